@@ -0,0 +1,383 @@
+"""
+Benchmarks for the calendar algebra, the .ics reader and the command
+pipelines.
+
+Every workload is generated from a seed (see bench/workloads.py), and the
+available and agenda commands run end to end against src.fake.FakeService,
+so no network or Google account is needed.  Results are written as JSON, one
+record per benchmark with its wall-clock times, throughput and peak traced
+memory, so runs on different commits can be compared:
+
+    python bench/run.py --output results.json
+    python bench/run.py --only union --calendars 50 --events 5000
+    python bench/run.py --only ics --ics-sizes 1K,1M,500M --repeat 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import arrow
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workloads  # noqa: E402
+from workloads import span  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = """[Settings]
+credentials_dir = {dir}
+timezone = US/Eastern
+start_work = 9:00 AM
+end_work = 5:00 PM
+
+[Weekend Days]
+monday = False
+tuesday = False
+wednesday = False
+thursday = False
+friday = False
+saturday = True
+sunday = True
+
+[Calendars]
+team = calendar-1@fake
+"""
+
+BENCHMARKS = []
+
+
+def benchmark(*names):
+    """
+    Registers a generator of the named cases, so that its workload is only
+    built when one of them is selected.
+    """
+
+    def register(fn):
+        BENCHMARKS.append((names, fn))
+        return fn
+
+    return register
+
+
+# Each benchmark generates its cases as (name, params, run, items): run() is
+# timed, and items (the number of events it handles) gives the throughput.
+
+
+@benchmark(
+    "union",
+    "intersection",
+    "union_pairwise",
+    "complement",
+    "available",
+    "bitset_raster",
+    "bitset_available",
+)
+def algebra(opts):
+    from src.bitset import BitsetInterval
+    from src.utils import Interval, events_complement
+
+    cals = workloads.random_intervals(
+        opts.calendars, opts.events, opts.years, opts.density, opts.overlap, opts.seed
+    )
+    params = {
+        "calendars": opts.calendars,
+        "events": opts.events,
+        "years": opts.years,
+        "density": opts.density,
+        "overlap": opts.overlap,
+    }
+    items = opts.calendars * opts.events
+    yield "union", params, lambda: Interval.union_all(cals), items
+    yield "intersection", params, lambda: Interval.intersect_all(cals), items
+    yield "union_pairwise", params, lambda: [
+        a | b for a, b in zip(cals, cals[1:])
+    ], items
+    yield "complement", params, lambda: [
+        events_complement(cal.start, cal.events, cal.end) for cal in cals
+    ], items
+    yield "available", params, lambda: ~Interval.union_all(cals[1:]) & cals[0], items
+    grid = workloads.on_grid(cals, BitsetInterval.quantum)
+    yield "bitset_raster", params, lambda: [
+        BitsetInterval.from_interval(cal) for cal in grid
+    ], items
+    bitsets = [BitsetInterval.from_interval(cal) for cal in grid]
+    yield "bitset_available", params, lambda: (
+        ~BitsetInterval.union_all(bitsets[1:]) & bitsets[0]
+    ).index(), items
+
+
+@benchmark("incremental_build", "incremental_update")
+def incremental(opts):
+    from src.incremental import Availability
+
+    cals = workloads.random_intervals(
+        opts.calendars, opts.events, opts.years, opts.density, opts.overlap, opts.seed
+    )
+    start, end = cals[0].start, cals[0].end
+    busy = dict(enumerate(cals[1:]))
+    free = {"free": cals[0]}
+    params = {
+        "calendars": opts.calendars,
+        "events": opts.events,
+        "years": opts.years,
+        "density": opts.density,
+        "overlap": opts.overlap,
+    }
+    yield "incremental_build", params, lambda: Availability(
+        start, end, busy, free
+    ), opts.calendars * opts.events
+    availability = Availability(start, end, busy, free)
+    moved = [(ev.s, ev.e) for ev in cals[1].events[:100]]
+
+    def update():
+        # move events of one calendar an hour later, and back again:
+        for s, e in moved:
+            availability.update(0, added=[(s + 3600, e + 3600)], removed=[(s, e)])
+        for s, e in moved:
+            availability.update(0, added=[(s, e)], removed=[(s + 3600, e + 3600)])
+
+    yield "incremental_update", params, update, 2 * len(moved)
+
+
+@benchmark("event_build", "event_sort", "event_format")
+def events(opts):
+    from src.utils import Event
+
+    start, end = span(opts.years)
+    spans = workloads.random_spans(opts.events, start, end, seed=opts.seed)
+    evs = [
+        Event(arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+        for s, e in spans
+    ]
+    params = {"events": opts.events}
+    yield "event_build", params, lambda: [
+        Event(arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+        for s, e in spans
+    ], len(spans)
+    yield "event_sort", params, lambda: sorted(evs, key=lambda ev: ev.end), len(evs)
+    yield "event_format", params, lambda: [ev.human_str() for ev in evs], len(evs)
+
+
+@benchmark("cal_daily_event", "cal_weekends", "cal_weekdays")
+def synthetic(opts):
+    from src.utils import cal_daily_event, cal_weekdays, cal_weekends
+
+    start, end = span(opts.synthetic_years)
+    params = {"years": opts.synthetic_years}
+    days = (end - start).days
+    yield "cal_daily_event", params, lambda: cal_daily_event(
+        start, end, 9, 0, 17, 0
+    ), days
+    yield "cal_weekends", params, lambda: cal_weekends(start, end), days
+    yield "cal_weekdays", params, lambda: cal_weekdays(start, end), days
+
+
+@benchmark("ics_parse_all", "ics_parse_month", "ics_parse_filtered")
+def ics(opts):
+    from src.filters import EventFilter
+    from src.ics import get_ics_calendar_events
+
+    def consume(path, start, end, event_filter=None):
+        return lambda: sum(
+            1 for _ in get_ics_calendar_events(path, start, end, event_filter)
+        )
+
+    for size in opts.ics_sizes.split(","):
+        path = os.path.join(opts.workdir, "bench-%s.ics" % size)
+        count = workloads.write_ics(
+            path, workloads.parse_size(size), years=5, seed=opts.seed
+        )
+        params = {"size": size, "bytes": os.path.getsize(path), "vevents": count}
+        start, end = span(5)
+        month = start.replace(years=+2)
+        yield "ics_parse_all", params, consume(path, start, end), count
+        yield "ics_parse_month", params, consume(
+            path, month, month.replace(months=+1)
+        ), count
+        # about one event in ten is kept, the rest rejected on the raw SUMMARY:
+        yield "ics_parse_filtered", params, consume(
+            path, start, end, EventFilter(match=r"number \d*7 ")
+        ), count
+
+
+@benchmark(
+    "available_e2e",
+    "available_expr_e2e",
+    "agenda_e2e",
+    "available_sharded_e2e",
+    "batch_e2e",
+)
+def pipelines(opts):
+    import src.credentials
+    from src.fake import FakeService
+
+    calendars = workloads.random_api_calendars(
+        opts.calendars, opts.events, opts.years, opts.density, opts.seed
+    )
+    service = FakeService(calendars, latency=opts.latency)
+    # the service has to be in place before gcal binds it as a default:
+    src.credentials.get_service = lambda: service
+    src.credentials.get_thread_service = lambda: service
+    import gcal
+
+    start, end = span(opts.years)
+    window = ["--no-cache", "--start", start.isoformat(), "--end", end.isoformat()]
+    busy = ["--busy-calendars"] + sorted(calendars)
+    params = {
+        "calendars": opts.calendars,
+        "events": opts.events,
+        "years": opts.years,
+        "latency": opts.latency,
+    }
+    items = opts.calendars * opts.events
+
+    def command(name, argv):
+        def run():
+            gcal.configure([name] + argv)
+            with contextlib.redirect_stdout(io.StringIO()):
+                getattr(gcal, name)()
+
+        return run
+
+    yield "available_e2e", params, command(
+        "available", window + busy + ["--free-calendars", "workhours"]
+    ), items
+    yield "available_expr_e2e", params, command(
+        "available", window + ["--expr", "~(primary | team) & workhours & weekday"]
+    ), items
+    yield "agenda_e2e", params, command("agenda", window + busy), items
+    # the same availability in 30 day shards, across opts.workers processes:
+    shard = ["--shard", "30d", "--workers", str(opts.workers)]
+    yield "available_sharded_e2e", dict(params, workers=opts.workers), command(
+        "available", window + busy + ["--free-calendars", "workhours"] + shard
+    ), items
+
+    # a job per calendar, evaluated across opts.workers processes:
+    jobs = os.path.join(opts.workdir, "jobs.jsonl")
+    with open(jobs, "w") as f:
+        for id in sorted(calendars):
+            job = {"id": id, "busy": [id], "free": ["workhours", "weekday"]}
+            f.write(json.dumps(job) + "\n")
+    batch = ["--jobs", jobs, "--output", os.devnull, "--workers", str(opts.workers)]
+    yield "batch_e2e", dict(params, workers=opts.workers), command(
+        "batch", window + batch
+    ), items
+
+
+def measure(run, repeat, memory):
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - began)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return times, peak
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calculendar benchmarks")
+    parser.add_argument("--only", default="", help="regex of benchmarks to run")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--calendars", type=int, default=10)
+    parser.add_argument("--events", type=int, default=2000, help="per calendar")
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--density", type=float, default=0.3)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--synthetic-years", type=int, default=10)
+    parser.add_argument("--ics-sizes", default="1K,1M,10M")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="fake API latency (seconds)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes for the batch benchmark",
+    )
+    opts = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # a settings.ini of its own, so results do not depend on the user's:
+        opts.workdir = workdir
+        with open(os.path.join(workdir, "settings.ini"), "w") as f:
+            f.write(SETTINGS.format(dir=workdir))
+        os.chdir(workdir)
+
+        for names, generate in BENCHMARKS:
+            if not any(re.search(opts.only, name) for name in names):
+                continue
+            for name, params, run, items in generate(opts):
+                if not re.search(opts.only, name):
+                    continue
+                times, peak = measure(run, opts.repeat, not opts.no_memory)
+                result = {
+                    "name": name,
+                    "params": params,
+                    "items": items,
+                    "best": min(times),
+                    "median": statistics.median(times),
+                    "items_per_second": items / min(times) if min(times) else None,
+                    "peak_bytes": peak,
+                }
+                results.append(result)
+                print(
+                    "%-20s %10.1f ms %14.0f items/s %s"
+                    % (
+                        name,
+                        1000 * result["best"],
+                        result["items_per_second"] or 0,
+                        json.dumps(params),
+                    ),
+                    file=sys.stderr,
+                )
+
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": arrow.utcnow().isoformat(),
+        "options": {k: v for k, v in vars(opts).items() if k != "workdir"},
+        "results": results,
+    }
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
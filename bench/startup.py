@@ -0,0 +1,76 @@
+"""
+Measures how long gcal.py takes to start.
+
+Runs a command (by default `gcal.py list`) several times in fresh
+interpreters and reports the best and median wall-clock times, then lists the
+slowest imports from `python -X importtime`.  Run it from the directory that
+holds your settings.ini:
+
+    python bench/startup.py
+    python bench/startup.py --runs 20 -- agenda --busy-calendars primary
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+GCAL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gcal.py"
+)
+BUDGET = 0.2  # seconds, for `gcal.py list`
+
+
+def time_runs(command, runs):
+    times = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def slowest_imports(command, count):
+    """
+    The (cumulative microseconds, module) of the slowest top-level imports.
+    """
+    result = subprocess.run(
+        [command[0], "-X", "importtime"] + command[1:],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("   "):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gcal.py startup time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("gcal_args", nargs="*", default=["list"])
+    args = parser.parse_args()
+
+    command = [sys.executable, GCAL] + args.gcal_args
+    times = time_runs(command, args.runs)
+    print("gcal.py %s:" % " ".join(args.gcal_args))
+    print("  best   %6.1f ms" % (1000 * min(times)))
+    print("  median %6.1f ms" % (1000 * statistics.median(times)))
+    if args.gcal_args == ["list"] and min(times) > BUDGET:
+        print("  over the %d ms budget!" % (1000 * BUDGET))
+
+    print("slowest imports (cumulative):")
+    for micros, name in slowest_imports(command, args.top):
+        print("  %6.1f ms  %s" % (micros / 1000.0, name))
+
+
+if __name__ == "__main__":
+    main()
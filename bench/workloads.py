@@ -0,0 +1,176 @@
+"""
+Seeded synthetic workloads for the benchmarks.
+
+Everything here is deterministic for a given seed, so runs on different
+commits measure the same work.
+"""
+import os
+import random
+import sys
+
+import arrow
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import Event, Interval, epoch, events_flatten  # noqa: E402
+
+ORIGIN = arrow.get("2020-01-01T00:00:00+00:00")
+
+
+def span(years):
+    return ORIGIN, ORIGIN.replace(years=+years)
+
+
+def random_spans(count, start, end, density=0.3, overlap=0.2, seed=0):
+    """
+    count (start, end) epoch pairs between start and end, sorted by start.
+
+    density is the fraction of the span the events would cover if they did
+    not overlap; overlap is the chance that an event starts inside the one
+    before it rather than at a random time.
+    """
+    rng = random.Random(seed)
+    lo, hi = epoch(start), epoch(end)
+    mean = max(60, int(density * (hi - lo) / max(count, 1)))
+    spans = []
+    for _ in range(count):
+        if spans and rng.random() < overlap:
+            prev_start, prev_end = spans[-1]
+            ev_start = rng.randrange(prev_start, prev_end)
+        else:
+            ev_start = rng.randrange(lo, hi)
+        length = 60 * max(1, int(rng.expovariate(60.0 / mean)))
+        spans.append((ev_start, min(ev_start + length, hi)))
+    spans.sort()
+    return spans
+
+
+def random_interval(count, start, end, density=0.3, overlap=0.2, seed=0):
+    """
+    A flattened Interval of count random events.
+    """
+    events = [
+        Event(arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+        for s, e in random_spans(count, start, end, density, overlap, seed)
+    ]
+    return Interval(start, events_flatten(events), end)
+
+
+def random_intervals(calendars, events, years=1, density=0.3, overlap=0.2, seed=0):
+    """
+    calendars random Intervals of events events each, over years years.
+    """
+    start, end = span(years)
+    return [
+        random_interval(events, start, end, density, overlap, seed + n)
+        for n in range(calendars)
+    ]
+
+
+def on_grid(intervals, quantum):
+    """
+    The intervals with their events rounded out to multiples of quantum
+    seconds, so that the bitset backend computes the same availability as
+    the others.
+    """
+    return [
+        Interval(
+            cal.start,
+            events_flatten(
+                [
+                    Event(ev.s - ev.s % quantum, ev.e - ev.e % -quantum)
+                    for ev in cal.events
+                ]
+            ),
+            cal.end,
+        )
+        for cal in intervals
+    ]
+
+
+def random_api_calendars(calendars, events, years=1, density=0.3, seed=0):
+    """
+    Calendars in the shape src.fake.FakeService serves, keyed by id.
+    """
+    start, end = span(years)
+    result = {}
+    for n in range(calendars):
+        evs = []
+        spans = random_spans(events, start, end, density, 0.2, seed + n)
+        for i, (s, e) in enumerate(spans):
+            ev_start = arrow.Arrow.utcfromtimestamp(s).isoformat()
+            ev_end = arrow.Arrow.utcfromtimestamp(e).isoformat()
+            evs.append(
+                {
+                    "id": "%d-%d" % (n, i),
+                    "summary": "event %d" % i,
+                    "start": {"dateTime": ev_start},
+                    "end": {"dateTime": ev_end},
+                }
+            )
+        id = "primary" if n == 0 else "calendar-%d@fake" % n
+        result[id] = {"summary": "calendar %d" % n, "events": evs}
+    return result
+
+
+def vevent(rng, i, years):
+    """
+    One VEVENT, as text: mostly UTC times, with some all-day, TZID and
+    weekly recurring events mixed in.
+    """
+    year = ORIGIN.year + rng.randrange(years)
+    month, day, hour = rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 22)
+    date = "%04d%02d%02d" % (year, month, day)
+    lines = [
+        "BEGIN:VEVENT",
+        "UID:%d@bench" % i,
+        "SUMMARY:Synthetic event number %d with a summary long enough to be fol" % i,
+        " ded onto a second line",
+    ]
+    kind = i % 20
+    if kind == 0:
+        lines.append("DTSTART;VALUE=DATE:" + date)
+    elif kind in (1, 2):
+        lines.append("DTSTART;TZID=Europe/Berlin:%sT%02d0000" % (date, hour))
+        lines.append("DTEND;TZID=Europe/Berlin:%sT%02d3000" % (date, hour))
+    else:
+        lines.append("DTSTART:%sT%02d0000Z" % (date, hour))
+        lines.append("DTEND:%sT%02d4500Z" % (date, hour))
+    if kind == 3:
+        lines.append("RRULE:FREQ=WEEKLY;COUNT=%d" % rng.randint(2, 50))
+    lines.append("END:VEVENT")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def write_ics(path, size, years=5, seed=0):
+    """
+    Writes a synthetic .ics file of about size bytes, and returns the number
+    of VEVENTs in it.
+    """
+    rng = random.Random(seed)
+    written = 0
+    count = 0
+    with open(path, "w", newline="") as f:
+        header = (
+            "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//calculendar//bench//EN\r\n"
+        )
+        f.write(header)
+        written += len(header)
+        while written < size:
+            text = vevent(rng, count, years)
+            f.write(text)
+            written += len(text)
+            count += 1
+        f.write("END:VCALENDAR\r\n")
+    return count
+
+
+def parse_size(text):
+    """
+    A size like 500, 1K, 20M or 1G, in bytes.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
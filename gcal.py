@@ -6,32 +6,47 @@ from __future__ import print_function
 
 # For command-line arguments
 import argparse
+import json
+import os
+import sys
+import time
 
 # Module functions
 import src.credentials
 from src.utils import *
 from src.utils import safe_input as input
-from src.ics import get_ics_calendar_events
+from src.expr import compile_expr
+from src.filters import EventFilter, counts_as_busy
+from src.freebusy import query_freebusy
+from src.agenda import iter_pages, merge_streams
+from src.batching import MAX_BATCH, Batcher
+from src import timings
+from src.output import FORMATS, Writer, local_times, write_interval
+from src.slots import parse_duration
+from src.tz import DAY, get_zone, parse_epoch
 
-
-# Dates to access the next month.
-NOW_DATE = arrow.utcnow().date()
-NOW = arrow.utcnow()  # right now
-IN30 = NOW.replace(days=+30)  # in 30 days
-
-start_work = arrow.get(settings.START_WORK, "H:mm A").replace(tzinfo=settings.TIMEZONE)
-end_work = arrow.get(settings.END_WORK, "H:mm A").replace(tzinfo=settings.TIMEZONE)
+# Importing this module has no side effects: the command line is parsed, and
+# settings, credentials and the cache are loaded, by configure() and the
+# commands that need them.  Modules that are slow to import (src.ics,
+# src.snapshot, src.cache, src.server, src.batch, src.incremental) are imported
+# where they are used.
 
 # Parse arguments
 parser = argparse.ArgumentParser()
-parser.add_argument("command", help="list | agenda | available | import")
-parser.add_argument("--start", default=NOW, help="start of timespan")
-parser.add_argument("--end", default=IN30, help="end of timespan")
 parser.add_argument(
-    "--query-timezone", default=settings.TIMEZONE, help="timezone to use for output"
+    "command",
+    help="list | agenda | available | find-slots | batch | watch | import "
+    "| cache-stats | serve",
 )
+parser.add_argument("--start", help="start of timespan (default: now)")
+parser.add_argument("--end", help="end of timespan (default: in 30 days)")
+parser.add_argument("--query-timezone", help="timezone to use for output")
+parser.add_argument("--output-timezone", help="timezone to use for output")
 parser.add_argument(
-    "--output-timezone", default=settings.TIMEZONE, help="timezone to use for output"
+    "--format",
+    default="text",
+    choices=FORMATS,
+    help="output format for available and agenda",
 )
 
 parser.add_argument(
@@ -48,85 +63,531 @@ parser.add_argument(
     nargs="+",
     help="calendar ids to use for free information",
 )
+parser.add_argument(
+    "--expr",
+    metavar="expression",
+    help="availability as an expression over calendars, e.g. "
+    '"~(primary | out_of_town) & workhours & weekday"',
+)
 parser.add_argument(
     "-i", "--input", default=[], nargs="+", help="paths to .ics calendars to import"
 )
 parser.add_argument("-a", "--all", action="store_true")
-args = parser.parse_args()
-QUERY_TIMEZONE = args.query_timezone or args.output_timezone
-START = arrow.get(args.start)
-END = arrow.get(args.end)
-BUSY = get_calendars_from_imported(args.busy_calendars)
-FREE = get_calendars_from_imported(args.free_calendars)
-INPUT = args.input
+parser.add_argument(
+    "--backend",
+    default="list",
+    choices=["list", "numpy", "bitset"],
+    help="interval representation to compute availability with",
+)
+parser.add_argument(
+    "--quantum",
+    metavar="DURATION",
+    default="15m",
+    help="slot length for --backend bitset; availability is rounded in to it",
+)
+parser.add_argument(
+    "--exact-grid",
+    action="store_true",
+    help="with --backend bitset, make times off the --quantum grid an error "
+    "rather than rounding availability in to it",
+)
+parser.add_argument(
+    "--no-cache", action="store_true", help="bypass the on-disk cache of API results"
+)
+parser.add_argument(
+    "--cache-ttl",
+    type=int,
+    help="seconds before cached API results are refreshed",
+)
+parser.add_argument(
+    "--duration", default="30m", help="length of the slots to find, e.g. 30m or 1h"
+)
+parser.add_argument("--count", type=int, default=3, help="number of slots to find")
+parser.add_argument(
+    "--gap", default="0m", help="minimum time between consecutive slots found"
+)
+parser.add_argument(
+    "--buffer",
+    default="0m",
+    help="free time to leave between each slot and the busy times around it",
+)
+parser.add_argument(
+    "--align", default="0m", help="start slots on multiples of this, e.g. 15m"
+)
+parser.add_argument(
+    "--jobs",
+    metavar="FILE",
+    default="-",
+    help="JSONL file of jobs for the batch command (default: stdin)",
+)
+parser.add_argument(
+    "--output",
+    metavar="FILE",
+    default="-",
+    help="file to write batch results to (default: stdout)",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    help="processes to evaluate batch jobs or shards with (default: one per core)",
+)
+parser.add_argument(
+    "--shard",
+    metavar="DURATION",
+    help="evaluate availability in slices of this length, e.g. 30d, "
+    "across worker processes",
+)
+parser.add_argument(
+    "--match", metavar="REGEX", help="only count events whose summary matches"
+)
+parser.add_argument(
+    "--ignore",
+    metavar="REGEX",
+    nargs="+",
+    default=[],
+    help="ignore events whose summary matches, e.g. OOO-optional",
+)
+parser.add_argument(
+    "--search",
+    metavar="TERMS",
+    help="only count events matching free text search terms (searched by the API)",
+)
+parser.add_argument(
+    "--min-duration",
+    metavar="DURATION",
+    default="0m",
+    help="ignore events shorter than this, e.g. 10m",
+)
+parser.add_argument(
+    "--ignore-status",
+    metavar="STATUS",
+    nargs="+",
+    default=[],
+    help="ignore events with this status or response, e.g. tentative declined",
+)
+parser.add_argument(
+    "--ignore-transparent",
+    action="store_true",
+    help="ignore events marked as free",
+)
+parser.add_argument(
+    "--filter-calendars",
+    metavar="calendar-id",
+    nargs="+",
+    help="apply the event filters only to these calendars (default: all)",
+)
+parser.add_argument(
+    "--poll",
+    type=float,
+    default=60,
+    help="seconds between checks for changes in the watch command",
+)
+parser.add_argument("--host", help="address for the serve command")
+parser.add_argument("--port", type=int, help="port for the serve command")
+parser.add_argument(
+    "--timings",
+    metavar="FILE",
+    nargs="?",
+    const="-",
+    help="record time spent per phase, and write it as JSON to FILE "
+    "(or as a table to stderr)",
+)
+parser.add_argument(
+    "--profile", metavar="FILE", help="run under cProfile and dump its stats to FILE"
+)
+
+args = None
+QUERY_TIMEZONE = OUTPUT_TIMEZONE = START = END = None
+BUSY = FREE = INPUT = []
+BackendInterval = Interval
+cache = None
+BATCH_TABLE = None  # the busy times batch jobs are evaluated against
+EVENT_FILTER = None  # which events count (an EventFilter, false if all do)
+
+
+def configure(argv=None):
+    """
+    Parses the command line, and sets up the globals the commands use.
+    """
+    global args, QUERY_TIMEZONE, OUTPUT_TIMEZONE, START, END, BUSY, FREE, INPUT
+    global BackendInterval, cache, EVENT_FILTER
+    args = parser.parse_args(argv)
+    if args.expr:
+        try:
+            compile_expr(args.expr, CALENDAR_ALIASES)
+        except SyntaxError as error:
+            parser.error("invalid --expr: %s" % error)
+    if args.timings:
+        timings.enable()
+    now = arrow.utcnow()
+    QUERY_TIMEZONE = args.query_timezone or args.output_timezone or settings.TIMEZONE
+    OUTPUT_TIMEZONE = args.output_timezone or settings.TIMEZONE
+    START = arrow.get(args.start) if args.start else now
+    END = arrow.get(args.end) if args.end else now.replace(days=+30)
+    BUSY = get_calendars_from_imported(args.busy_calendars)
+    FREE = get_calendars_from_imported(args.free_calendars)
+    INPUT = args.input
+    if args.cache_ttl is None:
+        args.cache_ttl = settings.CACHE_TTL
+
+    BackendInterval = backend_class(args.backend, args.quantum, args.exact_grid)
+    # "primary" is a calendar to filter too, and no calendars are not all:
+    filter_calendars = args.filter_calendars
+    if filter_calendars is not None:
+        filter_calendars = [
+            settings.get_imported_calendar_by_name(c) for c in filter_calendars
+        ]
+    EVENT_FILTER = EventFilter(
+        match=args.match,
+        ignore=args.ignore,
+        search=args.search,
+        min_duration=parse_duration(args.min_duration),
+        statuses=args.ignore_status,
+        transparent=args.ignore_transparent,
+        calendars=filter_calendars,
+    )
+
+    cache = None
+    if not args.no_cache and args.command.lower() != "list":
+        from src.cache import Cache
+
+        cache = Cache(settings.CACHE_PATH, args.cache_ttl, settings.CACHE_MAX_BYTES)
+
+
+def backend_class(backend, quantum, exact=False):
+    """
+    The interval class to compute availability with.
+    """
+    if backend == "numpy":
+        from src.vector import ArrayInterval
 
-gcal_service = src.credentials.get_service()
+        return ArrayInterval
+    if backend == "bitset":
+        from src.bitset import with_quantum
+
+        return with_quantum(parse_duration(quantum), exact)
+    return Interval
+
+
+def calendar_filter(calendarId):
+    """
+    The EventFilter for a calendar's events, or None if they all count.
+    """
+    if EVENT_FILTER and EVENT_FILTER.applies(calendarId):
+        return EVENT_FILTER
+    return None
+
+
+def window(start, end):
+    """
+    The given time span, defaulting to the one on the command line.
+    """
+    return (START if start is None else start, END if end is None else end)
+
+
+def execute(request, batcher=None):
+    """
+    Executes an API request, batched with others if a Batcher is given.
+    """
+    return batcher.execute(request) if batcher else request.execute()
 
 
 # Get the next several events:
-def get_calendar_events(calendarId="primary", maxResults=10):
+def get_calendar_events(
+    calendarId="primary", maxResults=10, start=None, end=None, batcher=None
+):
+    start, end = window(start, end)
     if ".ics" in calendarId:
-        return get_ics_calendar_events(calendarId)
+        from src.ics import get_ics_calendar_events
+
+        return get_ics_calendar_events(calendarId, start, end, tz=QUERY_TIMEZONE)
+    elif cache:
+        # the events of the window (and a span after it) are kept in sync in
+        # the cache:
+        def list_events(**params):
+            with timings.phase("api.events.list") as p:
+                page = execute(
+                    src.credentials.get_thread_service()
+                    .events()
+                    .list(calendarId=calendarId, singleEvents=True, **params),
+                    batcher,
+                )
+                p.count(len(page.get("items", [])))
+            return page
+
+        events = [
+            event
+            for event in cache.events(calendarId, start, end, list_events)
+            if event_time(event["end"]) > start
+        ]
+        events.sort(key=lambda event: event_time(event["start"]))
+        return events[:maxResults] if maxResults else events
     else:
-        events_result = (
-            gcal_service.events()
-            .list(
-                calendarId=calendarId,
-                timeMin=START.isoformat(),
-                maxResults=maxResults,
-                singleEvents=True,
-                orderBy="startTime",
+        with timings.phase("api.events.list") as p:
+            events_result = execute(
+                src.credentials.get_thread_service()
+                .events()
+                .list(
+                    calendarId=calendarId,
+                    timeMin=start.isoformat(),
+                    maxResults=maxResults,
+                    singleEvents=True,
+                    orderBy="startTime",
+                ),
+                batcher,
             )
-            .execute()
-        )
+            p.count(len(events_result.get("items", [])))
         return events_result.get("items", [])
 
 
+def event_time(time):
+    """
+    The start or end of an API event, which is a date for all-day events.
+    """
+    return arrow.get(time.get("dateTime", time.get("date")))
+
+
+def event_epoch(time, tz="UTC"):
+    """
+    The start or end of an API event, as epoch seconds; an all-day event's
+    date starts at midnight in timezone tz.
+    """
+    if "dateTime" in time:
+        return parse_epoch(time["dateTime"])
+    day = epoch(time["date"]) // DAY
+    return get_zone(tz).utc(day * DAY)
+
+
+def get_busy_times(
+    calendarIds,
+    timeZone=None,
+    start=None,
+    end=None,
+    get_service=src.credentials.get_thread_service,
+):
+    """
+    The busy times of remote calendars, as (start, end) epoch seconds pairs
+    ordered by start, from the cache or freebusy queries (or, for calendars
+    whose events are filtered, from the events themselves).
+    """
+    start, end = window(start, end)
+    timeZone = timeZone or QUERY_TIMEZONE
+
+    def fetch(ids, window_start, window_end):
+        return query_freebusy(get_service, ids, window_start, window_end, timeZone)
+
+    filtered = [id for id in calendarIds if calendar_filter(id)]
+    calendarIds = [id for id in calendarIds if not calendar_filter(id)]
+    if cache:
+        busy = cache.freebusy(calendarIds, start, end, fetch)
+    else:
+        busy = fetch(calendarIds, start, end)
+    if filtered:
+        busy.update(filtered_busy_times(filtered, start, end, timeZone))
+    return busy
+
+
+def filtered_busy_times(calendarIds, start, end, timeZone="UTC"):
+    """
+    The busy times of remote calendars, as get_busy_times gives them, from
+    the busy events that their filter keeps (all-day events in timeZone).
+    The calendars' events are listed concurrently, in batch requests.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    batcher = Batcher(src.credentials.get_thread_service)
+    lo, hi = epoch(start), epoch(end)
+
+    def busy_times(calendarId):
+        times = []
+        for event in iter_calendar_events(calendarId, start, end, batcher):
+            if not counts_as_busy(event):
+                continue
+            ev_start = event_epoch(event["start"], timeZone)
+            ev_end = event_epoch(event.get("end", event["start"]), timeZone)
+            times.append((max(ev_start, lo), min(ev_end, hi)))
+        merged = []
+        for ev_start, ev_end in sorted(times):
+            if merged and ev_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], ev_end))
+            elif ev_start < ev_end:
+                merged.append((ev_start, ev_end))
+        return merged
+
+    with timings.phase("filter.events") as p:
+        with ThreadPoolExecutor(min(len(calendarIds), MAX_BATCH)) as pool:
+            busy = dict(zip(calendarIds, pool.map(busy_times, calendarIds)))
+        p.count(sum(len(times) for times in busy.values()))
+    return busy
+
+
 # Returns a dict containing a cal_interval for each requested calendar:
 def get_freebusy(
-    calendarIds=["primary"], timeZone=QUERY_TIMEZONE, start=START, end=END
+    calendarIds=["primary"],
+    timeZone=None,
+    start=None,
+    end=None,
+    get_service=src.credentials.get_thread_service,
 ):
-    fb_q = {
-        "timeMin": start.isoformat(),
-        "timeMax": end.isoformat(),
-        "timeZone": timeZone,
-        "items": [{"id": id} for id in calendarIds],
-    }
-    freebusy_result = gcal_service.freebusy().query(body=fb_q).execute()
-    cals = freebusy_result["calendars"]
+    start, end = window(start, end)
+    timeZone = timeZone or QUERY_TIMEZONE
+    # .ics calendars are read locally rather than queried:
+    remote = [id for id in calendarIds if ".ics" not in id]
+    busy = get_busy_times(remote, timeZone, start, end, get_service)
     cal_index = {}
-    for id, times in cals.items():
-        busy_times = times["busy"]
-        revs = []  # events in reverse order
-        for t in busy_times:
-            ev_start = arrow.get(t["start"])
-            ev_end = arrow.get(t["end"])
-            ev = Event(ev_start, ev_end)
-            # accumulate events in reverse order:
-            revs = [ev] + revs
-        cal_index[id] = Interval(start, revs[::-1], end)
+    for id in calendarIds:
+        if ".ics" in id and cache and not calendar_filter(id):
+            from src.snapshot import get_snapshot_interval
+
+            cal_index[id] = get_snapshot_interval(
+                id, start, end, BackendInterval, timeZone
+            )
+        elif ".ics" in id:
+            from src.ics import get_ics_interval
+
+            cal_index[id] = get_ics_interval(
+                id, start, end, calendar_filter(id), timeZone
+            )
+            if BackendInterval is not Interval:
+                cal_index[id] = BackendInterval.from_interval(cal_index[id])
+    with timings.phase("freebusy.build") as p:
+        for id, busy_times in busy.items():
+            p.count(len(busy_times))
+            cal_index[id] = busy_interval(busy_times, start, end)
     return cal_index
 
 
-# check to see if the calendar is synthetic;
-# if synthentic, will be computed against query timezone.
+def busy_interval(busy_times, start, end):
+    """
+    A calendar's busy times, as (start, end) epoch seconds pairs, as an
+    Interval.
+    """
+    if BackendInterval is not Interval:
+        # array backends skip building Event objects altogether:
+        return BackendInterval.from_arrays(
+            start,
+            [ev_start for ev_start, ev_end in busy_times],
+            [ev_end for ev_start, ev_end in busy_times],
+            end,
+        )
+    # busy times from adjacent time windows are merged:
+    evs = [Event(ev_start, ev_end) for ev_start, ev_end in busy_times]
+    return Interval(start, events_flatten(evs), end)
+
+
+# Synthetic calendars that are defined in terms of others:
+CALENDAR_ALIASES = {
+    "weekday": "~weekend",
+    "weekdays": "~weekend",
+    "weekends": "weekend",
+}
+SYNTHETIC_CALENDARS = ["weekend", "weekday", "workhours"]
+
+
+def expr_calendars(plan):
+    """
+    The remote calendars in a compiled expression, as a dict from the names
+    used in it to calendar ids.
+    """
+    return {
+        cal: settings.get_imported_calendar_by_name(cal)
+        for cal in plan.calendars
+        if not synthetic_calendar(cal)
+    }
+
+
+def in_window(interval, start, end, buffer=0):
+    """
+    A calendar between start and end, with each of its busy times widened
+    by buffer seconds on either side.
+    """
+    if not buffer and (interval.start, interval.end) == (start, end):
+        return interval
+    starts, ends = [], []
+    for s, e in zip(*interval.index()):
+        s, e = int(s) - buffer, int(e) + buffer
+        if starts and s <= ends[-1]:
+            ends[-1] = max(ends[-1], e)
+        else:
+            starts.append(s)
+            ends.append(e)
+    return interval_between(starts, ends, start, end, BackendInterval)
+
+
+def evaluate_expr(text, start=None, end=None, cal_index=None, buffer=0):
+    """
+    Computes a calendar expression, fetching every remote calendar it
+    needs with a single freebusy query (unless they are all in cal_index).
+    The busy times of the calendars it complements are widened by buffer
+    seconds on either side.
+    """
+    start, end = window(start, end)
+    plan = compile_expr(text, CALENDAR_ALIASES)
+    remote = expr_calendars(plan)
+    calidx = {} if cal_index is None else cal_index
+
+    def lookup(cal):
+        if synthetic_calendar(cal):
+            return get_cal(calidx, cal, start, end)
+        if remote[cal] not in calidx:
+            # (with the busy times just outside the window, for buffers)
+            calidx.update(
+                get_freebusy(
+                    calendarIds=sorted(set(remote.values())),
+                    start=start.shift(seconds=-buffer),
+                    end=end.shift(seconds=+buffer),
+                )
+            )
+        widen = buffer if cal in plan.busy_calendars else 0
+        return in_window(calidx[remote[cal]], start, end, widen)
+
+    return plan.evaluate(lookup, BackendInterval)
+
 
-# TODO: Add support for synthetic calendars in other timezones.
+def synthetic_calendar(cal):
+    """
+    The name and timezone of a synthetic calendar, such as workhours or
+    workhours@Europe/Berlin (None for the settings timezone), or None if
+    cal is not synthetic.
+    """
+    name, _, tz = cal.partition("@")
+    if name.lower() not in SYNTHETIC_CALENDARS:
+        return None
+    if tz:
+        try:
+            get_zone(tz)
+        except ValueError:
+            return None  # a real calendar id, like weekend@example.com
+    return name.lower(), tz or None
 
 
-def get_cal(cal_index, cal_id):
-    if cal_id == "weekend":
-        return cal_weekends(START, END)
-    if cal_id == "weekday":
-        return ~cal_weekends(START, END)
-    if cal_id == "workhours":
+def work_hours():
+    """
+    The start and end of the working day, from the settings.
+    """
+    return [
+        arrow.get(time, "H:mm A").replace(tzinfo=settings.TIMEZONE)
+        for time in (settings.START_WORK, settings.END_WORK)
+    ]
+
+
+def get_cal(cal_index, cal_id, start=None, end=None):
+    start, end = window(start, end)
+    name, tz = synthetic_calendar(cal_id) or (None, None)
+    if name == "weekend":
+        return cal_weekends(start, end, tz)
+    if name == "weekday":
+        return cal_weekdays(start, end, tz)
+    if name == "workhours":
+        start_work, end_work = work_hours()
         return cal_daily_event(
-            START,
-            END,
+            start,
+            end,
             start_work.hour,
             start_work.minute,
             end_work.hour,
             end_work.minute,
+            tz,
         )
     else:
         return cal_index[cal_id]
@@ -138,7 +599,9 @@ def list_cals():
     else:
         imported = settings.list_imported_calendars()
         imported_names = [cal[0] for cal in imported]
-        cals_result = gcal_service.calendarList().list().execute()
+        with timings.phase("api.calendarList"):
+            service = src.credentials.get_service()
+            cals_result = service.calendarList().list().execute()
         cals = cals_result.get("items", [])
         for cal in cals:
             if cal["summary"].lower() not in imported_names:
@@ -151,32 +614,512 @@ def list_cals():
                 settings.set_calendar(cal["summary"], cal["id"])
 
 
+# All the events of a calendar between start and end, ordered by start time
+# (just those that its filter keeps, if it has one):
+def iter_calendar_events(calendarId, start=None, end=None, batcher=None):
+    start, end = window(start, end)
+    event_filter = calendar_filter(calendarId)
+    if ".ics" in calendarId:
+        from src.ics import get_ics_calendar_events
+
+        with timings.phase("ics.parse") as p:
+            events = get_ics_calendar_events(
+                calendarId, start, end, event_filter, QUERY_TIMEZONE
+            )
+            events = sorted(events, key=lambda event: event_time(event["start"]))
+            p.count(len(events))
+        return iter(events)
+    elif cache and not (event_filter and event_filter.terms):
+
+        def cached_events():
+            # fetched (or synced) on the thread that consumes them:
+            for event in get_calendar_events(calendarId, None, start, end, batcher):
+                if event_time(event["start"]) < end and (
+                    event_filter is None or event_filter.matches(event)
+                ):
+                    yield event
+
+        return cached_events()
+    else:
+        # search terms can only be applied by the API, so calendars searched
+        # in are listed rather than synced into the cache:
+        query = event_filter.query() if event_filter else {}
+
+        def list_page(token):
+            with timings.phase("api.events.list") as p:
+                page = execute(
+                    src.credentials.get_thread_service()
+                    .events()
+                    .list(
+                        calendarId=calendarId,
+                        timeMin=start.isoformat(),
+                        timeMax=end.isoformat(),
+                        maxResults=250,
+                        pageToken=token,
+                        singleEvents=True,
+                        orderBy="startTime",
+                        **query
+                    ),
+                    batcher,
+                )
+                p.count(len(page.get("items", [])))
+            return page
+
+        if event_filter is None:
+            return iter_pages(list_page)
+        return (event for event in iter_pages(list_page) if event_filter.matches(event))
+
+
+def agenda_events(calendars, start=None, end=None):
+    """
+    The events of several calendars, fetched concurrently and generated in
+    order as soon as they are known to come next.  The calendars' requests
+    are sent together, in batch requests.
+    """
+    start, end = window(start, end)
+    batcher = Batcher(src.credentials.get_thread_service)
+    return merge_streams(
+        [iter_calendar_events(cal, start, end, batcher) for cal in calendars],
+        key=lambda event: event_time(event["start"]),
+    )
+
+
+def agenda_time(time):
+    """
+    The start or end of an API event, as epoch seconds, or a date for
+    all-day events.
+    """
+    if "dateTime" in time:
+        return epoch(arrow.get(time["dateTime"]))
+    return arrow.get(time["date"]).date()
+
+
 def agenda():
-    events = []
-    for cal in BUSY:
-        cal_events = get_calendar_events(calendarId=cal)
-        events += cal_events
-    if not events:
-        print("No upcoming events found.")
+    events = agenda_events(BUSY)
+    if args.format != "text":
+        # stream each event as soon as it is known:
+        writer = Writer(sys.stdout, args.format, OUTPUT_TIMEZONE, flush_every=1)
+        for event in events:
+            end = event.get("end", event["start"])
+            writer.write(
+                agenda_time(event["start"]),
+                agenda_time(end),
+                event.get("summary", ""),
+            )
+        writer.close()
+        return
+    found = False
     for event in events:
-        start = event["start"].get("dateTime", event["start"].get("date"))
-        a_start = arrow.get(start).format("YYYY-MM-DD h:mm A")
-        # print(event)
-        print(a_start, event["summary"])
+        found = True
+        start = agenda_time(event["start"])
+        if isinstance(start, int):
+            a_start = arrow.Arrow.utcfromtimestamp(start).to(OUTPUT_TIMEZONE)
+        else:
+            a_start = arrow.get(start)  # an all-day event's date
+        print(a_start.format("YYYY-MM-DD h:mm A"), event["summary"], flush=True)
+    if not found:
+        print("No upcoming events found.")
+
+
+def compute_available(
+    busy, free, expr=None, start=None, end=None, cal_index=None, buffer=0
+):
+    """
+    The availability Interval, from either an expression or lists of busy
+    and free calendars.  Remote calendars are fetched, unless cal_index
+    already has them.  Busy times are widened by buffer seconds on either
+    side, so that the time available keeps that far from them.
+    """
+    start, end = window(start, end)
+    if expr:
+        return evaluate_expr(expr, start, end, cal_index, buffer)
+    calidx = cal_index
+    if calidx is None:
+        # (with the busy times just outside the window, for buffers)
+        calidx = get_freebusy(
+            calendarIds=[c for c in busy + free if not synthetic_calendar(c)],
+            start=start.shift(seconds=-buffer),
+            end=end.shift(seconds=+buffer),
+        )
+
+    def calendar(c, widen=0):
+        if synthetic_calendar(c):
+            return get_cal(calidx, c, start, end)
+        return in_window(calidx[c], start, end, widen)
+
+    # busy in any of the busy calendars, free in all of the free calendars:
+    my_busy = BackendInterval.union_all(
+        [BackendInterval(start, [], end)] + [calendar(c, buffer) for c in busy]
+    )
+    my_free = BackendInterval.intersect_all(
+        [BackendInterval(start, [Event(start, end)], end)] + [calendar(c) for c in free]
+    )
+    return ~my_busy & my_free
 
 
 def available():
-    calidx = get_freebusy(calendarIds=BUSY)
-    my_busy = Interval(START, [], END)
-    my_free = Interval(START, [Event(START, END)], END)
-    for cal_id in BUSY:
-        my_busy = my_busy | get_cal(calidx, cal_id)
-    for cal_id in FREE:
-        my_free = my_free & get_cal(calidx, cal_id)
-    available = ~my_busy & my_free
+    if args.shard:
+        return available_sharded()
+    available = compute_available(BUSY, FREE, args.expr)
     # print out availability:
-    for ev in available.events:
-        print(ev.human_str())
+    with timings.phase("output") as p:
+        p.count(write_interval(available, sys.stdout, args.format, OUTPUT_TIMEZONE))
+
+
+def find_slots():
+    from src import slots
+
+    buffer = slots.parse_duration(args.buffer)
+
+    def available_between(start, end):
+        # buffers are kept around busy times, not the edges of the window
+        # or of free calendars such as workhours:
+        return compute_available(BUSY, FREE, args.expr, start, end, buffer=buffer)
+
+    found = slots.find_slots(
+        slots.free_segments(available_between, START, END),
+        slots.parse_duration(args.duration),
+        args.count,
+        gap=slots.parse_duration(args.gap),
+        align=slots.parse_duration(args.align),
+    )
+    with timings.phase("output") as p:
+        writer = Writer(sys.stdout, args.format, OUTPUT_TIMEZONE)
+        for start, end in found:
+            writer.write(start, end)
+        p.count(writer.close())
+
+
+def batch_job(job):
+    """
+    A job from the job file, with its calendar names resolved to ids, its
+    window in epoch seconds, and the remote calendars it needs; or just its
+    id and an error, if it is not valid.
+    """
+    try:
+        start = arrow.get(job["start"]) if "start" in job else START
+        end = arrow.get(job["end"]) if "end" in job else END
+        expr = job.get("expr")
+        busy = get_calendars_from_imported(job.get("busy", [] if expr else BUSY))
+        free = get_calendars_from_imported(job.get("free", [] if expr else FREE))
+        if expr:
+            calendars = expr_calendars(compile_expr(expr, CALENDAR_ALIASES)).values()
+        else:
+            calendars = [c for c in busy + free if not synthetic_calendar(c)]
+        timezone = job.get("timezone", OUTPUT_TIMEZONE)
+        get_zone(timezone)
+    except (ValueError, TypeError, SyntaxError, arrow.parser.ParserError) as error:
+        return {"id": str(job["id"]), "error": str(error)}
+    return {
+        "id": str(job["id"]),
+        "expr": expr,
+        "busy": busy,
+        "free": free,
+        "start": epoch(start),
+        "end": epoch(end),
+        "calendars": sorted(set(calendars)),
+        "timezone": timezone,
+    }
+
+
+def init_batch_worker(table, backend, quantum, exact):
+    global BATCH_TABLE, BackendInterval
+    BATCH_TABLE = table
+    BackendInterval = backend_class(backend, quantum, exact)
+
+
+def evaluate_batch_job(job):
+    """
+    Computes the availability for a batch job, in a worker, as its id and
+    the (starts, ends) arrays of the free times, or its id and an error.
+    """
+    from src.batch import pack
+
+    if "error" in job:
+        return job["id"], None, job["error"]
+    start = arrow.Arrow.utcfromtimestamp(job["start"])
+    end = arrow.Arrow.utcfromtimestamp(job["end"])
+    cal_index = {
+        id: BATCH_TABLE.interval(id, start, end, BackendInterval)
+        for id in job["calendars"]
+    }
+    try:
+        available = compute_available(
+            job["busy"], job["free"], job["expr"], start, end, cal_index
+        )
+    except (ValueError, KeyError, SyntaxError) as error:
+        return job["id"], None, str(error)
+    return job["id"], pack(available), None
+
+
+def busy_table(calendars, start, end):
+    """
+    The busy times of calendars between start and end, as a BusyTable for
+    worker processes.
+    """
+    from src.batch import BusyTable
+
+    table = BusyTable()
+    remote = [id for id in calendars if ".ics" not in id]
+    local = [id for id in calendars if ".ics" in id]
+    for id, times in get_busy_times(remote, start=start, end=end).items():
+        table.add_times(id, times)
+    if local:
+        cal_index = get_freebusy(calendarIds=local, start=start, end=end)
+        for id in local:
+            table.add(id, cal_index[id])
+    return table
+
+
+def batch():
+    from src.batch import BusyTable, read_jobs, run
+
+    if args.jobs == "-":
+        jobs = [batch_job(job) for job in read_jobs(sys.stdin)]
+    else:
+        with open(args.jobs) as f:
+            jobs = [batch_job(job) for job in read_jobs(f)]
+    valid = [job for job in jobs if "error" not in job]
+
+    # every remote calendar is fetched just once, over the span of all jobs:
+    table = BusyTable()
+    calendars = sorted(set(id for job in valid for id in job["calendars"]))
+    if calendars:
+        with timings.phase("batch.fetch") as p:
+            start = arrow.Arrow.utcfromtimestamp(min(job["start"] for job in valid))
+            end = arrow.Arrow.utcfromtimestamp(max(job["end"] for job in valid))
+            table = busy_table(calendars, start, end)
+            p.count(len(calendars))
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    workers = args.workers or os.cpu_count() or 1
+    results = run(
+        jobs,
+        evaluate_batch_job,
+        workers,
+        init_batch_worker,
+        (table, args.backend, args.quantum, args.exact_grid),
+    )
+    try:
+        with timings.phase("batch.evaluate") as p:
+            for job, (id, times, error) in zip(jobs, results):
+                if error is not None:
+                    record = {"id": id, "error": error}
+                else:
+                    times_in = local_times(job["timezone"])
+                    record = {
+                        "id": id,
+                        "start": times_in.iso(job["start"]),
+                        "end": times_in.iso(job["end"]),
+                        "available": [
+                            {"start": times_in.iso(s), "end": times_in.iso(e)}
+                            for s, e in zip(*times)
+                        ],
+                    }
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                p.count(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def available_sharded():
+    """
+    The available command, evaluated in shards of the window on worker
+    processes, for windows of months or years.
+    """
+    from src.batch import run, shards, stitch
+
+    size = parse_duration(args.shard)
+    if args.expr:
+        calendars = expr_calendars(compile_expr(args.expr, CALENDAR_ALIASES))
+        calendars = calendars.values()
+    else:
+        calendars = [c for c in BUSY + FREE if not synthetic_calendar(c)]
+    calendars = sorted(set(calendars))
+
+    # the busy times are fetched once, for the whole window:
+    with timings.phase("shard.fetch") as p:
+        table = busy_table(calendars, START, END)
+        p.count(len(calendars))
+    jobs = [
+        {
+            "id": n,
+            "expr": args.expr,
+            "busy": BUSY,
+            "free": FREE,
+            "start": start,
+            "end": end,
+            "calendars": calendars,
+        }
+        for n, (start, end) in enumerate(shards(epoch(START), epoch(END), size))
+    ]
+    workers = args.workers or os.cpu_count() or 1
+    results = run(
+        jobs,
+        evaluate_batch_job,
+        workers,
+        init_batch_worker,
+        (table, args.backend, args.quantum, args.exact_grid),
+    )
+
+    def shard_times():
+        for id, times, error in results:
+            if error is not None:
+                raise ValueError(error)
+            yield times
+
+    with timings.phase("output") as p:
+        writer = Writer(sys.stdout, args.format, OUTPUT_TIMEZONE)
+        for start, end in stitch(shard_times()):
+            writer.write(start, end)
+        p.count(writer.close())
+
+
+def watch_text(times, start, end, summary):
+    return ("+ " if summary == "available" else "- ") + times.slot_text(start, end)
+
+
+def watch():
+    """
+    Prints the availability, then polls the calendars and prints just the
+    slots that become available (+) or unavailable (-) as they change.
+    """
+    from src.incremental import Availability, difference
+
+    if args.expr:
+        print("The watch command takes busy and free calendars, not --expr.")
+        return
+    remote = sorted(set(c for c in BUSY + FREE if not synthetic_calendar(c)))
+
+    def poll():
+        # each calendar's busy times, merged, as (start, end) ranges:
+        calidx = get_freebusy(calendarIds=remote, start=START, end=END)
+        return {id: list(zip(*get_cal(calidx, id).index())) for id in remote}
+
+    def calendar(id):
+        if synthetic_calendar(id):
+            return get_cal({}, id)
+        return Interval(START, [Event(s, e) for s, e in busy[id]], END)
+
+    busy = poll()
+    with timings.phase("incremental.build"):
+        availability = Availability(
+            START,
+            END,
+            {c: calendar(c) for c in BUSY},
+            {c: calendar(c) for c in FREE},
+        )
+    writer = Writer(sys.stdout, args.format, OUTPUT_TIMEZONE, watch_text, 1)
+    for start, end in zip(*availability.index()):
+        writer.write(start, end, "available")
+    try:
+        while True:
+            time.sleep(args.poll)
+            new_busy = poll()
+            for id in remote:
+                # only the busy times that changed are re-evaluated:
+                added = difference(new_busy[id], busy[id])
+                removed = difference(busy[id], new_busy[id])
+                if not added and not removed:
+                    continue
+                with timings.phase("incremental.update") as p:
+                    changes = availability.update(id, added, removed)
+                    p.count(len(changes))
+                for start, end, free in changes:
+                    writer.write(start, end, "available" if free else "unavailable")
+            busy = new_busy
+    except KeyboardInterrupt:
+        writer.close()
+
+
+def cache_stats():
+    if not cache:
+        print("The cache is disabled.")
+        return
+    stats = cache.stats()
+    for kind in ("freebusy", "events"):
+        hits = stats.get(kind + "_hits", 0)
+        misses = stats.get(kind + "_misses", 0) + stats.get(kind + "_syncs", 0)
+        ratio = float(hits) / (hits + misses) if hits + misses else 0.0
+        print(
+            "%s: %d hits, %d misses (hit ratio %.1f%%), %d entries, %d bytes"
+            % (
+                kind,
+                hits,
+                misses,
+                100 * ratio,
+                stats[kind + "_entries"],
+                stats[kind + "_bytes"],
+            )
+        )
+    print("incremental syncs:", stats.get("events_syncs", 0))
+    print("evictions:", stats.get("evictions", 0))
+
+
+def query_window(params):
+    """
+    The start and end of an HTTP query, defaulting like the command line.
+    """
+    start = arrow.utcnow().floor("minute")
+    if "start" in params:
+        start = arrow.get(params["start"][0])
+    end = start.replace(days=+30)
+    if "end" in params:
+        end = arrow.get(params["end"][0])
+    return start, end
+
+
+def available_route(params):
+    from src.server import split
+
+    start, end = query_window(params)
+    busy = get_calendars_from_imported(split(params, "busy") or ["primary"])
+    free = get_calendars_from_imported(split(params, "free"))
+    expr = params.get("expr", [None])[0]
+    available = compute_available(busy, free, expr, start, end)
+    utc = local_times("UTC")
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "available": [
+            {"start": utc.iso(int(s)), "end": utc.iso(int(e))}
+            for s, e in zip(*available.index())
+        ],
+    }
+
+
+def agenda_route(params):
+    from src.server import split
+
+    start, end = query_window(params)
+    calendars = get_calendars_from_imported(split(params, "calendars"))
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "events": [
+            {
+                "start": event_time(event["start"]).isoformat(),
+                "summary": event.get("summary", ""),
+            }
+            for event in agenda_events(calendars, start, end)
+        ],
+    }
+
+
+def serve():
+    from src import server
+
+    host = args.host or server.DEFAULT_HOST
+    port = args.port or server.DEFAULT_PORT
+    routes = {"/available": available_route, "/agenda": agenda_route}
+    httpd = server.make_server(routes, host, port, args.cache_ttl)
+    print("Serving on http://%s:%d/" % (host, port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        httpd.server_close()
 
 
 def import_cal():
@@ -186,17 +1129,51 @@ def import_cal():
         for path in INPUT:
             name = input("What would you like to name this calendar? ")
             settings.set_calendar(name, path)
+            if cache:
+                from src.snapshot import import_snapshot
+
+                import_snapshot(path, QUERY_TIMEZONE)
     list_cals()
 
 
-if __name__ == "__main__":
+def run_command():
     if args.command.lower() == "list":
         list_cals()
     elif args.command.lower() == "agenda":
         agenda()
     elif args.command.lower() == "available":
         available()
+    elif args.command.lower() == "find-slots":
+        find_slots()
+    elif args.command.lower() == "batch":
+        batch()
+    elif args.command.lower() == "watch":
+        watch()
     elif args.command.lower() == "import":
         import_cal()
+    elif args.command.lower() == "cache-stats":
+        cache_stats()
+    elif args.command.lower() == "serve":
+        serve()
     else:
         print("unknown command: " + args.command)
+
+
+def main(argv=None):
+    configure(argv)
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run_command)
+        finally:
+            profiler.dump_stats(args.profile)
+    else:
+        run_command()
+    if args.timings:
+        timings.write_report(args.timings)
+
+
+if __name__ == "__main__":
+    main()
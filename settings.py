@@ -4,7 +4,8 @@ import os
 import arrow
 import pytz
 from arrow.parser import ParserError
-from src.utils import safe_input as input
+import src.utils
+from src import timings
 
 
 weekday_dict = {
@@ -20,6 +21,11 @@ weekday_dict = {
 zones = pytz.all_timezones  # list of usable timezones
 
 
+# src.utils imports this module, so its names are only looked up when used:
+def input(message):
+    return src.utils.safe_input(message)
+
+
 def confirm_input(user_input):
     print("I got the following: ")
     if type(user_input) == list:
@@ -146,47 +152,85 @@ def setup_settings():
             parser.write(ini)
 
 
-setup_settings()
+# Settings are read (and, the first time, set up interactively) when one of
+# them is first used rather than on import, so commands that need none of them
+# start quickly.  Module attributes like TIMEZONE are computed on first access
+# by __getattr__ below, and then stored as ordinary globals until the settings
+# are written.
+
+_parser = None
+
 
-parser = configparser.ConfigParser(interpolation=None)
-parser.read("settings.ini")
+def load():
+    """
+    The parsed settings.ini, creating it first if need be.
+    """
+    global _parser
+    if _parser is None:
+        with timings.phase("settings.load"):
+            setup_settings()
+            parser = configparser.ConfigParser(interpolation=None)
+            parser.read("settings.ini")
+            _parser = parser
+    return _parser
 
 
-CREDENTIALS_DIR = parser.get("Settings", "credentials_dir")
-TIMEZONE = parser.get("Settings", "timezone")
-START_WORK = parser.get("Settings", "start_work")
-END_WORK = parser.get("Settings", "end_work")
+def get_cache_path():
+    default = os.path.join(load().get("Settings", "credentials_dir"), "cache.sqlite")
+    return load().get("Settings", "cache_path", fallback=default)
 
 
 def get_weekend_num():
     weekend = []
-    for i in parser["Weekend Days"]:
-        if parser.getboolean("Weekend Days", i):
+    for i in load()["Weekend Days"]:
+        if load().getboolean("Weekend Days", i):
             weekend.append(weekday_dict[i])
     return weekend
 
 
-weekend_num = get_weekend_num()
+_lazy = {
+    "parser": load,
+    "CREDENTIALS_DIR": lambda: load().get("Settings", "credentials_dir"),
+    "TIMEZONE": lambda: load().get("Settings", "timezone"),
+    "START_WORK": lambda: load().get("Settings", "start_work"),
+    "END_WORK": lambda: load().get("Settings", "end_work"),
+    # Optional settings for the on-disk cache of Google API results:
+    "CACHE_PATH": get_cache_path,
+    "CACHE_TTL": lambda: load().getint("Settings", "cache_ttl", fallback=300),
+    "CACHE_MAX_BYTES": lambda: load().getint(
+        "Settings", "cache_max_bytes", fallback=64 * 1024 * 1024
+    ),
+    "weekend_num": get_weekend_num,
+    # 0 (False) if calendars not imported:
+    "calendars_imported": lambda: len(load().options("Calendars")),
+}
+
 
-calendars_imported = len(
-    parser.options("Calendars")
-)  # returns 0 (False) if calendars not imported
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module 'settings' has no attribute " + repr(name))
+    value = _lazy[name]()
+    globals()[name] = value
+    return value
 
 
 def set_calendar(cal_name, cal_id):
-    parser.set("Calendars", cal_name, cal_id)
+    load().set("Calendars", cal_name, cal_id)
     with open("settings.ini", "w") as config:
-        parser.write(config)
+        load().write(config)
+    # values computed from the old settings are computed again when used:
+    for name in _lazy:
+        globals().pop(name, None)
 
 
 def list_imported_calendars():
-    for cal, id in parser.items("Calendars"):
+    for cal, id in load().items("Calendars"):
         print(cal, ":", id)
-    return parser.items("Calendars")
+    return load().items("Calendars")
 
 
 def get_imported_calendar_by_name(name: str):
-    for cal, id in parser.items("Calendars"):
+    for cal, id in load().items("Calendars"):
         if name.lower() == cal.lower() and name.lower() != "primary":
             return id
     return name # print("Calendar with name " + name + " not found")
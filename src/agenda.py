@@ -0,0 +1,66 @@
+"""
+Streaming, concurrent agenda fetching.
+
+Each calendar's events are fetched on a background thread (following
+pagination), and the per-calendar streams, each ordered by start time, are
+merged with a heap.  The merged stream yields an event as soon as it is known
+to be the earliest one left, so output starts as soon as every calendar has
+delivered its first page.
+"""
+import heapq
+import queue
+import threading
+
+_DONE = object()
+
+
+def iter_pages(list_page):
+    """
+    Generates the items of every page of an API list call; list_page(token)
+    fetches the page for a pageToken (None for the first page).
+    """
+    token = None
+    while True:
+        page = list_page(token)
+        for item in page.get("items", []):
+            yield item
+        token = page.get("nextPageToken")
+        if not token:
+            return
+
+
+def in_background(iterable, buffer=1000):
+    """
+    Consumes iterable on a daemon thread, and returns an iterator over the
+    items it produces; an exception on the thread is re-raised here.
+    """
+    items = queue.Queue(buffer)
+
+    def run():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as error:
+            items.put((_DONE, error))
+            return
+        items.put((_DONE, None))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def drain():
+        while True:
+            item = items.get()
+            if type(item) == tuple and len(item) == 2 and item[0] is _DONE:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+
+    return drain()
+
+
+def merge_streams(streams, key):
+    """
+    Fetches every stream concurrently, and merges them in order of key.
+    """
+    return heapq.merge(*[in_background(stream) for stream in streams], key=key)
@@ -0,0 +1,144 @@
+"""
+Evaluating many availability jobs in one run.
+
+A job file has one JSON object per line, e.g.
+
+    {"id": "alice", "expr": "~(alice | alice_travel) & workhours & weekday"}
+    {"id": "room-4", "busy": ["room-4@example.com"], "free": ["workhours"],
+     "start": "2020-03-01", "end": "2020-04-01"}
+
+Every remote calendar is fetched once for the whole batch, over the span of
+all the jobs that need it, into a BusyTable: two int64 arrays of epoch
+seconds per calendar, which pickle compactly.  The table is sent to each
+worker process once, when it starts, and the jobs (and their results, as
+arrays) are the only other traffic, so the CPU-bound interval algebra runs
+on every core.
+
+The same machinery evaluates one long window in shards: fixed-size slices of
+time, each evaluated as a job of its own, whose free times are stitched back
+together where they meet at the shard boundaries.
+"""
+import array
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils import Interval, interval_between
+
+CHUNKS_PER_WORKER = 4  # jobs are handed out in about this many chunks each
+
+
+def read_jobs(lines):
+    """
+    The jobs in lines of JSONL, skipping blank lines.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as error:
+            raise ValueError("job file line %d: %s" % (number, error))
+        if not isinstance(job, dict):
+            raise ValueError("job file line %d: not an object" % number)
+        job.setdefault("id", str(number))
+        yield job
+
+
+def pack(interval):
+    """
+    The epoch starts and ends of an Interval (or ArrayInterval) as arrays.
+    """
+    starts, ends = interval.index()
+    return array.array("q", [int(s) for s in starts]), array.array(
+        "q", [int(e) for e in ends]
+    )
+
+
+class BusyTable:
+    """
+    The busy times of several calendars, as arrays of epoch seconds.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def add(self, id, interval):
+        self.starts[id], self.ends[id] = pack(interval)
+
+    def add_times(self, id, times):
+        """
+        Adds a calendar's busy times, as (start, end) epoch seconds pairs
+        ordered by start; overlapping ones are merged.
+        """
+        starts, ends = array.array("q"), array.array("q")
+        for start, end in times:
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts[id], self.ends[id] = starts, ends
+
+    def __contains__(self, id):
+        return id in self.starts
+
+    def interval(self, id, start, end, interval_class=Interval):
+        """
+        The busy times of a calendar between start and end.
+        """
+        return interval_between(
+            self.starts[id], self.ends[id], start, end, interval_class
+        )
+
+
+def shards(start, end, size):
+    """
+    The (start, end) slices of size seconds (the last may be shorter) that
+    the epoch window start..end is split into.
+    """
+    if size <= 0:
+        raise ValueError("shard size must be positive")
+    for shard_start in range(start, end, size):
+        yield shard_start, min(shard_start + size, end)
+
+
+def stitch(results):
+    """
+    Yields the (start, end) times from consecutive shards' (starts, ends)
+    arrays, joining times that meet at a shard boundary.
+    """
+    pending = None
+    for starts, ends in results:
+        for start, end in zip(starts, ends):
+            if pending and pending[1] == start:
+                pending = (pending[0], end)
+                continue
+            if pending:
+                yield pending
+            pending = (start, end)
+    if pending:
+        yield pending
+
+
+def run(jobs, evaluate, workers=1, initializer=None, initargs=()):
+    """
+    Yields evaluate(job) for each of jobs, in order, as they are done.
+
+    With more than one worker, jobs are evaluated in a pool of worker
+    processes, each set up with initializer(*initargs); evaluate must then
+    be picklable (a module-level function).
+    """
+    jobs = list(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        if initializer:
+            initializer(*initargs)
+        for job in jobs:
+            yield evaluate(job)
+        return
+    chunksize = max(1, len(jobs) // (workers * CHUNKS_PER_WORKER))
+    with ProcessPoolExecutor(
+        workers, initializer=initializer, initargs=initargs
+    ) as pool:
+        for result in pool.map(evaluate, jobs, chunksize=chunksize):
+            yield result
@@ -0,0 +1,121 @@
+"""
+Batched API requests.
+
+Google's APIs take up to MAX_BATCH calls in one batch HTTP request.  A
+Batcher lets several threads (such as the agenda's per-calendar fetchers)
+each make their own requests as usual, and sends those made at about the
+same time together: the first request of a batch waits WAIT seconds for
+others to join it (or until there are MAX_BATCH), and then the whole group
+is executed in one round trip.  Calls in a batch that fail with a transient error are
+retried, with backoff, in a later batch.
+"""
+import threading
+import time
+
+from src import timings
+from src.freebusy import BACKOFF, RETRIES, is_retryable
+
+MAX_BATCH = 50  # calls per batch request for the Calendar API
+WAIT = 0.01  # seconds a request waits for others to join its batch
+
+
+class Pending:
+    def __init__(self, request):
+        self.request = request
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class Batcher:
+    """
+    get_service() must return a service object that is safe to use on the
+    calling thread; it is used to create the batch requests.
+    """
+
+    def __init__(
+        self, get_service, size=MAX_BATCH, wait=WAIT, retries=RETRIES, backoff=BACKOFF
+    ):
+        self.get_service = get_service
+        self.size = size
+        self.wait = wait
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def execute(self, request):
+        """
+        Executes request along with any others made at about the same time,
+        and returns its response (or raises its error).
+        """
+        item = Pending(request)
+        with self.lock:
+            self.pending.append(item)
+            first = len(self.pending) == 1
+            full = len(self.pending) >= self.size
+        if full:
+            self.flush()
+        elif first:
+            # the first request of a batch waits for others to join it:
+            time.sleep(self.wait)
+            self.flush()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.response
+
+    def flush(self):
+        """
+        Sends the requests that are waiting (up to a batch of them).
+        """
+        with self.lock:
+            group = self.pending[: self.size]
+            del self.pending[: self.size]
+        if not group:
+            return
+        for attempt in range(self.retries + 1):
+            self.send(group)
+            group = [
+                item
+                for item in group
+                if item.error is not None and is_retryable(item.error)
+            ]
+            if not group or attempt == self.retries:
+                break
+            time.sleep(self.backoff * 2**attempt)
+        for item in group:
+            item.done.set()
+
+    def send(self, group):
+        """
+        Executes a group of requests in one round trip, and marks those that
+        succeeded, or failed for good, as done.
+        """
+
+        def finish(item, response, error):
+            item.response, item.error = response, error
+            if error is None or not is_retryable(error):
+                item.done.set()
+
+        with timings.phase("api.batch") as p:
+            p.count(len(group))
+            if len(group) == 1:
+                try:
+                    finish(group[0], group[0].request.execute(), None)
+                except Exception as error:
+                    finish(group[0], None, error)
+                return
+            batch = self.get_service().new_batch_http_request(
+                callback=lambda id, response, error: finish(
+                    group[int(id)], response, error
+                )
+            )
+            for i, item in enumerate(group):
+                batch.add(item.request, request_id=str(i))
+            try:
+                batch.execute()
+            except Exception as error:
+                for item in group:
+                    if not item.done.is_set():
+                        finish(item, None, error)
@@ -0,0 +1,220 @@
+"""
+A slot bitmap alternative to src.utils.Interval, for combining many calendars
+at a fixed granularity.
+
+Time is cut into slots of a quantum (15 minutes by default) on a grid of
+multiples of the quantum since the epoch.  A calendar is a pair of Python
+ints with a bit per slot of its window (the first slot is the most
+significant bit): bits, set where the calendar is busy in any part of the
+slot, and full, set where it is busy throughout the slot.  |, & and ~ are
+then bitwise operations on ints, which run a machine word at a time however
+many events the calendars hold.
+
+On the grid the two bitmaps are the same.  Off it, they bound the calendar
+from above and below, and ~ swaps them, so that busy calendars (which are
+complemented) round out to the grid and free calendars round in: the slots
+of a combined calendar that are full are then certainly available, and
+those are the times it reports.  A calendar built from events reports the
+events themselves.  Classes made with exact=True make times off the grid an
+error instead.  Bits are converted through strings of "0"s and "1"s, which
+int() and format() handle in linear time.
+"""
+import functools
+import re
+
+import arrow
+
+from src import timings
+from src.utils import Event, Interval, SlotQueries, common_window, epoch
+
+QUANTUM = 15 * 60  # seconds per slot, by default
+
+RUNS = re.compile("1+")
+
+
+class OffGridError(ValueError):
+    """
+    An event starts or ends between the slots of a BitsetInterval.
+    """
+
+
+class BitsetInterval(SlotQueries):
+    """
+    Drop-in replacement for Interval with events held as a bitmap of slots.
+    """
+
+    quantum = QUANTUM
+    exact = False  # times off the grid are an error, rather than rounded
+
+    def __init__(self, start, events, end):
+        self._window(start, end)
+        self._raster((ev.s, ev.e) for ev in events)
+
+    def _window(self, start, end):
+        self.start = start
+        self.end = end
+        self.lo, self.hi = epoch(start), epoch(end)
+        self.origin = self.lo - self.lo % self.quantum
+        self.size = max(-(-(self.hi - self.origin) // self.quantum), 0)
+        self._index = None
+
+    def _raster(self, times):
+        """
+        Sets the bitmaps of the slots that (start, end) epoch times cover in
+        any part and throughout, and keeps the times, merged and clipped to
+        the interval, as its index.
+        """
+        merged = []
+        clipped = sorted((max(int(s), self.lo), min(int(e), self.hi)) for s, e in times)
+        for s, e in clipped:
+            if s >= e:
+                continue
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self._index = ([s for s, e in merged], [e for s, e in merged])
+        self.bits = self.full = 0
+        if not self.size:
+            return
+        bits = bytearray(b"0") * self.size
+        full = bytearray(b"0") * self.size
+        on_grid = True
+        for s, e in merged:
+            for time in (s, e):
+                if time % self.quantum and self.lo < time < self.hi:
+                    if self.exact:
+                        raise OffGridError(
+                            "%s is not on the %ds grid of the bitset backend; "
+                            "use a smaller quantum or another backend"
+                            % (arrow.Arrow.utcfromtimestamp(time), self.quantum)
+                        )
+                    on_grid = False
+            first = (s - self.origin) // self.quantum
+            last = -(-(e - self.origin) // self.quantum)
+            bits[first:last] = b"1" * (last - first)
+            # the slots at the interval's ends are only partly inside it:
+            if s > self.lo:
+                first = -(-(s - self.origin) // self.quantum)
+            if e < self.hi:
+                last = (e - self.origin) // self.quantum
+            if first < last:
+                full[first:last] = b"1" * (last - first)
+        self.bits = int(bits, 2)
+        self.full = self.bits if on_grid else int(full, 2)
+
+    @classmethod
+    def from_arrays(cls, start, starts, ends, end):
+        interval = cls.__new__(cls)
+        interval._window(start, end)
+        interval._raster(zip(starts, ends))
+        return interval
+
+    @classmethod
+    def from_interval(cls, interval):
+        if isinstance(interval, cls):
+            return interval
+        starts, ends = interval.index()
+        return cls.from_arrays(interval.start, starts, ends, interval.end)
+
+    def _derive(self, bits, full):
+        interval = self.__class__.__new__(self.__class__)
+        interval._window(self.start, self.end)
+        interval.bits = bits
+        interval.full = bits if full == bits else full
+        return interval
+
+    def index(self):
+        """
+        The busy times, as (starts, ends) lists of epoch seconds, clipped to
+        the interval: the events it was built from, or the full slots of a
+        combined calendar.
+        """
+        if self._index is None:
+            starts, ends = [], []
+            if self.full:
+                text = format(self.full, "0%db" % self.size)
+                for run in RUNS.finditer(text):
+                    s = max(self.origin + run.start() * self.quantum, self.lo)
+                    e = min(self.origin + run.end() * self.quantum, self.hi)
+                    if s < e:
+                        starts.append(s)
+                        ends.append(e)
+            self._index = (starts, ends)
+        return self._index
+
+    def to_interval(self):
+        return Interval(self.start, self.events, self.end)
+
+    def __len__(self):
+        return len(self.index()[0])
+
+    def iter_events(self):
+        for s, e in zip(*self.index()):
+            yield Event(s, e)
+
+    @property
+    def events(self):
+        return list(self.iter_events())
+
+    def _coerce(self, other):
+        if self.start != other.start or self.end != other.end:
+            raise Exception("won't combine calendars with different intervals")
+        return self.from_interval(other)
+
+    @timings.timed("algebra.not", count=len)
+    def __invert__(self):
+        mask = (1 << self.size) - 1
+        return self._derive(self.full ^ mask, self.bits ^ mask)
+
+    @timings.timed("algebra.or", count=len)
+    def __or__(self, other):
+        other = self._coerce(other)
+        return self._derive(self.bits | other.bits, self.full | other.full)
+
+    def __and__(self, other):
+        other = self._coerce(other)
+        return self._derive(self.bits & other.bits, self.full & other.full)
+
+    @classmethod
+    @timings.timed("algebra.union_all", count=len)
+    def union_all(cls, intervals):
+        common_window(intervals)
+        bits = full = 0
+        for cal in intervals:
+            cal = cls.from_interval(cal)
+            bits |= cal.bits
+            full |= cal.full
+        return cls.from_interval(intervals[0])._derive(bits, full)
+
+    @classmethod
+    @timings.timed("algebra.intersect_all", count=len)
+    def intersect_all(cls, intervals):
+        common_window(intervals)
+        first = cls.from_interval(intervals[0])
+        bits, full = first.bits, first.full
+        for cal in intervals[1:]:
+            cal = cls.from_interval(cal)
+            bits &= cal.bits
+            full &= cal.full
+        return first._derive(bits, full)
+
+    def __str__(self):
+        return "\n".join([str(x) for x in self.iter_events()])
+
+
+@functools.lru_cache(maxsize=None)
+def with_quantum(seconds, exact=False):
+    """
+    A BitsetInterval class whose slots are seconds long, and which rejects
+    times off its grid if exact.
+    """
+    if seconds <= 0:
+        raise ValueError("the quantum must be positive")
+    if seconds == QUANTUM and not exact:
+        return BitsetInterval
+    return type(
+        "BitsetInterval%ds%s" % (seconds, "Exact" if exact else ""),
+        (BitsetInterval,),
+        {"quantum": seconds, "exact": exact},
+    )
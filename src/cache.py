@@ -0,0 +1,352 @@
+"""
+A persistent on-disk cache for freebusy results and calendar events.
+
+The cache is a single SQLite file:
+
+ + freebusy results are stored per calendar and time window; a query only
+   requests the sub-ranges of its window that are not already cached (or have
+   outlived the TTL), and serves the rest locally.  A newly fetched window is
+   merged with the cached ones it overlaps or touches, so repeated queries of
+   sliding windows keep one entry per calendar;
+ + events are kept per calendar and time window together with Google's
+   nextSyncToken, so that a refresh only transfers the events that changed
+   since the last one;
+ + entries are evicted least-recently-used first once the cache outgrows its
+   size bound;
+ + hits and misses are counted, and reported by the cache-stats command.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import arrow
+
+from src.tz import DAY
+from src.utils import epoch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS freebusy (
+    calendar_id TEXT,
+    window_start INTEGER,
+    window_end INTEGER,
+    fetched REAL,
+    last_used REAL,
+    size INTEGER,
+    busy TEXT
+);
+CREATE INDEX IF NOT EXISTS freebusy_calendar ON freebusy (calendar_id);
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT PRIMARY KEY,
+    time_min INTEGER,
+    time_max INTEGER,
+    sync_token TEXT,
+    fetched REAL,
+    last_used REAL,
+    size INTEGER,
+    events TEXT
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+DEFAULT_TTL = 300  # seconds
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+SYNC_SPAN = 90 * DAY  # the least time a full sync of events covers
+
+
+def missing_ranges(start, end, covered):
+    """
+    The parts of start..end (epoch seconds) not covered by any of the given
+    (start, end) ranges.
+    """
+    missing = []
+    cursor = start
+    for cov_start, cov_end in sorted(covered):
+        if cov_start > cursor:
+            missing.append((cursor, min(cov_start, end)))
+        cursor = max(cursor, cov_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return [(s, e) for s, e in missing if s < e]
+
+
+def merge_times(times):
+    """
+    (start, end) ranges sorted, with overlapping or adjacent ones merged.
+    """
+    merged = []
+    for start, end in sorted(times):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def might_overlap(event, lo, hi):
+    """
+    Might an API event overlap lo..hi (epoch seconds)?  All-day events are
+    given a day of slack either side, for the timezone they are in.
+    """
+    times = []
+    for time in (event.get("start", {}), event.get("end", event.get("start", {}))):
+        if "dateTime" in time:
+            times.append(epoch(time["dateTime"]))
+        elif "date" in time:
+            times.append(epoch(time["date"]) + (DAY if times else -DAY))
+        else:
+            return True
+    return times[0] < hi and times[1] > lo
+
+
+def is_gone(error):
+    """
+    Is this the API's "410 Gone" answer to an expired sync token?
+    """
+    resp = getattr(error, "resp", None)
+    return resp is not None and int(getattr(resp, "status", 0)) == 410
+
+
+class Cache:
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(events)")]
+        if columns and "time_max" not in columns:
+            # events cached before their windows were bounded:
+            self.db.execute("DROP TABLE events")
+        self.db.executescript(SCHEMA)
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.db.close()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO stats VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                (name, n, n),
+            )
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.db.execute("SELECT name, value FROM stats"))
+            for table in ("freebusy", "events"):
+                rows, size = self.db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM " + table
+                ).fetchone()
+                stats[table + "_entries"] = rows
+                stats[table + "_bytes"] = size
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.db.executescript(
+                "DELETE FROM freebusy; DELETE FROM events; DELETE FROM stats;"
+            )
+            self.db.commit()
+
+    def evict(self):
+        """
+        Drops least recently used entries until the cache fits max_bytes.
+        """
+        total = sum(
+            self.db.execute("SELECT COALESCE(SUM(size), 0) FROM " + table).fetchone()[0]
+            for table in ("freebusy", "events")
+        )
+        if total <= self.max_bytes:
+            return
+        entries = self.db.execute(
+            "SELECT last_used, size, 'freebusy', rowid FROM freebusy "
+            "UNION ALL SELECT last_used, size, 'events', rowid FROM events "
+            "ORDER BY last_used"
+        ).fetchall()
+        for last_used, size, table, rowid in entries:
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM " + table + " WHERE rowid = ?", (rowid,))
+            self.count("evictions")
+            total -= size
+
+    def freebusy(self, calendar_ids, start, end, fetch):
+        """
+        Busy times for each calendar between start and end, as returned by
+        src.freebusy.query_freebusy.
+
+        fetch(calendar_ids, start, end) is called for the sub-ranges that are
+        not in the cache; calendars missing the same sub-ranges are fetched
+        together.
+        """
+        lo, hi = epoch(start), epoch(end)
+        now = time.time()
+        with self.lock:
+            busy = {}
+            todo = {}  # missing range -> calendars missing it
+            for id in calendar_ids:
+                rows = self.db.execute(
+                    "SELECT rowid, window_start, window_end, busy FROM freebusy "
+                    "WHERE calendar_id = ? AND fetched >= ? "
+                    "AND window_end > ? AND window_start < ?",
+                    (id, now - self.ttl, lo, hi),
+                ).fetchall()
+                busy[id] = [tuple(t) for row in rows for t in json.loads(row[3])]
+                self.db.executemany(
+                    "UPDATE freebusy SET last_used = ? WHERE rowid = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                missing = missing_ranges(lo, hi, [(row[1], row[2]) for row in rows])
+                self.count("freebusy_hits" if not missing else "freebusy_misses")
+                for window in missing:
+                    todo.setdefault(window, []).append(id)
+            # expired entries are replaced by the refetched windows:
+            self.db.execute("DELETE FROM freebusy WHERE fetched < ?", (now - self.ttl,))
+            self.db.commit()
+
+        for (win_lo, win_hi), ids in sorted(todo.items()):
+            fetched = fetch(
+                ids,
+                arrow.Arrow.utcfromtimestamp(win_lo),
+                arrow.Arrow.utcfromtimestamp(win_hi),
+            )
+            with self.lock:
+                for id in ids:
+                    times = [(epoch(s), epoch(e)) for s, e in fetched.get(id, [])]
+                    self.store_freebusy(id, win_lo, win_hi, times, now)
+                    busy[id].extend(times)
+                self.db.commit()
+
+        with self.lock:
+            self.evict()
+            self.db.commit()
+        result = {}
+        for id, times in busy.items():
+            times = sorted(
+                set((max(s, lo), min(e, hi)) for s, e in times if s < hi and e > lo)
+            )
+            result[id] = times
+        return result
+
+    def store_freebusy(self, id, lo, hi, times, now):
+        """
+        Stores the busy times of a calendar fetched for lo..hi, as one entry
+        together with the fresh entries that overlap or touch it; the merged
+        entry expires with the oldest of them.
+        """
+        rows = self.db.execute(
+            "SELECT rowid, window_start, window_end, fetched, busy FROM freebusy "
+            "WHERE calendar_id = ? AND fetched >= ? "
+            "AND window_start <= ? AND window_end >= ?",
+            (id, now - self.ttl, hi, lo),
+        ).fetchall()
+        fetched = now
+        for rowid, row_lo, row_hi, row_fetched, row_busy in rows:
+            lo, hi = min(lo, row_lo), max(hi, row_hi)
+            fetched = min(fetched, row_fetched)
+            times = times + [tuple(t) for t in json.loads(row_busy)]
+        self.db.executemany(
+            "DELETE FROM freebusy WHERE rowid = ?", [(row[0],) for row in rows]
+        )
+        blob = json.dumps(merge_times(times))
+        self.db.execute(
+            "INSERT INTO freebusy VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (id, lo, hi, fetched, now, len(blob), blob),
+        )
+
+    def events(self, calendar_id, time_min, time_max, list_events):
+        """
+        All the events of a calendar between time_min and time_max, kept up
+        to date with incremental sync.
+
+        list_events(**params) performs one events().list request.  The first
+        request for a calendar is a full sync of a window from time_min (of
+        at least SYNC_SPAN, so that later queries fall inside it); later
+        ones only ask for what changed since the stored sync token.  Events
+        are only kept within the window, so that recurring events with no
+        end do not grow the cache without bound.
+        """
+        now = time.time()
+        lo, hi = epoch(time_min), epoch(time_max)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT time_min, time_max, sync_token, fetched, events FROM events "
+                "WHERE calendar_id = ?",
+                (calendar_id,),
+            ).fetchone()
+        covered = row and row[0] <= lo and hi <= row[1]
+        if covered and row[3] >= now - self.ttl:
+            self.count("events_hits")
+            with self.lock:
+                self.db.execute(
+                    "UPDATE events SET last_used = ? WHERE calendar_id = ?",
+                    (now, calendar_id),
+                )
+                self.db.commit()
+            return list(json.loads(row[4]).values())
+
+        t_min, t_max = lo, max(hi, lo + SYNC_SPAN)
+        full_sync = {
+            "timeMin": arrow.Arrow.utcfromtimestamp(t_min).isoformat(),
+            "timeMax": arrow.Arrow.utcfromtimestamp(t_max).isoformat(),
+        }
+        if covered and row[2]:
+            self.count("events_syncs")
+            t_min, t_max = row[0], row[1]
+            events = json.loads(row[4])
+            try:
+                token = self.sync(
+                    events, list_events, {"syncToken": row[2]}, t_min, t_max
+                )
+            except Exception as error:
+                if not is_gone(error):
+                    raise
+                # the sync token has expired; start over with a full sync:
+                self.count("events_resyncs")
+                events = {}
+                token = self.sync(events, list_events, full_sync)
+        else:
+            self.count("events_misses")
+            events = {}
+            token = self.sync(events, list_events, full_sync)
+
+        blob = json.dumps(events)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (calendar_id, t_min, t_max, token, now, now, len(blob), blob),
+            )
+            self.evict()
+            self.db.commit()
+        return list(events.values())
+
+    def sync(self, events, list_events, params, lo=None, hi=None):
+        """
+        Applies every page of an events().list to the events dict (keyed by
+        event id), and returns the next sync token.  Incremental syncs can't
+        be limited to a window, so changed events outside lo..hi (epoch
+        seconds) are dropped here.
+        """
+        page_token = None
+        while True:
+            page = list_events(pageToken=page_token, **params)
+            for event in page.get("items", []):
+                if event.get("status") == "cancelled" or (
+                    lo is not None and not might_overlap(event, lo, hi)
+                ):
+                    events.pop(event["id"], None)
+                else:
+                    events[event["id"]] = event
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return page.get("nextSyncToken")
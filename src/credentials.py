@@ -18,15 +18,19 @@
 # import settings
 
 from __future__ import print_function
-import datetime
+import copy
+import hashlib
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import threading
 import settings
+from src import timings
+
+# The Google API client and OAuth libraries are slow to import, so they are
+# only imported once a service is actually needed.
+
+SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
 
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
 # Credentials should be stored in settings.CREDENTIALS_DIR
 def get_service():
@@ -44,8 +48,71 @@ def get_service():
     # service = build("calendar", "v3", http=creds.authorize(Http()))
     # return service
 
-   
-    creds = None
+    from googleapiclient.discovery import build
+
+    creds = get_credentials()
+    with timings.phase("service.build"):
+        service = build("calendar", "v3", credentials=creds, cache=DiscoveryCache())
+
+    return service
+
+
+_credentials = None
+# (reentrant, as loading the credentials may refresh them)
+_credentials_lock = threading.RLock()
+
+
+def get_credentials():
+    """
+    The user's credentials, shared by every service (and thread) in the
+    process.  token.pickle is read once; whenever the access token expires
+    (whether here or in a service's http object), it is refreshed once,
+    under a lock, and saved back to token.pickle, so that later runs reuse
+    it until it expires in turn.
+    """
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None or not _credentials.valid:
+            _credentials = share(load_credentials(_credentials))
+        return _credentials
+
+
+def share(creds):
+    """
+    Makes the credentials refresh under the lock, and save the new token.
+    The threads that find the same token stale at once then refresh it
+    just once between them.
+    """
+    if "refresh" in vars(creds):
+        return creds
+    refresh = type(creds).refresh
+
+    def locked_refresh(request):
+        stale = creds.token
+        with _credentials_lock:
+            if creds.token == stale:  # no other thread has refreshed it yet
+                refresh(creds, request)
+                save_credentials(creds)
+
+    creds.refresh = locked_refresh
+    return creds
+
+
+def save_credentials(creds):
+    """
+    Saves the credentials to token.pickle, for the next run.
+    """
+    saved = copy.copy(creds)
+    vars(saved).pop("refresh", None)
+    token_pickle_file = os.path.join(settings.CREDENTIALS_DIR, "token.pickle")
+    with open(token_pickle_file, "wb") as token:
+        pickle.dump(saved, token)
+
+
+def load_credentials(creds=None):
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
@@ -54,30 +121,77 @@ def get_service():
     # It must contain credentials.json as acquired from the quickstart tutorial.
     # It will place token.pickle there after it has authenticated.
 
-    token_pickle_file = os.path.join(settings.CREDENTIALS_DIR,'token.pickle')
-    credentials_file = os.path.join(settings.CREDENTIALS_DIR,'credentials.json')
-
-    if os.path.exists(token_pickle_file):
-        with open(token_pickle_file, 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                credentials_file, SCOPES)
-            creds = flow.run_local_server()
-        # Save the credentials for the next run
-        with open(token_pickle_file, 'wb') as token:
-            pickle.dump(creds, token)
-
-    service = build('calendar', 'v3', credentials=creds) 
+    with timings.phase("credentials.load"):
+        token_pickle_file = os.path.join(settings.CREDENTIALS_DIR, "token.pickle")
+        credentials_file = os.path.join(settings.CREDENTIALS_DIR, "credentials.json")
+
+        if creds is None and os.path.exists(token_pickle_file):
+            with open(token_pickle_file, "rb") as token:
+                creds = pickle.load(token)
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                # (not the shared refresh, which would save them twice)
+                type(creds).refresh(creds, Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    credentials_file, SCOPES
+                )
+                creds = flow.run_local_server()
+            # Save the credentials for the next run
+            save_credentials(creds)
+
+    return creds
+
+
+class DiscoveryCache:
+    """
+    Keeps the API discovery document in the credentials directory, so that
+    building a service does not fetch it again on every run.  (This is the
+    interface of googleapiclient.discovery_cache.base.Cache.)  Documents
+    are also kept in memory, for the services built for other threads.
+    """
+
+    documents = {}  # url -> content, shared by every service built
+
+    def path(self, url):
+        name = hashlib.sha1(url.encode("utf8")).hexdigest()
+        return os.path.join(settings.CREDENTIALS_DIR, "discovery-" + name + ".json")
+
+    def get(self, url):
+        if url not in self.documents:
+            try:
+                with open(self.path(url)) as f:
+                    self.documents[url] = f.read()
+            except OSError:
+                return None
+        return self.documents[url]
+
+    def set(self, url, content):
+        self.documents[url] = content
+        try:
+            with open(self.path(url), "w") as f:
+                f.write(content)
+        except OSError:
+            pass
+
+
+_local = threading.local()
+
+
+def get_thread_service():
+    """
+    A service object for the calling thread.  The http object inside a
+    service is not thread-safe, so each worker thread gets its own.
+    """
+    if not hasattr(_local, "service"):
+        _local.service = get_service()
+    return _local.service
 
-    return service
 
 def main():
     get_service()
 
-if __name__  == "__main__":
+
+if __name__ == "__main__":
     main()
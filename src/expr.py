@@ -0,0 +1,262 @@
+"""
+A small language of calendar expressions, e.g.:
+
+    ~(primary | out_of_town) & workhours & weekday
+
+Calendar names are combined with | (busy in any), & (busy in all) and ~
+(complement).  An expression is parsed into an AST, planned, and then
+evaluated lazily:
+
+ + ~ is pushed down to the calendars with De Morgan's laws, which cancels
+   double negations (and aliases such as weekday = ~weekend);
+ + chains of | and & are flattened into n-ary nodes, so they are evaluated
+   with a single Interval.union_all / Interval.intersect_all;
+ + identical subterms are shared, and operands common to several chains are
+   factored out into a shared node, so each one is only computed once.
+"""
+import itertools
+
+from src.utils import Interval
+
+OPERATORS = "|&~()"
+
+# AST nodes are plain tuples, so that equal subterms hash (and are shared)
+# alike:
+#   ("name", calendar)
+#   ("not", node)
+#   ("and", frozenset of nodes)
+#   ("or", frozenset of nodes)
+
+
+def name(calendar):
+    return ("name", calendar)
+
+
+def negate(node):
+    """
+    The complement of node, with ~ pushed down to the calendars.
+    """
+    kind = node[0]
+    if kind == "name":
+        return ("not", node)
+    elif kind == "not":
+        return node[1]
+    elif kind == "and":
+        return combine("or", [negate(x) for x in node[1]])
+    else:
+        return combine("and", [negate(x) for x in node[1]])
+
+
+def combine(kind, nodes):
+    """
+    An n-ary "and" / "or" node, absorbing nested nodes of the same kind.
+    """
+    args = set()
+    for node in nodes:
+        if node[0] == kind:
+            args.update(node[1])
+        else:
+            args.add(node)
+    if len(args) == 1:
+        return args.pop()
+    return (kind, frozenset(args))
+
+
+def tokenize(text):
+    tokens = []
+    word = ""
+    for char in text:
+        if char.isspace() or char in OPERATORS:
+            if word:
+                tokens.append(word)
+                word = ""
+            if not char.isspace():
+                tokens.append(char)
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def parse(text, aliases=None):
+    """
+    Parses an expression into an AST in negation normal form.
+
+    aliases maps calendar names to expressions that stand in for them, for
+    instance {"weekday": "~weekend"}.
+    """
+    aliases = aliases or {}
+    tokens = tokenize(text)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take(expected=None):
+        token = peek()
+        if token is None:
+            raise SyntaxError("unexpected end of expression: " + text)
+        if expected and token != expected:
+            raise SyntaxError("expected " + expected + " but got " + token)
+        pos[0] += 1
+        return token
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "|":
+            take("|")
+            nodes.append(parse_and())
+        return combine("or", nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() == "&":
+            take("&")
+            nodes.append(parse_not())
+        return combine("and", nodes)
+
+    def parse_not():
+        token = take()
+        if token == "~":
+            return negate(parse_not())
+        elif token == "(":
+            node = parse_or()
+            take(")")
+            return node
+        elif token in OPERATORS:
+            raise SyntaxError("unexpected " + token + " in: " + text)
+        elif token.lower() in aliases:
+            return parse(aliases[token.lower()], aliases)
+        else:
+            return name(token)
+
+    node = parse_or()
+    if peek() is not None:
+        raise SyntaxError("unexpected " + peek() + " in: " + text)
+    return node
+
+
+def subterms(node):
+    """
+    Every distinct node of the AST, children before their parents.
+    """
+    seen = []
+    known = set()
+
+    def visit(node):
+        if node in known:
+            return
+        if node[0] == "not":
+            visit(node[1])
+        elif node[0] in ("and", "or"):
+            for arg in node[1]:
+                visit(arg)
+        known.add(node)
+        seen.append(node)
+
+    visit(node)
+    return seen
+
+
+def share(node):
+    """
+    Factors operands that several n-ary nodes have in common into a shared
+    node, e.g. (workhours & weekday & a) | (workhours & weekday & b) computes
+    workhours & weekday once.
+    """
+    nodes = [x for x in subterms(node) if x[0] in ("and", "or")]
+    common = set()
+    for x, y in itertools.combinations(nodes, 2):
+        if x[0] == y[0]:
+            both = x[1] & y[1]
+            if len(both) >= 2:
+                common.add((x[0], both))
+    if not common:
+        return node
+    # factor the largest common operand sets first:
+    common = sorted(common, key=lambda x: -len(x[1]))
+
+    rewritten = {}
+
+    def rewrite(node):
+        if node in rewritten:
+            return rewritten[node]
+        kind = node[0]
+        if kind == "name":
+            new = node
+        elif kind == "not":
+            new = ("not", rewrite(node[1]))
+        else:
+            args = node[1]
+            for shared_kind, shared_args in common:
+                if shared_kind == kind and shared_args < args:
+                    inner = rewrite((kind, shared_args))
+                    args = (args - shared_args) | {inner}
+                    break
+            new = (kind, frozenset(rewrite(x) for x in args))
+        rewritten[node] = new
+        return new
+
+    return rewrite(node)
+
+
+class Plan:
+    """
+    A compiled calendar expression.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        nodes = subterms(root)
+        self.calendars = sorted(x[1] for x in nodes if x[0] == "name")
+        # the calendars only ever complemented, whose busy times are the
+        # ones that make the result unavailable:
+        positive = {root}
+        for node in nodes:
+            if node[0] in ("and", "or"):
+                positive.update(node[1])
+        self.busy_calendars = sorted(
+            x[1][1] for x in nodes if x[0] == "not" and x[1] not in positive
+        )
+
+    def evaluate(self, lookup, interval_class=Interval):
+        """
+        Computes the expression; lookup(calendar) returns the Interval for a
+        calendar name, and is only called for calendars the expression needs,
+        once each.
+        """
+        memo = {}
+
+        def value(node):
+            if node in memo:
+                return memo[node]
+            kind = node[0]
+            if kind == "name":
+                result = lookup(node[1])
+            elif kind == "not":
+                result = ~value(node[1])
+            else:
+                positive = [x for x in node[1] if x[0] != "not"]
+                negative = [x[1] for x in node[1] if x[0] == "not"]
+                # ~a & ~b is computed as ~(a | b), ~a | ~b as ~(a & b), so
+                # that each n-ary node costs at most one complement:
+                if kind == "and":
+                    collect, dual = interval_class.intersect_all, "or"
+                else:
+                    collect, dual = interval_class.union_all, "and"
+                args = [value(x) for x in positive]
+                if negative:
+                    args.append(~value(combine(dual, negative)))
+                result = args[0] if len(args) == 1 else collect(args)
+            memo[node] = result
+            return result
+
+        return value(self.root)
+
+
+def compile_expr(text, aliases=None):
+    """
+    Parses and plans a calendar expression.
+    """
+    return Plan(share(parse(text, aliases)))
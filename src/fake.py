@@ -0,0 +1,307 @@
+"""
+An in-process stand-in for the Google Calendar service object.
+
+FakeService answers freebusy().query, events().list and
+calendarList().list from calendars held in memory, singly or in batch
+requests.  It enforces the same per-request limits as the real API and can
+simulate latency and transient failures, so the fetching code can be
+exercised (and its throughput measured) offline.  requests counts the round
+trips made.
+"""
+import json
+import random
+import threading
+import time
+
+import arrow
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "fake"
+
+
+class FakeHttpError(Exception):
+    """
+    Mimics googleapiclient.errors.HttpError closely enough for retries.
+    """
+
+    def __init__(self, status, message="", reason=None):
+        Exception.__init__(self, str(status) + " " + message)
+        self.resp = FakeResponse(status)
+        errors = [{"reason": reason, "message": message}] if reason else []
+        error = {"code": status, "message": message, "errors": errors}
+        self.content = json.dumps({"error": error}).encode("utf8")
+
+
+class FakeRequest:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self, **kwargs):
+        return self.service.call(self.handler)
+
+
+class FakeBatch:
+    """
+    Mimics the BatchHttpRequest from service.new_batch_http_request().
+    """
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self.requests))
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, **kwargs):
+        if len(self.requests) > self.service.max_batch:
+            raise FakeHttpError(400, "too many requests in a batch")
+        self.service.call(self.run)
+
+    def run(self):
+        results = []
+        for request_id, request, callback in self.requests:
+            try:
+                results.append((request.handler(), None))
+            except FakeHttpError as e:
+                results.append((None, e))
+        # the callbacks are called once the whole response has arrived:
+        for (request_id, request, callback), result in zip(self.requests, results):
+            if callback:
+                callback(request_id, *result)
+
+
+class FakeResource:
+    def __init__(self, service, methods):
+        self.service = service
+        self.methods = methods
+
+    def __getattr__(self, name):
+        handler = self.methods[name]
+        return lambda **kwargs: FakeRequest(self.service, lambda: handler(**kwargs))
+
+
+class FakeService:
+    """
+    calendars maps a calendar id to a dict with a "summary" and a list of
+    "events", each a dict shaped like the API's event resources.
+    """
+
+    def __init__(
+        self,
+        calendars,
+        latency=0.0,
+        failure_rate=0.0,
+        max_items=50,
+        max_span_days=60,
+        max_batch=50,
+        seed=0,
+    ):
+        self.calendars = calendars
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_items = max_items
+        self.max_span_days = max_span_days
+        self.max_batch = max_batch
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.parsed = {}
+        self.version = 0  # bumped by every change, and used as sync token
+        self.versions = {}  # (calendar id, event id) -> version of last change
+        self.oldest_sync_token = 0
+
+    def call(self, handler):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self.random.random() < self.failure_rate
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if fail:
+                raise FakeHttpError(503, "backend error")
+            return handler()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def freebusy(self):
+        return FakeResource(self, {"query": self.freebusy_query})
+
+    def events(self):
+        return FakeResource(self, {"list": self.events_list})
+
+    def calendarList(self):
+        return FakeResource(self, {"list": self.calendar_list})
+
+    def calendar_events(self, calendarId):
+        if calendarId not in self.calendars:
+            raise FakeHttpError(404, "calendar not found: " + calendarId)
+        return self.calendars[calendarId]["events"]
+
+    def busy_spans(self, calendarId):
+        """
+        (start, end) of the opaque events of a calendar, parsed once.
+        """
+        if calendarId not in self.parsed:
+            self.parsed[calendarId] = [
+                (event_time(ev["start"]), event_time(ev["end"]))
+                for ev in self.calendar_events(calendarId)
+                if ev.get("transparency") != "transparent"
+                and ev.get("status") != "cancelled"
+            ]
+        return self.parsed[calendarId]
+
+    def freebusy_query(self, body):
+        if len(body["items"]) > self.max_items:
+            raise FakeHttpError(400, "too many calendars requested")
+        time_min = arrow.get(body["timeMin"])
+        time_max = arrow.get(body["timeMax"])
+        if time_max > time_min.replace(days=+self.max_span_days):
+            raise FakeHttpError(400, "the requested time range is too long")
+        calendars = {}
+        for item in body["items"]:
+            if item["id"] not in self.calendars:
+                calendars[item["id"]] = {"errors": [{"reason": "notFound"}]}
+                continue
+            busy = []
+            for start, end in self.busy_spans(item["id"]):
+                if end > time_min and start < time_max:
+                    busy.append(
+                        {
+                            "start": max(start, time_min).isoformat(),
+                            "end": min(end, time_max).isoformat(),
+                        }
+                    )
+            calendars[item["id"]] = {"busy": busy}
+        return {
+            "timeMin": body["timeMin"],
+            "timeMax": body["timeMax"],
+            "calendars": calendars,
+        }
+
+    def put_event(self, calendarId, event):
+        """
+        Adds or replaces an event, as if it had been edited in the calendar.
+        """
+        with self.lock:
+            events = self.calendars[calendarId]["events"]
+            events[:] = [ev for ev in events if ev["id"] != event["id"]] + [event]
+            self.version += 1
+            self.versions[(calendarId, event["id"])] = self.version
+            self.parsed.pop(calendarId, None)
+
+    def delete_event(self, calendarId, event_id):
+        cancelled = {"id": event_id, "status": "cancelled"}
+        self.put_event(calendarId, cancelled)
+
+    def expire_sync_tokens(self):
+        self.oldest_sync_token = self.version
+
+    def events_list(
+        self,
+        calendarId,
+        timeMin=None,
+        timeMax=None,
+        maxResults=250,
+        pageToken=None,
+        syncToken=None,
+        q=None,
+        showDeleted=False,
+        **kwargs
+    ):
+        events = self.calendar_events(calendarId)
+        if syncToken is not None:
+            if int(syncToken) < self.oldest_sync_token:
+                raise FakeHttpError(410, "sync token is no longer valid")
+            events = [
+                ev
+                for ev in events
+                if self.versions.get((calendarId, ev["id"]), 0) > int(syncToken)
+            ]
+        elif not showDeleted:
+            events = [ev for ev in events if ev.get("status") != "cancelled"]
+        if q:
+            # every term, in any of the event's text fields:
+            terms = q.lower().split()
+            events = [
+                ev
+                for ev in events
+                if all(term in searchable_text(ev) for term in terms)
+            ]
+        if timeMin:
+            events = [ev for ev in events if event_time(ev["end"]) > arrow.get(timeMin)]
+        if timeMax:
+            events = [
+                ev for ev in events if event_time(ev["start"]) < arrow.get(timeMax)
+            ]
+        if syncToken is None:
+            events = sorted(events, key=lambda ev: event_time(ev["start"]))
+        offset = int(pageToken or 0)
+        page = events[offset : offset + maxResults]
+        result = {"items": page}
+        if offset + maxResults < len(events):
+            result["nextPageToken"] = str(offset + maxResults)
+        else:
+            result["nextSyncToken"] = str(self.version)
+        return result
+
+    def calendar_list(self, **kwargs):
+        return {
+            "items": [
+                {"id": id, "summary": cal.get("summary", id)}
+                for id, cal in sorted(self.calendars.items())
+            ]
+        }
+
+
+def event_time(time):
+    """
+    The start or end of an event, timed or all-day.
+    """
+    return arrow.get(time.get("dateTime", time.get("date")))
+
+
+def searchable_text(event):
+    fields = [event.get(name, "") for name in ("summary", "description", "location")]
+    fields += [attendee.get("email", "") for attendee in event.get("attendees", [])]
+    return " ".join(fields).lower()
+
+
+def random_calendars(count, start, end, events=100, max_minutes=120, seed=0):
+    """
+    count calendars with events randomly placed between start and end, on a
+    quarter-hour grid.
+    """
+    rng = random.Random(seed)
+    span = int((end - start).total_seconds() // 900)
+    calendars = {}
+    for n in range(count):
+        id = "calendar-%d@fake" % n
+        evs = []
+        for i in range(events):
+            ev_start = start.replace(minutes=+15 * rng.randrange(span))
+            ev_end = ev_start.replace(minutes=+15 * rng.randint(1, max_minutes // 15))
+            evs.append(
+                {
+                    "id": "%d-%d" % (n, i),
+                    "summary": "event %d" % i,
+                    "start": {"dateTime": ev_start.isoformat()},
+                    "end": {"dateTime": ev_end.isoformat()},
+                }
+            )
+        calendars[id] = {"summary": "calendar %d" % n, "events": evs}
+    return calendars
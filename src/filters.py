@@ -0,0 +1,162 @@
+"""
+Filtering which events count, as early as possible.
+
+An EventFilter drops events by summary (a regex to match, and regexes to
+ignore), free text search terms, minimum duration, status (the event's own,
+or the user's response to it), transparency, or an arbitrary predicate, and
+may be limited to some calendars.  Each check runs where it is cheapest:
+
+ + search terms are sent to events().list as its q parameter, so events that
+   do not match are never transferred (and deleted events are not asked
+   for);
+ + in .ics files, the raw SUMMARY, STATUS, TRANSP, DESCRIPTION and LOCATION
+   lines of an event are checked before any objects are built for it (see
+   src.ics);
+ + everything else is checked on each event, in the shape of the API's
+   event resources, before it is used.
+
+Free/busy queries only report busy times, not events, so calendars that a
+filter applies to are read through events().list instead.
+"""
+import re
+
+from src.utils import epoch
+
+# the raw .ics properties matches_raw looks at:
+RAW_PROPERTIES = (b"SUMMARY", b"STATUS", b"TRANSP", b"DESCRIPTION", b"LOCATION")
+
+
+class EventFilter:
+    def __init__(
+        self,
+        match=None,
+        ignore=(),
+        search=None,
+        min_duration=0,
+        statuses=(),
+        transparent=False,
+        calendars=None,
+        predicate=None,
+    ):
+        """
+        match and ignore are regexes over event summaries; search is free
+        text whose terms must all appear in the event; min_duration is in
+        seconds; statuses are statuses (e.g. tentative) or responses (e.g.
+        declined) to ignore; transparent ignores events that are marked as
+        free; calendars limits the filter to those calendar ids (None for
+        all of them); and
+        predicate(event) must be true of the events that are kept.
+        """
+        self.match = re.compile(match) if match else None
+        self.ignore = [re.compile(pattern) for pattern in ignore]
+        self.terms = search.lower().split() if search else []
+        self.min_duration = min_duration
+        self.statuses = set(status.lower() for status in statuses)
+        self.transparent = transparent
+        self.calendars = None if calendars is None else set(calendars)
+        self.predicate = predicate
+
+    def __bool__(self):
+        return bool(
+            self.match
+            or self.ignore
+            or self.terms
+            or self.min_duration
+            or self.statuses
+            or self.transparent
+            or self.predicate
+        )
+
+    def applies(self, calendar):
+        return bool(self) and (self.calendars is None or calendar in self.calendars)
+
+    def query(self):
+        """
+        The events().list parameters that filter on the server.
+        """
+        params = {"showDeleted": False}
+        if self.terms:
+            params["q"] = " ".join(self.terms)
+        return params
+
+    def matches_summary(self, summary):
+        if self.match and not self.match.search(summary):
+            return False
+        return not any(pattern.search(summary) for pattern in self.ignore)
+
+    def matches_raw(self, props):
+        """
+        A check on the raw properties of an .ics event: could it be kept?
+        """
+        if not self.matches_summary(raw_text(props.get(b"SUMMARY", b""))):
+            return False
+        if raw_text(props.get(b"STATUS", b"")).lower() in self.statuses:
+            return False
+        if self.transparent and props.get(b"TRANSP", b"").upper() == b"TRANSPARENT":
+            return False
+        if self.terms:
+            text = " ".join(
+                raw_text(props.get(name, b""))
+                for name in (b"SUMMARY", b"DESCRIPTION", b"LOCATION")
+            ).lower()
+            return all(term in text for term in self.terms)
+        return True
+
+    def matches(self, event):
+        """
+        Is an event (in the shape of the API's event resources) kept?  Search
+        terms are left to the API, or to matches_raw.
+        """
+        if not self.matches_summary(event.get("summary", "")):
+            return False
+        if event.get("status", "").lower() in self.statuses:
+            return False
+        for attendee in event.get("attendees", []):
+            if attendee.get("self"):
+                response = attendee.get("responseStatus", "").lower()
+                if response in self.statuses:
+                    return False
+        if self.transparent and event.get("transparency") == "transparent":
+            return False
+        if self.min_duration and duration(event) < self.min_duration:
+            return False
+        return self.predicate is None or self.predicate(event)
+
+
+def counts_as_busy(event):
+    """
+    Does an event make its calendar busy, as free/busy queries count it:
+    neither cancelled, marked as free nor declined?
+    """
+    if event.get("status") == "cancelled":
+        return False
+    if event.get("transparency") == "transparent":
+        return False
+    return not any(
+        attendee.get("self") and attendee.get("responseStatus") == "declined"
+        for attendee in event.get("attendees", [])
+    )
+
+
+# backslash escapes in .ics TEXT values:
+ESCAPE = re.compile(r"\\([\\;,nN])")
+
+
+def raw_text(value):
+    """
+    A raw .ics TEXT value as a string, unescaped.
+    """
+    return ESCAPE.sub(
+        lambda m: "\n" if m.group(1) in "nN" else m.group(1),
+        value.decode("utf8", "replace"),
+    )
+
+
+def duration(event):
+    """
+    The length of an event in seconds; an event with no end has none.
+    """
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    end = event.get("end", {})
+    end = end.get("dateTime", end.get("date", start))
+    return epoch(end) - epoch(start)
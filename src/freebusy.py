@@ -0,0 +1,167 @@
+"""
+Chunked, concurrent freebusy queries.
+
+The Google API caps both the number of calendars (items) and the time span of
+a single freebusy().query.  query_freebusy splits a query into calendar
+batches and time windows, runs the chunks on a bounded thread pool with
+retries and exponential backoff, and stitches the busy times back together
+per calendar.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import timings
+from src.tz import parse_epoch
+
+MAX_ITEMS = 50  # calendars per request
+MAX_SPAN_DAYS = 60  # days per request
+MAX_WORKERS = 8
+RETRIES = 5
+BACKOFF = 0.5  # seconds, doubled after every failed attempt
+
+# HTTP statuses worth retrying: rate limits and server errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 403s are only rate limits with these reasons; others (a calendar that is
+# not shared, say) will not go away by retrying:
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+class FreeBusyError(ValueError):
+    """
+    The busy times of a calendar could not be read, e.g. because its id is
+    wrong or it is not shared with the user.
+    """
+
+
+def error_reasons(error):
+    """
+    The reasons given in the JSON body of an HttpError.
+    """
+    try:
+        errors = json.loads(error.content)["error"].get("errors", [])
+        return [item.get("reason") for item in errors]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return []
+
+
+def is_retryable(error):
+    resp = getattr(error, "resp", None)
+    if resp is not None:
+        status = int(getattr(resp, "status", 0))
+        if status == 403:
+            return any(reason in RATE_LIMIT_REASONS for reason in error_reasons(error))
+        return status in RETRY_STATUSES
+    return isinstance(error, OSError)
+
+
+def with_retries(call, retries=RETRIES, backoff=BACKOFF):
+    """
+    Runs call(), retrying transient failures with exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as error:
+            if attempt == retries or not is_retryable(error):
+                raise
+            # full jitter, so that concurrent chunks don't retry in lockstep:
+            time.sleep(random.uniform(0, backoff * 2**attempt))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def shared_pool(workers):
+    """
+    A persistent thread pool, so that each worker's service object (see
+    src.credentials.get_thread_service) is reused across queries.
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers)
+        return _pools[workers]
+
+
+def time_windows(start, end, max_span_days=MAX_SPAN_DAYS):
+    """
+    Splits start..end into consecutive windows of at most max_span_days.
+    """
+    windows = []
+    while start < end:
+        window_end = min(start.replace(days=+max_span_days), end)
+        windows.append((start, window_end))
+        start = window_end
+    return windows
+
+
+def batches(items, size=MAX_ITEMS):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def query_freebusy(
+    get_service,
+    calendar_ids,
+    start,
+    end,
+    time_zone,
+    max_items=MAX_ITEMS,
+    max_span_days=MAX_SPAN_DAYS,
+    max_workers=MAX_WORKERS,
+    retries=RETRIES,
+    backoff=BACKOFF,
+):
+    """
+    Returns a dict mapping each calendar id to its busy times, as a list of
+    (start, end) epoch seconds pairs ordered by start time.  Raises
+    FreeBusyError if the API reports errors for a calendar, rather than take
+    it to be free.
+
+    get_service() is called on the worker threads, and must return a service
+    object that is safe to use on the calling thread.
+    """
+
+    def query(ids, window_start, window_end):
+        fb_q = {
+            "timeMin": window_start.isoformat(),
+            "timeMax": window_end.isoformat(),
+            "timeZone": time_zone,
+            "items": [{"id": id} for id in ids],
+        }
+        with timings.phase("api.freebusy") as p:
+            result = with_retries(
+                lambda: get_service().freebusy().query(body=fb_q).execute(),
+                retries,
+                backoff,
+            )
+            p.count(sum(len(t.get("busy", [])) for t in result["calendars"].values()))
+        return result
+
+    chunks = [
+        (ids, window_start, window_end)
+        for ids in batches(list(calendar_ids), max_items)
+        for window_start, window_end in time_windows(start, end, max_span_days)
+    ]
+    busy = {id: [] for id in calendar_ids}
+    if not chunks:
+        return busy
+    results = list(shared_pool(max_workers).map(lambda chunk: query(*chunk), chunks))
+    with timings.phase("freebusy.parse") as p:
+        for result in results:
+            for id, times in result["calendars"].items():
+                if times.get("errors"):
+                    reasons = [error.get("reason", "") for error in times["errors"]]
+                    raise FreeBusyError(
+                        "can't read calendar %s: %s" % (id, ", ".join(reasons))
+                    )
+                busy.setdefault(id, []).extend(
+                    (parse_epoch(t["start"]), parse_epoch(t["end"]))
+                    for t in times.get("busy", [])
+                )
+        for times in busy.values():
+            times.sort(key=lambda t: t[0])
+            p.count(len(times))
+    return busy
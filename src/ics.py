@@ -2,29 +2,474 @@ import datetime
 import os
 import icalendar
 import arrow
+from dateutil import rrule
 
+from src import timings
+from src.utils import Event, Interval, events_flatten
 
-def get_ics_calendar_events(calendar: os.path):
-    events_list = []
-    with open(calendar, "r") as cal:
-        ics_cal = icalendar.Calendar.from_ical(cal.read())
-        for i in ics_cal.walk():
-            if i.name == "VEVENT":
-                start = i["DTSTART"].dt
-                event_dict = {"start": {}, "end": {}, "summary": ""}
-                if type(start) == datetime.datetime:
-                    event_dict["start"]["dateTime"] = arrow.Arrow.fromdatetime(
-                        start, start.tzinfo
-                    )
-                    try:
-                        end = i["DTEND"].dt
-                        event_dict["end"]["dateTime"] = arrow.Arrow.fromdatetime(
-                            end, end.tzinfo
-                        )
-                    except KeyError:
-                        pass
-                else:
-                    event_dict["start"]["date"] = arrow.Arrow.fromdate(start)
-                event_dict["summary"] = i["summary"].to_ical().decode("utf8")
-                events_list.append(event_dict)
-        return events_list
+# Events are read one VEVENT at a time, so memory stays bounded however large
+# the .ics file is.  Before an event is parsed, its raw DTSTART / DTEND dates
+# are compared against the query window, and events that cannot fall inside it
+# are skipped without building any objects.  The same goes for events that an
+# EventFilter (see src.filters) rejects on their raw SUMMARY, STATUS etc.
+
+# A day of slack covers any UTC offset of a floating or TZID time.
+SLACK = datetime.timedelta(days=1)
+
+# The fixed wall-clock length of one period of each frequency (months and
+# years vary):
+PERIODS = {
+    "WEEKLY": datetime.timedelta(weeks=1),
+    "DAILY": datetime.timedelta(days=1),
+    "HOURLY": datetime.timedelta(hours=1),
+    "MINUTELY": datetime.timedelta(minutes=1),
+    "SECONDLY": datetime.timedelta(seconds=1),
+}
+
+
+def iter_vevents(calendar: os.path):
+    """
+    Yields the unfolded content lines (as bytes) of each VEVENT in the file,
+    leaving out the components nested in it, such as VALARMs, so that their
+    properties are not taken for the event's own.
+    """
+    with open(calendar, "rb") as cal:
+        lines = None
+        depth = 0  # of the components nested in the VEVENT
+        for raw in cal:
+            line = raw.rstrip(b"\r\n")
+            if line[:1] in (b" ", b"\t"):
+                # a folded line continues the previous one:
+                if lines and not depth:
+                    lines[-1] += line[1:]
+            elif line == b"BEGIN:VEVENT":
+                lines = []
+                depth = 0
+            elif lines is None:
+                continue
+            elif line.startswith(b"BEGIN:"):
+                depth += 1
+            elif depth and line.startswith(b"END:"):
+                depth -= 1
+            elif line == b"END:VEVENT":
+                yield lines
+                lines = None
+            elif not depth:
+                lines.append(line)
+
+
+def calendar_owner(calendar: os.path):
+    """
+    The address of the calendar's owner, from an X-WR-CALNAME that is an
+    email address (as in Google's exports), or None.
+    """
+    with open(calendar, "rb") as cal:
+        for raw in cal:
+            line = raw.rstrip(b"\r\n")
+            if line.startswith(b"BEGIN:") and line != b"BEGIN:VCALENDAR":
+                return None
+            if line.startswith(b"X-WR-CALNAME"):
+                name = line.split(b":", 1)[-1].strip().decode("utf8", "replace")
+                return name.lower() if "@" in name else None
+    return None
+
+
+def raw_properties(lines, names):
+    """
+    The raw values of the first occurrence of each named property.
+    """
+    found = {}
+    for line in lines:
+        for name in names:
+            if line.startswith(name) and line[len(name) : len(name) + 1] in b";:":
+                if name not in found:
+                    found[name] = line.split(b":", 1)[-1].strip()
+    return found
+
+
+def raw_date(value):
+    """
+    The YYYYMMDD date at the start of a raw DATE / DATE-TIME value, or None.
+    """
+    try:
+        return datetime.datetime.strptime(value[:8].decode("ascii"), "%Y%m%d")
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def raw_duration(value):
+    """
+    The length given by a raw DURATION value (zero if there is none), or
+    None if it cannot be read.
+    """
+    if not value:
+        return datetime.timedelta(0)
+    try:
+        return abs(icalendar.vDuration.from_ical(value.decode("ascii")))
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def raw_until(rule):
+    """
+    The date of a raw RRULE's UNTIL, or None if it has none.
+    """
+    for part in rule.split(b";"):
+        if part.upper().startswith(b"UNTIL="):
+            return raw_date(part[len(b"UNTIL=") :])
+    return None
+
+
+def might_overlap(props, window_start, window_end):
+    """
+    A cheap check on the raw properties: can this event overlap the window?
+    A recurring event's last occurrence is taken from its RRULE's UNTIL.
+    """
+    start = raw_date(props.get(b"DTSTART", b""))
+    if start is None:
+        return True
+    if window_end is not None and start > window_end + SLACK:
+        return False
+    length = raw_duration(props.get(b"DURATION", b""))
+    if length is None:
+        return True
+    end = raw_date(props.get(b"DTEND", b""))
+    if end is not None:
+        length = max(length, end - start)
+    if b"RDATE" in props:
+        return True
+    if b"RRULE" in props:
+        # (UNTIL may be in UTC, and its date is rounded down)
+        until = raw_until(props[b"RRULE"])
+        if until is None:
+            return True
+        start = until + SLACK
+    if window_start is not None and start + length + SLACK < window_start:
+        return False
+    return True
+
+
+def override_key(lines):
+    """
+    The recurrence_key of an override, parsing only its UID and
+    RECURRENCE-ID.
+    """
+    names = (b"UID", b"RECURRENCE-ID")
+    wanted = [
+        line
+        for line in lines
+        if any(
+            line.startswith(name) and line[len(name) : len(name) + 1] in b";:"
+            for name in names
+        )
+    ]
+    i = icalendar.Event.from_ical(
+        b"\r\n".join([b"BEGIN:VEVENT"] + wanted + [b"END:VEVENT", b""])
+    )
+    return recurrence_key(str(i.get("UID")), i["RECURRENCE-ID"].dt)
+
+
+def naive_date(time):
+    return None if time is None else datetime.datetime(time.year, time.month, time.day)
+
+
+def to_arrow(time, tz="UTC"):
+    """
+    An arrow for a DATE or DATE-TIME value; dates are midnight in timezone
+    tz, as the Google API's all-day events are taken to be.
+    """
+    if type(time) == datetime.datetime:
+        return arrow.Arrow.fromdatetime(time, time.tzinfo)
+    else:
+        return arrow.Arrow(time.year, time.month, time.day).replace(tzinfo=tz)
+
+
+def duration(i):
+    """
+    The length of an event, from DTEND or DURATION.
+    """
+    start = i["DTSTART"].dt
+    if "DTEND" in i:
+        return to_arrow(i["DTEND"].dt) - to_arrow(start)
+    elif "DURATION" in i:
+        return i["DURATION"].dt
+    elif type(start) == datetime.datetime:
+        return datetime.timedelta(0)
+    else:
+        return datetime.timedelta(days=1)
+
+
+# ATTENDEE PARTSTATs as the API's attendee responseStatus:
+RESPONSES = {
+    "NEEDS-ACTION": "needsAction",
+    "ACCEPTED": "accepted",
+    "DECLINED": "declined",
+    "TENTATIVE": "tentative",
+}
+
+
+def attendees(i, owner=None):
+    """
+    The event's attendees in the shape of the API's, with the calendar's
+    owner (an email address) as self.
+    """
+    props = i.get("ATTENDEE", [])
+    result = []
+    for prop in props if isinstance(props, list) else [props]:
+        email = str(prop)
+        if email.lower().startswith("mailto:"):
+            email = email[len("mailto:") :]
+        attendee = {"email": email}
+        partstat = str(prop.params.get("PARTSTAT", "NEEDS-ACTION")).upper()
+        attendee["responseStatus"] = RESPONSES.get(partstat, partstat.lower())
+        if owner and email.lower() == owner:
+            attendee["self"] = True
+        result.append(attendee)
+    return result
+
+
+def event_dict(i, start, end, has_end=True, owner=None):
+    """
+    An event in the shape of the Google API's event resources.
+    """
+    ev = {"start": {}, "end": {}, "summary": ""}
+    if type(i["DTSTART"].dt) == datetime.datetime:
+        ev["start"]["dateTime"] = start
+        if has_end:
+            ev["end"]["dateTime"] = end
+    else:
+        ev["start"]["date"] = start
+        ev["end"]["date"] = end
+    if "SUMMARY" in i:
+        ev["summary"] = str(i["SUMMARY"])
+    if "UID" in i:
+        ev["id"] = str(i["UID"])
+    if "STATUS" in i:
+        ev["status"] = str(i["STATUS"]).lower()
+    if str(i.get("TRANSP", "")).upper() == "TRANSPARENT":
+        ev["transparency"] = "transparent"
+    if "ATTENDEE" in i:
+        ev["attendees"] = attendees(i, owner)
+    return ev
+
+
+def values(i, name):
+    """
+    Every date of a (possibly repeated) RDATE / EXDATE property.
+    """
+    props = i.get(name, [])
+    if not isinstance(props, list):
+        props = [props]
+    return [d.dt for prop in props for d in prop.dts]
+
+
+def recurrence_key(uid, time):
+    return (uid, to_arrow(time).to("UTC").isoformat())
+
+
+class Recurrence:
+    """
+    The occurrences of an event with an RRULE and/or RDATEs.
+
+    Occurrences are computed on naive wall-clock times in the event's own
+    timezone and localized one at a time, so they keep their local time
+    across daylight saving transitions.  All-day occurrences start at
+    midnight in day_zone.
+    """
+
+    def __init__(self, i, day_zone="UTC"):
+        self.day_zone = day_zone
+        start = i["DTSTART"].dt
+        self.all_day = type(start) != datetime.datetime
+        if self.all_day:
+            start = datetime.datetime(start.year, start.month, start.day)
+        self.tz = start.tzinfo
+        self.dtstart = start.replace(tzinfo=None)
+        self.duration = duration(i)
+        self.recurs = []
+        rules = i.get("RRULE", [])
+        for rule in rules if isinstance(rules, list) else [rules]:
+            rule = icalendar.vRecur(rule)
+            if "UNTIL" in rule:
+                rule["UNTIL"] = [self.wall_clock(rule["UNTIL"][0], True)]
+            self.recurs.append(rule)
+        self.rdates = [self.wall_clock(time) for time in values(i, "RDATE")]
+        self.exdates = [self.wall_clock(time) for time in values(i, "EXDATE")]
+
+    def rules(self, lower):
+        """
+        The occurrences as an rruleset, with each rule started as late as it
+        can be while still producing every occurrence from lower onwards.
+        """
+        rules = rrule.rruleset()
+        for rule in self.recurs:
+            rule, dtstart = self.rebased(rule, lower)
+            if rule is not None:
+                rules.rrule(rrule.rrulestr(rule.to_ical().decode(), dtstart=dtstart))
+        for time in self.rdates:
+            rules.rdate(time)
+        for time in self.exdates:
+            rules.exdate(time)
+        return rules
+
+    def rebased(self, rule, lower):
+        """
+        The rule (or None, if it has no occurrences left) and a DTSTART moved
+        forward by whole INTERVALs to just before lower, so that the
+        occurrences before the window are not generated one by one.  Only
+        rules whose periods are a fixed length of wall-clock time are moved,
+        and those with a COUNT only if each period has one occurrence (no
+        BY* parts), so that the COUNT can be reduced by the periods skipped.
+        """
+        step = PERIODS.get(rule["FREQ"][0])
+        if step is None or lower <= self.dtstart:
+            return rule, self.dtstart
+        if "COUNT" in rule and any(key.startswith("BY") for key in rule):
+            return rule, self.dtstart
+        period = step * int(rule.get("INTERVAL", [1])[0])
+        skipped = (lower - self.dtstart) // period
+        if "COUNT" in rule:
+            left = int(rule["COUNT"][0]) - skipped
+            if left <= 0:
+                return None, self.dtstart
+            rule = icalendar.vRecur(rule)
+            rule["COUNT"] = [left]
+        return rule, self.dtstart + skipped * period
+
+    def wall_clock(self, time, until=False):
+        """
+        A DATE or DATE-TIME as a naive time in the event's timezone.
+        """
+        if type(time) != datetime.datetime:
+            time = datetime.datetime(time.year, time.month, time.day)
+            if until:
+                # an UNTIL date includes the whole day:
+                time += datetime.timedelta(days=1, seconds=-1)
+            return time
+        if time.tzinfo is not None and self.tz is not None:
+            time = time.astimezone(self.tz)
+        elif time.tzinfo is not None:
+            time = time.astimezone(datetime.timezone.utc)
+        return time.replace(tzinfo=None)
+
+    def localize(self, time):
+        if self.all_day:
+            return time.date()
+        if self.tz is None:
+            return time
+        if hasattr(self.tz, "localize"):
+            return self.tz.normalize(self.tz.localize(time))
+        return time.replace(tzinfo=self.tz)
+
+    def between(self, start, end):
+        """
+        Lazily generates the occurrences overlapping start..end, as their
+        local DTSTART plus start and end arrows; occurrences outside the
+        window are never built.
+        """
+        lower = self.dtstart
+        if start is not None:
+            lower = self.wall_clock((start - self.duration - SLACK).datetime)
+        upper = self.wall_clock((end + SLACK).datetime)
+        for time in self.rules(lower).xafter(lower, inc=True):
+            if time > upper:
+                return
+            occ_start = to_arrow(self.localize(time), self.day_zone)
+            occ_end = occ_start + self.duration
+            if (start is None or occ_end > start) and occ_start < end:
+                yield self.localize(time), occ_start, occ_end
+
+
+def get_ics_calendar_events(
+    calendar: os.path, start=None, end=None, event_filter=None, tz="UTC"
+):
+    """
+    Generates the events of an .ics file overlapping start..end (either of
+    which may be None for an open-ended window), and kept by event_filter.
+    All-day events start at midnight in timezone tz.
+
+    Recurring events are expanded within the window (with EXDATEs and
+    RECURRENCE-ID overrides applied) once the whole file has been read; with
+    no end to the window they are reported once, at their DTSTART.  Only the
+    recurring events that may reach the window are kept until then: those
+    whose RRULE has no UNTIL (or that have RDATEs) are, however old.  Of the
+    overrides moved to times outside the window, only the occurrence they
+    replace is remembered.
+    """
+    from src.filters import RAW_PROPERTIES
+
+    window_start = naive_date(start)
+    window_end = naive_date(end)
+    names = (b"DTSTART", b"DTEND", b"DURATION", b"RRULE", b"RDATE", b"RECURRENCE-ID")
+    rule_names = (b"RRULE:", b"RRULE;")
+    if event_filter:
+        names += RAW_PROPERTIES
+    owner = calendar_owner(calendar)
+    recurring = []
+    overridden = set()
+    for lines in iter_vevents(calendar):
+        props = raw_properties(lines, names)
+        if sum(line.startswith(rule_names) for line in lines) > 1:
+            # only the first RRULE is read raw, so the rules are unbounded:
+            props[b"RRULE"] = b""
+        if b"RECURRENCE-ID" in props:
+            # an override may move an occurrence out of the window (or replace
+            # it with an event that is filtered out), and then only hides the
+            # occurrence it replaces:
+            if not might_overlap(props, window_start, window_end):
+                overridden.add(override_key(lines))
+                continue
+        elif not might_overlap(props, window_start, window_end) or (
+            event_filter and not event_filter.matches_raw(props)
+        ):
+            continue
+        i = icalendar.Event.from_ical(
+            b"\r\n".join([b"BEGIN:VEVENT"] + lines + [b"END:VEVENT", b""])
+        )
+        if "RECURRENCE-ID" in i:
+            overridden.add(recurrence_key(str(i.get("UID")), i["RECURRENCE-ID"].dt))
+            if str(i.get("STATUS", "")).upper() == "CANCELLED":
+                continue
+            if event_filter and not event_filter.matches_raw(props):
+                continue
+        elif end is not None and ("RRULE" in i or "RDATE" in i):
+            recurring.append(i)
+            continue
+        ev_start = to_arrow(i["DTSTART"].dt, tz)
+        ev_end = ev_start + duration(i)
+        if (end is not None and ev_start >= end) or (
+            start is not None and ev_end <= start
+        ):
+            continue
+        ev = event_dict(i, ev_start, ev_end, "DTEND" in i or "DURATION" in i, owner)
+        if event_filter is None or event_filter.matches(ev):
+            yield ev
+
+    for i in recurring:
+        uid = str(i.get("UID"))
+        for time, occ_start, occ_end in Recurrence(i, tz).between(start, end):
+            if recurrence_key(uid, time) not in overridden:
+                ev = event_dict(i, occ_start, occ_end, owner=owner)
+                if event_filter is None or event_filter.matches(ev):
+                    yield ev
+
+
+@timings.timed("ics.parse", count=lambda cal: len(cal.events))
+def get_ics_interval(calendar: os.path, start, end, event_filter=None, tz="UTC"):
+    """
+    The busy times of an .ics calendar between start and end, counting only
+    the events kept by event_filter (with all-day events in timezone tz),
+    and, like free/busy queries, neither those marked as free nor those
+    its owner declined.
+    """
+    from src.filters import counts_as_busy
+
+    events = []
+    for ev in get_ics_calendar_events(calendar, start, end, event_filter, tz):
+        if not counts_as_busy(ev):
+            continue
+        ev_start = ev["start"].get("dateTime", ev["start"].get("date"))
+        ev_end = ev["end"].get("dateTime", ev["end"].get("date", ev_start))
+        events.append(Event(max(ev_start, start), min(ev_end, end)))
+    events.sort(key=lambda ev: ev.s)
+    return Interval(start, events_flatten(events), end)
@@ -0,0 +1,266 @@
+"""
+Incremental maintenance of availability as calendars change.
+
+Availability from busy and free calendars is ~(busy in any) & (free in all).
+Rather than recomputing it from every calendar when one changes, a single
+count is kept over the window: how many busy calendars cover each moment,
+plus how many free calendars do not.  The time is available exactly where
+that count is zero.
+
+Each calendar keeps its own coverage count (how many of its events cover
+each moment), so that overlapping events can be added and removed
+independently; only where a calendar's coverage flips between zero and
+non-zero does the shared count change.  Both are step functions held as
+sorted lists of change times, updated by bisection, so an update touches
+only the time ranges of the events that changed.
+"""
+import bisect
+
+from src.utils import Event, Interval, epoch
+
+
+class Steps:
+    """
+    A step function over the window lo..hi: values[i] holds from times[i]
+    until times[i + 1] (or hi).  Neighbouring values always differ.
+    """
+
+    def __init__(self, lo, hi, initial=0, deltas=()):
+        """
+        Starts at initial everywhere, plus the sum of the (time, delta)
+        pairs in deltas up to each time.
+        """
+        self.lo, self.hi = lo, hi
+        self.times = [lo]
+        self.values = [initial]
+        value = initial
+        for time, delta in sorted(deltas):
+            value += delta
+            time = min(max(time, lo), hi)
+            if time == hi:
+                continue
+            if time == self.times[-1]:
+                self.values[-1] = value
+                if len(self.times) > 1 and self.values[-2] == value:
+                    del self.times[-1], self.values[-1]
+            elif value != self.values[-1]:
+                self.times.append(time)
+                self.values.append(value)
+
+    def split(self, time):
+        """
+        The index of the step starting at time, splitting a step if need be.
+        """
+        i = bisect.bisect_right(self.times, time) - 1
+        if self.times[i] == time:
+            return i
+        self.times.insert(i + 1, time)
+        self.values.insert(i + 1, self.values[i])
+        return i + 1
+
+    def join(self, i):
+        """
+        Merges step i into the one before it, if they have the same value.
+        """
+        if 0 < i < len(self.times) and self.values[i] == self.values[i - 1]:
+            del self.times[i], self.values[i]
+
+    def end(self, i):
+        return self.times[i + 1] if i + 1 < len(self.times) else self.hi
+
+    def add(self, start, end, delta):
+        """
+        Adds delta between start and end, and returns the (start, end,
+        nonzero) ranges where the value changed between zero and non-zero.
+        """
+        start, end = max(start, self.lo), min(end, self.hi)
+        if start >= end or not delta:
+            return []
+        first = self.split(start)
+        last = self.split(end) if end < self.hi else len(self.times)
+        flipped = []
+        for i in range(first, last):
+            before = self.values[i]
+            self.values[i] = before + delta
+            if (before == 0) != (self.values[i] == 0):
+                step_start, step_end = self.times[i], self.end(i)
+                nonzero = self.values[i] != 0
+                if flipped and flipped[-1][1:] == (step_start, nonzero):
+                    flipped[-1] = (flipped[-1][0], step_end, nonzero)
+                else:
+                    flipped.append((step_start, step_end, nonzero))
+        self.join(last)
+        self.join(first)
+        return flipped
+
+    def zeros(self, start=None, end=None):
+        """
+        The (start, end) ranges between start and end where the value is zero.
+        """
+        start = self.lo if start is None else max(start, self.lo)
+        end = self.hi if end is None else min(end, self.hi)
+        ranges = []
+        i = max(bisect.bisect_right(self.times, start) - 1, 0)
+        while i < len(self.times) and self.times[i] < end:
+            if self.values[i] == 0:
+                ranges.append((max(self.times[i], start), min(self.end(i), end)))
+            i += 1
+        return ranges
+
+
+def merge(ranges):
+    """
+    Sorted (start, end) ranges, with overlapping and touching ones merged.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def difference(first, second):
+    """
+    The parts of the sorted, disjoint ranges in first not in second.
+    """
+    result = []
+    j = 0
+    for start, end in first:
+        while j < len(second) and second[j][1] <= start:
+            j += 1
+        k = j
+        while k < len(second) and second[k][0] < end:
+            if second[k][0] > start:
+                result.append((start, second[k][0]))
+            start = max(start, second[k][1])
+            k += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+class Availability:
+    """
+    ~(busy in any of busy) & (free in all of free) between start and end,
+    kept up to date as events are added to and removed from the calendars.
+
+    busy and free map calendar ids to Intervals (or ArrayIntervals); a
+    calendar may be in both.
+    """
+
+    def __init__(self, start, end, busy, free):
+        self.start, self.end = start, end
+        self.lo, self.hi = epoch(start), epoch(end)
+        # keyed by (sign, id), where sign is what being covered by the
+        # calendar adds to count, so that a calendar can be busy and free:
+        self.calendars = {}
+        deltas = []
+        for calendars, sign in ((busy, 1), (free, -1)):
+            for id, interval in calendars.items():
+                self.calendars[sign, id] = self.steps(interval)
+                for s, e in self.coverage((sign, id)):
+                    deltas += [(s, sign), (e, -sign)]
+        # nothing is free until all of the free calendars cover it:
+        self.count = Steps(self.lo, self.hi, len(free), deltas)
+
+    def roles(self, id):
+        """
+        The (sign, id) keys of calendar id, as busy and / or free.
+        """
+        keys = [(sign, id) for sign in (1, -1) if (sign, id) in self.calendars]
+        if not keys:
+            raise KeyError(id)
+        return keys
+
+    def steps(self, interval):
+        # from the events themselves rather than the flattened index(), so
+        # that each of two overlapping events can be removed on its own:
+        deltas = []
+        for ev in interval.events:
+            deltas += [(int(ev.s), 1), (int(ev.e), -1)]
+        return Steps(self.lo, self.hi, 0, deltas)
+
+    def coverage(self, key):
+        """
+        The (start, end) ranges covered by the calendar with (sign, id) key.
+        """
+        steps = self.calendars[key]
+        return merge(
+            (steps.times[i], steps.end(i))
+            for i in range(len(steps.times))
+            if steps.values[i]
+        )
+
+    def track(self, touched, apply):
+        """
+        Calls apply(), which changes the count only within the touched
+        ranges, and returns the resulting (start, end, available) changes.
+        """
+        before = [self.count.zeros(s, e) for s, e in touched]
+        apply()
+        changes = []
+        for (s, e), was_free in zip(touched, before):
+            now_free = self.count.zeros(s, e)
+            changes += [(a, b, True) for a, b in difference(now_free, was_free)]
+            changes += [(a, b, False) for a, b in difference(was_free, now_free)]
+        return sorted(changes)
+
+    def update(self, id, added=(), removed=()):
+        """
+        Adds and removes (start, end) events of calendar id, and returns
+        the changes to the availability as (start, end, available) ranges.
+        """
+        keys = self.roles(id)
+        removed = [(epoch(s), epoch(e), -1) for s, e in removed]
+        added = [(epoch(s), epoch(e), 1) for s, e in added]
+
+        def apply():
+            for sign, _ in keys:
+                steps = self.calendars[sign, id]
+                for s, e, delta in removed + added:
+                    for flip_start, flip_end, covered in steps.add(s, e, delta):
+                        self.count.add(flip_start, flip_end, sign if covered else -sign)
+
+        return self.track(merge((s, e) for s, e, _ in removed + added if s < e), apply)
+
+    def replace(self, id, interval):
+        """
+        Replaces the events of calendar id with those of interval, and
+        returns the changes to the availability, as update does.  This
+        rebuilds the calendar from all of its events; update is cheaper
+        when the changed events are known.
+        """
+        covered, uncovered = [], []
+        for key in self.roles(id):
+            old = self.coverage(key)
+            self.calendars[key] = self.steps(interval)
+            new = self.coverage(key)
+            covered.append((key[0], difference(new, old)))
+            uncovered.append((key[0], difference(old, new)))
+
+        def apply():
+            for sign, ranges in covered:
+                for s, e in ranges:
+                    self.count.add(s, e, sign)
+            for sign, ranges in uncovered:
+                for s, e in ranges:
+                    self.count.add(s, e, -sign)
+
+        touched = [r for _, ranges in covered + uncovered for r in ranges]
+        return self.track(merge(touched), apply)
+
+    def index(self):
+        """
+        The available times, as (starts, ends) lists of epoch seconds.
+        """
+        zeros = self.count.zeros()
+        return [s for s, e in zeros], [e for s, e in zeros]
+
+    def interval(self, interval_class=Interval):
+        starts, ends = self.index()
+        if hasattr(interval_class, "from_arrays"):
+            return interval_class.from_arrays(self.start, starts, ends, self.end)
+        events = [Event(s, e) for s, e in zip(starts, ends)]
+        return interval_class(self.start, events, self.end)
@@ -0,0 +1,213 @@
+"""
+Batch formatting of availability and agenda output.
+
+Converting and formatting one event at a time through arrow dominated the
+time taken to print a long availability list.  Here whole calendars are
+formatted at once: epoch seconds are converted to local time through the
+zone's cached offset table (see src.tz), the formatted date and time-of-day
+parts are cached (a month of quarter-hour slots only has ~30 distinct days
+and 96 distinct times), and lines are written in large buffered chunks.
+Event.human_str uses the same formatting.
+
+Besides the human readable "text" format, results can be streamed as json
+(one array), jsonl (one object per line), csv or ics, with times in the
+output timezone (ics uses UTC, which needs no VTIMEZONE definitions).
+"""
+import csv
+import datetime
+import functools
+import io
+import json
+
+import arrow.locales
+
+from src.tz import DAY, get_zone
+from src.tz import date as tz_date
+
+FORMATS = ["text", "json", "jsonl", "csv", "ics"]
+BUFFER = 1000  # lines per write
+
+MONTHS = arrow.locales.EnglishLocale.month_names
+
+
+class LocalTimes:
+    """
+    Epoch seconds as times in one timezone, with cached formatted parts.
+    """
+
+    def __init__(self, tz):
+        self.name = tz
+        self.zone = get_zone(tz)
+        self.days = {}
+        self.clocks = {}
+        self.offsets = {}
+
+    def day(self, day):
+        # "MMMM DD @ " in arrow's terms:
+        if day not in self.days:
+            date = tz_date(day)
+            self.days[day] = "%s %02d @ " % (MONTHS[date.month], date.day)
+        return self.days[day]
+
+    def clock(self, seconds):
+        # "h:mma" in arrow's terms:
+        key = seconds // 60
+        if key not in self.clocks:
+            hour, minute = divmod(key, 60)
+            meridian = "am" if hour < 12 else "pm"
+            self.clocks[key] = "%d:%02d%s" % (hour % 12 or 12, minute, meridian)
+        return self.clocks[key]
+
+    def slot_text(self, start, end):
+        """
+        The same text as Event.human_str, in this timezone.
+        """
+        left_day, left = divmod(self.zone.local(start), DAY)
+        right_day, right = divmod(self.zone.local(end), DAY)
+        if left_day == right_day:
+            text = self.day(left_day) + self.clock(left) + "-" + self.clock(right)
+        else:
+            text = (
+                self.day(left_day)
+                + self.clock(left)
+                + "-"
+                + self.day(right_day)
+                + self.clock(right)
+            )
+        return text + " " + self.name
+
+    def iso(self, time):
+        if isinstance(time, datetime.date):
+            return time.isoformat()  # an all-day event's date
+        offset = self.zone.offset(time)
+        day, seconds = divmod(time + offset, DAY)
+        if offset not in self.offsets:
+            sign = "-" if offset < 0 else "+"
+            self.offsets[offset] = "%s%02d:%02d" % (
+                (sign,) + divmod(abs(offset) // 60, 60)
+            )
+        hours, seconds = divmod(seconds, 3600)
+        return "%sT%02d:%02d:%02d%s" % (
+            tz_date(day).isoformat(),
+            hours,
+            seconds // 60,
+            seconds % 60,
+            self.offsets[offset],
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def local_times(tz):
+    """
+    A shared LocalTimes for a timezone.
+    """
+    return LocalTimes(tz)
+
+
+def ics_time(time):
+    if isinstance(time, datetime.date):
+        return ";VALUE=DATE:" + time.strftime("%Y%m%d")
+    return ":" + datetime.datetime.utcfromtimestamp(time).strftime("%Y%m%dT%H%M%SZ")
+
+
+class Writer:
+    """
+    Streams records, each a start, an end and an optional summary, to out
+    in one of FORMATS.  Starts and ends are epoch seconds, or dates for
+    all-day events.  Lines are buffered, and written every flush_every of
+    them; text lines come from text(times, start, end, summary).
+    """
+
+    def __init__(self, out, format, tz, text=None, flush_every=BUFFER):
+        if format not in FORMATS:
+            raise ValueError("unknown output format: " + format)
+        self.out = out
+        self.format = format
+        self.times = LocalTimes(tz)
+        self.text = text or (
+            lambda times, start, end, summary: times.slot_text(start, end)
+        )
+        self.flush_every = flush_every
+        self.buffer = io.StringIO()
+        self.csv = csv.writer(self.buffer, lineterminator="\n")
+        self.lines = 0
+        self.count = 0
+        self.stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        if format == "json":
+            self.buffer.write("[")
+        elif format == "csv":
+            self.csv.writerow(["start", "end", "summary"])
+        elif format == "ics":
+            self.buffer.write(
+                "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//calculendar//EN\r\n"
+            )
+
+    def write(self, start, end, summary=None):
+        if self.format == "text":
+            self.buffer.write(self.text(self.times, start, end, summary) + "\n")
+        elif self.format in ("json", "jsonl"):
+            record = {"start": self.times.iso(start), "end": self.times.iso(end)}
+            if summary is not None:
+                record["summary"] = summary
+            if self.format == "json":
+                self.buffer.write(",\n" if self.count else "\n")
+                self.buffer.write(json.dumps(record))
+            else:
+                self.buffer.write(json.dumps(record) + "\n")
+        elif self.format == "csv":
+            self.csv.writerow(
+                [self.times.iso(start), self.times.iso(end), summary or ""]
+            )
+        else:
+            self.buffer.write(
+                "BEGIN:VEVENT\r\nUID:%d-%s@calculendar\r\nDTSTAMP:%s\r\n"
+                "DTSTART%s\r\nDTEND%s\r\nSUMMARY:%s\r\nEND:VEVENT\r\n"
+                % (
+                    self.count,
+                    self.stamp,
+                    self.stamp,
+                    ics_time(start),
+                    ics_time(end),
+                    ics_escape(summary if summary is not None else "Available"),
+                )
+            )
+        self.count += 1
+        self.lines += 1
+        if self.lines >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.out.write(self.buffer.getvalue())
+        self.out.flush()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.lines = 0
+
+    def close(self):
+        if self.format == "json":
+            self.buffer.write("\n]\n" if self.count else "]\n")
+        elif self.format == "ics":
+            self.buffer.write("END:VCALENDAR\r\n")
+        self.flush()
+        return self.count
+
+
+def ics_escape(text):
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def write_interval(interval, out, format="text", tz="UTC"):
+    """
+    Writes the events of an Interval (or ArrayInterval) to out, and returns
+    how many there were.
+    """
+    starts, ends = interval.index()
+    writer = Writer(out, format, tz)
+    for start, end in zip(starts, ends):
+        writer.write(int(start), int(end))
+    return writer.close()
@@ -0,0 +1,145 @@
+"""
+A long-running availability server with a local HTTP/JSON API.
+
+Running gcal.py once per query pays for Python startup, loading settings and
+credentials and building the API service every time.  The server pays for
+these once and keeps them warm, along with the on-disk cache and recently
+computed answers.  It exposes:
+
+    GET /available?start=...&end=...&busy=a,b&free=c,d
+    GET /available?start=...&end=...&expr=~primary%20%26%20workhours
+    GET /agenda?start=...&end=...&calendars=a,b
+    GET /health
+
+Identical queries that arrive while one is being computed are coalesced: they
+wait for, and share, the same result.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import arrow
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8737
+WORKERS = 8
+
+# what routes raise for queries they can't make sense of:
+BAD_REQUEST = (ValueError, KeyError, SyntaxError, arrow.parser.ParserError)
+
+
+class Coalescer:
+    """
+    Runs each distinct key once at a time, and remembers its result for ttl
+    seconds, after which it is dropped.  The work runs on a persistent pool,
+    so per-thread state (like API service objects) stays warm between
+    requests.
+    """
+
+    def __init__(self, ttl=30, workers=WORKERS):
+        self.ttl = ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.results = {}  # key -> (time computed, future), oldest first
+        self.computed = 0
+        self.coalesced = 0
+
+    def run(self, key, compute):
+        with self.lock:
+            self.prune(time.time() - self.ttl)
+            if key in self.results:
+                self.coalesced += 1
+                return self.results[key][1].result()
+            submitted = key not in self.pending
+            if submitted:
+                self.computed += 1
+                self.pending[key] = self.pool.submit(compute)
+            else:
+                self.coalesced += 1
+            future = self.pending[key]
+        if submitted:
+            # outside the lock: a future already done calls back at once
+            future.add_done_callback(lambda f: self.finish(key, f))
+        return future.result()
+
+    def prune(self, expired):
+        """
+        Drops the results computed before expired.
+        """
+        while self.results:
+            key = next(iter(self.results))
+            if self.results[key][0] >= expired:
+                break
+            del self.results[key]
+
+    def finish(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+            if future.exception() is None:
+                self.results[key] = (time.time(), future)
+
+
+def query_key(path, params):
+    return (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+
+
+def split(params, name):
+    """
+    A comma separated (or repeated) query parameter, as a list.
+    """
+    return [x for value in params.get(name, []) for x in value.split(",") if x]
+
+
+def make_server(routes, host=DEFAULT_HOST, port=DEFAULT_PORT, ttl=30):
+    """
+    An HTTP server answering GET requests with JSON; routes maps a path to a
+    function from the query parameters (a dict of lists, as from parse_qs)
+    to a JSON-serialisable result.
+    """
+    coalescer = Coalescer(ttl)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path == "/health":
+                return self.reply(
+                    200,
+                    {
+                        "ok": True,
+                        "computed": coalescer.computed,
+                        "coalesced": coalescer.coalesced,
+                    },
+                )
+            if url.path not in routes:
+                return self.reply(404, {"error": "unknown path: " + url.path})
+            route = routes[url.path]
+            try:
+                result = coalescer.run(
+                    query_key(url.path, params), lambda: route(params)
+                )
+            except BAD_REQUEST as error:
+                return self.reply(400, {"error": str(error)})
+            except Exception as error:
+                return self.reply(500, {"error": str(error)})
+            self.reply(200, result)
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.coalescer = coalescer
+    return server
@@ -0,0 +1,114 @@
+"""
+Finding the first few free slots of a given length.
+
+Rather than computing availability over the whole query span, it is
+computed one window at a time from the start of the span: a day first, then
+windows twice as long as the last, up to MAX_WINDOW.  The search stops as
+soon as enough slots are found, so later windows are never evaluated (nor
+their calendars fetched).
+"""
+import datetime
+import re
+
+import arrow
+
+from src.utils import epoch
+
+FIRST_WINDOW = datetime.timedelta(days=1)
+MAX_WINDOW = datetime.timedelta(days=16)
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_duration(text):
+    """
+    A duration like 30m, 1h30m, 2d or 45 (minutes), in seconds.
+    """
+    text = str(text).strip().lower()
+    if text.isdigit():
+        return 60 * int(text)
+    parts = re.findall(r"(\d+)\s*([smhdw])", text)
+    if not parts or re.sub(r"(\d+)\s*([smhdw])|\s", "", text):
+        raise ValueError("not a duration: " + text)
+    return sum(int(n) * UNITS[unit] for n, unit in parts)
+
+
+def windows(start, end, first=FIRST_WINDOW, largest=MAX_WINDOW):
+    """
+    Consecutive (start, end) windows covering start..end, each twice as long
+    as the one before, up to largest.
+    """
+    size = first
+    while start < end:
+        window_end = min(start + size, end)
+        yield start, window_end
+        start = window_end
+        size = min(size * 2, largest)
+
+
+def free_segments(
+    available_between, start, end, first=FIRST_WINDOW, largest=MAX_WINDOW
+):
+    """
+    Lazily generates the free time between start and end, as (start, end)
+    epoch seconds, from available_between(window_start, window_end), which
+    returns an Interval (or ArrayInterval) of the free time in a window.
+    Free time running across the edge of a window comes out in one piece.
+    """
+    pending = None
+    for window_start, window_end in windows(start, end, first, largest):
+        starts, ends = available_between(window_start, window_end).index()
+        for seg_start, seg_end in zip(starts, ends):
+            seg_start, seg_end = int(seg_start), int(seg_end)
+            if pending and pending[1] >= seg_start:
+                pending = (pending[0], max(pending[1], seg_end))
+                continue
+            if pending:
+                yield pending
+            pending = (seg_start, seg_end)
+        if pending and pending[1] < epoch(window_end):
+            # it can't continue into the next window:
+            yield pending
+            pending = None
+    if pending:
+        yield pending
+
+
+def find_slots(segments, duration, count, gap=0, align=0):
+    """
+    The first count slots of duration seconds within the free segments.
+
+    Slots start at least gap seconds after the previous slot ends, and on a
+    multiple of align seconds (since the epoch), if align is given.  (To
+    keep slots away from busy times, widen those before the free segments
+    are computed.)
+    """
+    slots = []
+    earliest = None
+    for seg_start, seg_end in segments:
+        slot_start = seg_start if earliest is None else max(seg_start, earliest)
+        while True:
+            if align:
+                slot_start = -(-slot_start // align) * align
+            if slot_start + duration > seg_end:
+                break
+            slots.append((slot_start, slot_start + duration))
+            if len(slots) == count:
+                return slots
+            earliest = slot_start + duration + gap
+            slot_start = earliest
+    return slots
+
+
+def first_slots(available_between, start, end, duration, count, **options):
+    """
+    find_slots over the free time from available_between (see
+    free_segments), as (start, end) arrow pairs.
+    """
+    slots = find_slots(
+        free_segments(available_between, start, end), duration, count, **options
+    )
+    return [
+        (arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+        for s, e in slots
+    ]
@@ -0,0 +1,249 @@
+"""
+Binary snapshots of parsed .ics calendars.
+
+Parsing a large .ics file is slow, and most of them rarely change.  A
+snapshot stores a calendar's busy times, already expanded and flattened, as
+two packed arrays of int64 epoch seconds behind a small header:
+
+    magic, format version,
+    mtime (ns), size and SHA-256 of the .ics file it was built from,
+    the window (epoch seconds) that was expanded, the number of events,
+    and the timezone all-day events were placed in
+
+followed by the event starts and then the event ends.  Snapshots are memory
+mapped, so a query only touches the slice of events inside its window.  The
+current snapshot of each calendar is kept mapped between queries (for the
+serve command), and a snapshot is unmapped once it is replaced or found to
+be out of date.
+
+A snapshot is only used for queries in the timezone it was built in.  It is
+valid while the .ics file's mtime and size are unchanged; if
+they differ but the content hash still matches, the snapshot is kept and its
+header refreshed.
+"""
+import array
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+import arrow
+
+import settings
+from src import timings
+from src.ics import get_ics_interval
+from src.utils import Interval, epoch, interval_between
+
+MAGIC = b"CALSNAP1"
+VERSION = 2
+HEADER = struct.Struct("<8sI4xqq32sqqq64s")
+
+# The window an explicit import expands recurring events over:
+BUILD_PAST_DAYS = 365
+BUILD_FUTURE_DAYS = 2 * 365
+
+_lock = threading.Lock()
+_open = {}  # snapshot path -> its mapped Snapshot, while it is current
+
+
+def snapshot_path(calendar):
+    name = hashlib.sha1(os.path.abspath(calendar).encode("utf8")).hexdigest()
+    directory = os.path.join(os.path.dirname(settings.CACHE_PATH), "snapshots")
+    return os.path.join(directory, name + ".snap")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def pack(values):
+    # native byte order, so the arrays can be used straight from the mmap:
+    return array.array("q", values).tobytes()
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.map)
+        magic, version, self.mtime, self.size, self.digest = fields[:5]
+        self.lo, self.hi, count = fields[5:8]
+        self.tz = fields[8].rstrip(b"\0").decode("utf8")
+        self.data = self.starts = self.ends = None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a calendar snapshot: " + path)
+        self.data = memoryview(self.map)[HEADER.size :]
+        self.starts = self.data[: 8 * count].cast("q")
+        self.ends = self.data[8 * count : 16 * count].cast("q")
+
+    def close(self):
+        """
+        Unmaps the snapshot; the views into the map are released first, as
+        an mmap cannot be closed while they are alive.
+        """
+        for view in (self.starts, self.ends, self.data):
+            if view is not None:
+                view.release()
+        self.data = self.starts = self.ends = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def is_current(self, stat):
+        return (self.mtime, self.size) == (stat.st_mtime_ns, stat.st_size)
+
+    def covers(self, start, end):
+        return self.lo <= epoch(start) and epoch(end) <= self.hi
+
+    def interval(self, start, end, interval_class=Interval):
+        """
+        The busy times between start and end, found by bisection.
+        """
+        return interval_between(self.starts, self.ends, start, end, interval_class)
+
+
+def build_snapshot(calendar, start, end, tz="UTC"):
+    """
+    Parses an .ics calendar between start and end, with all-day events in
+    timezone tz, and writes its snapshot.
+    """
+    stat = os.stat(calendar)
+    digest = file_hash(calendar)
+    busy = get_ics_interval(calendar, start, end, tz=tz).events
+    path = snapshot_path(calendar)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        stat.st_mtime_ns,
+        stat.st_size,
+        digest,
+        epoch(start),
+        epoch(end),
+        len(busy),
+        tz.encode("utf8"),
+    )
+    # write to a temporary file first, so readers never see a partial one:
+    with open(path + ".tmp", "wb") as f:
+        f.write(header)
+        f.write(pack([ev.s for ev in busy]))
+        f.write(pack([ev.e for ev in busy]))
+    os.replace(path + ".tmp", path)
+    return Snapshot(path)
+
+
+def load_snapshot(calendar):
+    """
+    The calendar's snapshot, or None if there is none or it is out of date.
+    """
+    path = snapshot_path(calendar)
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    stat = os.stat(calendar)
+    if snapshot.is_current(stat):
+        return snapshot
+    if snapshot.size == stat.st_size and snapshot.digest == file_hash(calendar):
+        # touched but unchanged; remember the new mtime:
+        with open(path, "r+b") as f:
+            f.seek(16)
+            f.write(struct.pack("<q", stat.st_mtime_ns))
+        snapshot.mtime = stat.st_mtime_ns
+        return snapshot
+    snapshot.close()
+    return None
+
+
+def open_snapshot(calendar):
+    """
+    The calendar's current snapshot, kept mapped from earlier queries while
+    the .ics file is unchanged, or None; called with _lock held.
+    """
+    path = snapshot_path(calendar)
+    snapshot = _open.pop(path, None)
+    if snapshot is not None:
+        if snapshot.is_current(os.stat(calendar)):
+            _open[path] = snapshot
+            return snapshot
+        snapshot.close()
+    snapshot = load_snapshot(calendar)
+    if snapshot is not None:
+        _open[path] = snapshot
+    return snapshot
+
+
+def replace_snapshot(calendar, *args):
+    """
+    Builds the calendar's snapshot, unmapping the one it replaces; called
+    with _lock held.
+    """
+    snapshot = build_snapshot(calendar, *args)
+    old = _open.pop(snapshot_path(calendar), None)
+    if old is not None:
+        old.close()
+    _open[snapshot_path(calendar)] = snapshot
+    return snapshot
+
+
+def close_snapshots():
+    """
+    Unmaps every snapshot kept open.
+    """
+    with _lock:
+        for snapshot in _open.values():
+            snapshot.close()
+        _open.clear()
+
+
+def build_window(start=None, end=None, snapshot=None):
+    """
+    The window to expand a snapshot over: the usual span around today, widened
+    to take in start..end and whatever the old snapshot already covered, so
+    that nearby queries are answered without another parse.
+    """
+    now = arrow.utcnow()
+    lo = epoch(now.replace(days=-BUILD_PAST_DAYS).floor("day"))
+    hi = epoch(now.replace(days=+BUILD_FUTURE_DAYS).floor("day"))
+    if start is not None:
+        lo, hi = min(lo, epoch(start)), max(hi, epoch(end))
+    if snapshot is not None:
+        lo, hi = min(lo, snapshot.lo), max(hi, snapshot.hi)
+    return arrow.Arrow.utcfromtimestamp(lo), arrow.Arrow.utcfromtimestamp(hi)
+
+
+@timings.timed("snapshot.load", count=len)
+def get_snapshot_interval(calendar, start, end, interval_class=Interval, tz="UTC"):
+    """
+    The busy times of an .ics calendar between start and end, with all-day
+    events in timezone tz, from its snapshot; the snapshot is (re)built when
+    it is missing, stale, in another timezone, or does not cover the window.
+    """
+    with _lock:
+        snapshot = open_snapshot(calendar)
+        if snapshot is not None and snapshot.tz != tz:
+            snapshot = replace_snapshot(calendar, *build_window(start, end), tz)
+        elif snapshot is None or not snapshot.covers(start, end):
+            window = build_window(start, end, snapshot)
+            snapshot = replace_snapshot(calendar, *window, tz)
+        return snapshot.interval(start, end, interval_class)
+
+
+def import_snapshot(calendar, tz="UTC"):
+    """
+    Eagerly builds the snapshot of a newly imported calendar.
+    """
+    with _lock:
+        replace_snapshot(calendar, *build_window(), tz)
@@ -0,0 +1,155 @@
+"""
+Per-phase timing instrumentation.
+
+Code marks its phases with
+
+    with timings.phase("api.freebusy") as p:
+        result = ...
+        p.count(len(result))
+
+or by decorating a function with @timings.timed("algebra.or").  While
+timings are disabled (the default) a phase is a shared do-nothing context
+manager, so instrumented code pays for little more than a flag check.  Once
+enable()d, every phase's wall time, calls and event count are accumulated,
+and each finished phase is passed to any hooks added with add_hook(), as
+hook(name, seconds, events).
+"""
+import functools
+import json
+import sys
+import threading
+import time
+
+enabled = False
+_lock = threading.Lock()
+_phases = {}  # name -> [calls, seconds, events]
+_hooks = []
+_began = None
+
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, events):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.events = 0
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.began, self.events)
+        return False
+
+    def count(self, events):
+        self.events += events
+
+
+def phase(name):
+    return Phase(name) if enabled else NULL_PHASE
+
+
+def timed(name, count=None):
+    """
+    Times every call of the decorated function as the named phase;
+    count(result), if given, is the number of events it handled.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Phase(name) as p:
+                result = fn(*args, **kwargs)
+                if count is not None:
+                    p.count(count(result))
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+def record(name, seconds, events=0):
+    with _lock:
+        totals = _phases.setdefault(name, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += events
+    for hook in _hooks:
+        hook(name, seconds, events)
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def enable():
+    global enabled, _began
+    enabled = True
+    if _began is None:
+        _began = time.perf_counter()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _began
+    with _lock:
+        _phases.clear()
+        _began = time.perf_counter() if enabled else None
+
+
+def report():
+    """
+    The accumulated timings, as a JSON-serialisable dict.
+    """
+    with _lock:
+        phases = {
+            name: {"calls": calls, "seconds": seconds, "events": events}
+            for name, (calls, seconds, events) in sorted(_phases.items())
+        }
+    total = time.perf_counter() - _began if _began is not None else 0.0
+    return {"total_seconds": total, "phases": phases}
+
+
+def write_report(path="-"):
+    """
+    Writes the report as JSON to path, or as a table to stderr for "-".
+    """
+    result = report()
+    if path != "-":
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        return
+    print(
+        "%-24s %8s %12s %10s" % ("phase", "calls", "seconds", "events"), file=sys.stderr
+    )
+    for name, totals in result["phases"].items():
+        print(
+            "%-24s %8d %12.4f %10d"
+            % (name, totals["calls"], totals["seconds"], totals["events"]),
+            file=sys.stderr,
+        )
+    print("%-24s %8s %12.4f" % ("total", "", result["total_seconds"]), file=sys.stderr)
@@ -0,0 +1,111 @@
+"""
+Timezone conversion on epoch seconds, through cached offset tables.
+
+Internally every time is an integer number of seconds since the epoch
+(UTC).  A Zone converts between these and local wall-clock times, counted
+in seconds since 1970-01-01 00:00 local time, by bisecting the zone's table
+of UTC offset transitions, so no datetime or tzinfo objects are built per
+conversion.  Zones are loaded once each and cached.
+"""
+import bisect
+import calendar
+import datetime
+import functools
+
+import pytz
+
+EPOCH = datetime.datetime(1970, 1, 1)
+DAY = 86400
+
+
+class Zone:
+    def __init__(self, name):
+        try:
+            tz = pytz.timezone(name)
+        except pytz.UnknownTimeZoneError:
+            raise ValueError("unknown timezone: " + name)
+        self.name = name
+        times = getattr(tz, "_utc_transition_times", None)
+        if times:
+            self.transitions = [int((t - EPOCH).total_seconds()) for t in times]
+            self.offsets = [
+                int(off.total_seconds()) for off, _, _ in tz._transition_info
+            ]
+            self.dst = [bool(dst) for _, dst, _ in tz._transition_info]
+        else:
+            # a fixed offset:
+            offset = tz.utcoffset(datetime.datetime(2000, 1, 1))
+            self.transitions = [-(1 << 62)]
+            self.offsets = [int(offset.total_seconds())]
+            self.dst = [False]
+
+    def index(self, time):
+        return max(bisect.bisect_right(self.transitions, time) - 1, 0)
+
+    def offset(self, time):
+        """
+        The UTC offset (in seconds) at an epoch time.
+        """
+        return self.offsets[self.index(time)]
+
+    def local(self, time):
+        """
+        The local wall-clock time at an epoch time.
+        """
+        return time + self.offsets[self.index(time)]
+
+    def utc(self, local, is_dst=False):
+        """
+        The epoch time of a local wall-clock time.  Like pytz's localize,
+        an ambiguous time (when the clocks go back) is taken to be in DST
+        only if is_dst, and a time skipped when the clocks go forward is
+        read with the offset from before the change.
+        """
+        before = self.offset(local - DAY)
+        after = self.offset(local + DAY)
+        if before == after:
+            return local - before
+        valid = [off for off in (before, after) if self.offset(local - off) == off]
+        if len(valid) == 1:
+            return local - valid[0]
+        if valid:
+            # ambiguous: prefer the reading whose DST flag matches, then the
+            # later one (or the earlier one, if is_dst), as pytz does
+            matching = [
+                off for off in valid if self.dst[self.index(local - off)] == is_dst
+            ]
+            times = [local - off for off in (matching or valid)]
+            return min(times) if is_dst else max(times)
+        # in the gap: the offset from before the change, or its DST twin
+        return local - (before if not is_dst else after)
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    return Zone(name)
+
+
+def weekday(day):
+    """
+    The weekday (0 is Monday) of a day number (days since 1970-01-01).
+    """
+    return (day + 3) % 7
+
+
+def date(day):
+    return datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+
+
+def parse_epoch(text):
+    """
+    The epoch time of an RFC 3339 timestamp, as the API returns them.
+    """
+    try:
+        time = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        import arrow
+
+        return calendar.timegm(arrow.get(text).utctimetuple())
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return int(time.timestamp())
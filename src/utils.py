@@ -1,28 +1,65 @@
+import bisect
+import calendar
+import heapq
+import numbers
 import sys
 
 import arrow
 
-
-# A cal_event represents a single event with a start and end time.
-# NOTE: all times have type arrow.
 import settings
+from src import timings
+from src.tz import DAY, get_zone, weekday
+
+
+def epoch(time):
+    """
+    Seconds since the epoch (UTC) of an arrow / datetime / date (midnight
+    UTC) or ISO 8601 string; numbers (NumPy's included) are taken to be
+    epoch seconds already.
+    """
+    if isinstance(time, numbers.Real):
+        return int(time)
+    if isinstance(time, str):
+        time = arrow.get(time)
+    return calendar.timegm(
+        time.utctimetuple() if hasattr(time, "utctimetuple") else time.timetuple()
+    )
 
 
+# A cal_event represents a single event with a start and end time.
+# NOTE: times are kept as integer epoch seconds (UTC), in s and e, which is
+# what all the interval algebra works on; start and end are the same times as
+# arrows, built only when they are asked for.
 class Event:
+    __slots__ = ("s", "e", "_start", "_end")
+
     def __init__(self, start, end):
-        self.start = arrow.get(start)
-        self.end = arrow.get(end)
+        self.s = start if type(start) is int else epoch(start)
+        self.e = end if type(end) is int else epoch(end)
+        self._start = self._end = None
+
+    @property
+    def start(self):
+        if self._start is None:
+            self._start = arrow.Arrow.utcfromtimestamp(self.s)
+        return self._start
+
+    @property
+    def end(self):
+        if self._end is None:
+            self._end = arrow.Arrow.utcfromtimestamp(self.e)
+        return self._end
 
     def __str__(self):
         return "(" + str(self.start) + "," + str(self.end) + ")"
 
     # is self entirely lesser than the other event?
     def __lt__(self, other):
-        return self.end < other.start
+        return self.e < other.s
 
     # creates the smallest event that contains both events:
     def join(self, other):
-        return Event(min(self.start, other.start), max(self.end, other.end))
+        return Event(min(self.s, other.s), max(self.e, other.e))
 
     # does this event overlap with another event?
     def intersects(self, other):
@@ -32,41 +69,89 @@ class Event:
 
     # print a human readable string:
     def human_str(self):
+        from src.output import local_times
 
-        left = self.start.to(settings.TIMEZONE)
-        right = self.end.to(settings.TIMEZONE)
-
-        left_date = left.format("YYYY-MM-DD")
-        right_date = right.format("YYYY-MM-DD")
-        if left_date == right_date:
-            return (
-                left.format("MMMM DD @ h:mma")
-                + "-"
-                + right.format("h:mma")
-                + " "
-                + settings.TIMEZONE
-            )
-        else:
-            return (
-                left.format("MMMM DD @ h:mma")
-                + "-"
-                + right.format("MMMM DD @ h:mma" + " " + settings.TIMEZONE)
-            )
+        return local_times(settings.TIMEZONE).slot_text(self.s, self.e)
+
+
+class SlotQueries:
+    """
+    Point and range queries over the busy times of an interval, answered by
+    bisection over a sorted index of event starts and ends (epoch seconds).
+    The index is built once, on first use; intervals are not meant to be
+    modified after they are built.
+    """
+
+    def index(self):
+        if getattr(self, "_index", None) is None:
+            events = events_flatten(sorted(self.events, key=lambda ev: ev.s))
+            self._index = ([ev.s for ev in events], [ev.e for ev in events])
+        return self._index
+
+    def is_free(self, time):
+        starts, ends = self.index()
+        t = epoch(time)
+        i = bisect.bisect_right(starts, t) - 1
+        return i < 0 or ends[i] <= t
+
+    def overlaps(self, start, end):
+        """
+        Is any event busy between start and end?
+        """
+        starts, ends = self.index()
+        i = bisect.bisect_right(ends, epoch(start))
+        return i < len(starts) and starts[i] < epoch(end)
+
+    def next_free_after(self, time):
+        """
+        The first free moment at or after time (and within the interval), as
+        a UTC Arrow, or None if there is none before the end of the interval.
+        """
+        starts, ends = self.index()
+        t = max(epoch(time), epoch(self.start))
+        i = bisect.bisect_right(starts, t) - 1
+        if i >= 0 and ends[i] > t:
+            t = int(ends[i])
+        return arrow.Arrow.utcfromtimestamp(t) if t < epoch(self.end) else None
+
+    def free_slots_between(self, start, end):
+        """
+        The free events between start and end (within the interval).
+        """
+        starts, ends = self.index()
+        lo = max(epoch(start), epoch(self.start))
+        hi = min(epoch(end), epoch(self.end))
+        slots = []
+        cursor = lo
+        i = bisect.bisect_right(ends, lo)
+        while i < len(starts) and starts[i] < hi:
+            if starts[i] > cursor:
+                slots.append((cursor, int(starts[i])))
+            cursor = max(cursor, int(ends[i]))
+            i += 1
+        if cursor < hi:
+            slots.append((cursor, hi))
+        return [
+            Event(arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+            for s, e in slots
+        ]
 
 
 # A cal_interval represents an interval of time on a calendar
 # within the interval are events at specific times.
-class Interval:
+class Interval(SlotQueries):
     def __init__(self, start, events, end):
         self.start = start
         self.events = events  # list of (start : arrow,end : arrow)
         self.end = end
 
+    @timings.timed("algebra.not", count=lambda cal: len(cal.events))
     def __invert__(self):
         return Interval(
             self.start, events_complement(self.start, self.events, self.end), self.end
         )
 
+    @timings.timed("algebra.or", count=lambda cal: len(cal.events))
     def __or__(self, other):
         if self.start != other.start or self.end != other.end:
             raise Exception("won't combine calendars with different intervals")
@@ -74,14 +159,40 @@ class Interval:
         return Interval(self.start, events_new, self.end)
 
     def __and__(self, other):
-        if self.start != other.start or self.end != other.end:
-            raise Exception("won't combine calendars with different intervals")
-        return ~(~self | ~other)
+        return Interval.intersect_all([self, other])
+
+    # "busy in any" of several calendars, in a single k-way merge:
+    @staticmethod
+    @timings.timed("algebra.union_all", count=lambda cal: len(cal.events))
+    def union_all(intervals):
+        start, end = common_window(intervals)
+        return Interval(start, events_union_all([cal.events for cal in intervals]), end)
+
+    # "free in all" of several calendars, in a single k-way merge:
+    @staticmethod
+    @timings.timed("algebra.intersect_all", count=lambda cal: len(cal.events))
+    def intersect_all(intervals):
+        start, end = common_window(intervals)
+        events = events_intersect_all([events_flatten(cal.events) for cal in intervals])
+        return Interval(start, events_clip(start, events, end), end)
 
     def __str__(self):
         return "\n".join([str(x) for x in self.events])
 
 
+def common_window(intervals):
+    """
+    The (start, end) shared by a non-empty list of intervals.
+    """
+    if not intervals:
+        raise Exception("need at least one calendar to combine")
+    start, end = intervals[0].start, intervals[0].end
+    for cal in intervals[1:]:
+        if cal.start != start or cal.end != end:
+            raise Exception("won't combine calendars with different intervals")
+    return start, end
+
+
 # Compute the complement of a sequence events between start and end.
 #
 # For example, if:
@@ -93,17 +204,34 @@ class Interval:
 #
 # This converts between "busy" and "available"
 def events_complement(start, events, end):
-    if not events:
-        if start >= end:
-            return []
+    gaps = []
+    cursor, end = epoch(start), epoch(end)
+    for ev in events:
+        if ev.s >= end:
+            break
+        if ev.s > cursor:
+            gaps.append(Event(cursor, ev.s))
+        if ev.e > cursor:
+            cursor = ev.e
+    if cursor < end:
+        gaps.append(Event(cursor, end))
+    return gaps
+
+
+def events_sweep(events):
+    """
+    Combines overlapping (or adjacent) events from a sequence ordered by start
+    time, in a single pass.
+    """
+    merged = []
+    for ev in events:
+        if merged and not merged[-1].e < ev.s:
+            last = merged[-1]
+            if last.e < ev.e:
+                merged[-1] = Event(last.s, ev.e)
         else:
-            return [Event(start, end)]
-    elif events[0].start <= start:
-        return events_complement(events[0].end, events[1:], end)
-    else:
-        head = events[0]
-        tail = events[1:]
-        return [Event(start, head.start)] + events_complement(head.end, tail, end)
+            merged.append(ev)
+    return merged
 
 
 def events_union(first_event, second_event):
@@ -114,13 +242,61 @@ def events_union(first_event, second_event):
         return second_event
     elif not second_event:
         return first_event
-    elif first_event[0] < second_event[0]:
-        return [first_event[0]] + events_union(first_event[1:], second_event)
-    elif second_event[0] < first_event[0]:
-        return [second_event[0]] + events_union(first_event, second_event[1:])
-    else:
-        joined_event = first_event[0].join(second_event[0])
-        return events_union([joined_event] + first_event[1:], second_event[1:])
+    return events_sweep(heapq.merge(first_event, second_event, key=lambda ev: ev.s))
+
+
+def events_union_all(event_lists):
+    """
+    Merge in order any number of ordered sequences of events.
+    """
+    return events_sweep(heapq.merge(*event_lists, key=lambda ev: ev.s))
+
+
+def events_intersect_all(event_lists):
+    """
+    Intersect any number of ordered sequences of non-overlapping events.
+
+    The boundaries of all the sequences are merged with a heap, and a
+    coverage counter tracks how many sequences are busy at each boundary.
+    Ends sort before starts at the same time, so adjacent events do not
+    intersect.
+    """
+
+    def boundaries(events):
+        for ev in events:
+            yield ev.s, 1
+            yield ev.e, -1
+
+    needed = len(event_lists)
+    coverage = 0
+    opened = None
+    events = []
+    for time, delta in heapq.merge(*[boundaries(evs) for evs in event_lists]):
+        coverage += delta
+        if coverage == needed:
+            opened = time
+        elif opened is not None:
+            if opened < time:
+                events.append(Event(opened, time))
+            opened = None
+    return events
+
+
+def events_clip(start, events, end):
+    """
+    Restricts an ordered sequence of events to lie between start and end.
+    """
+    clipped = []
+    start, end = epoch(start), epoch(end)
+    for ev in events:
+        if ev.s >= end:
+            break
+        if ev.e <= start:
+            continue
+        if ev.s < start or ev.e > end:
+            ev = Event(max(ev.s, start), min(ev.e, end))
+        clipped.append(ev)
+    return clipped
 
 
 def events_flatten(events):
@@ -129,66 +305,127 @@ def events_flatten(events):
     """
     if len(events) <= 1:
         return events
-    else:
-        a = events[0]
-        b = events[1]
-        if a.intersects(b):
-            return events_flatten([a.join(b)] + events[2:])
-        else:
-            return [a] + events_flatten(events[1:])
+    return events_sweep(events)
 
 
-def cal_daily_event(start, end, start_hour, start_min, end_hour, end_min):
+def interval_between(starts, ends, start, end, interval_class=Interval):
     """
-    A cal_interval with a single event every day:
+    The events between start and end, as an interval_class, from sorted
+    arrays of the epoch starts and ends of non-overlapping events (found by
+    bisection).
     """
-    new_start = start.floor("day")
-    new_end = end.replace(days=+1).floor("day")
+    lo, hi = epoch(start), epoch(end)
+    first = bisect.bisect_right(ends, lo)
+    last = bisect.bisect_left(starts, hi)
+    clipped_starts = [max(s, lo) for s in starts[first:last]]
+    clipped_ends = [min(e, hi) for e in ends[first:last]]
+    if hasattr(interval_class, "from_arrays"):
+        return interval_class.from_arrays(start, clipped_starts, clipped_ends, end)
+    events = [Event(s, e) for s, e in zip(clipped_starts, clipped_ends)]
+    return interval_class(start, events, end)
+
+
+# Synthetic calendars are generated day by day with date arithmetic in their
+# timezone, so they are correct across daylight saving transitions.  Days are
+# numbered from 1970-01-01 (local time), and converted to epoch seconds through
+# the zone's cached offset table.  The iter_* generators are lazy and accept
+# end=None for an unbounded stream.
+
+
+def local_days(start, end, zone):
+    """
+    The local day numbers in zone from the day of start through the day of end.
+    """
+    day = zone.local(epoch(start)) // DAY
+    last = zone.local(epoch(end)) // DAY if end is not None else None
+    while last is None or day <= last:
+        yield day
+        day += 1
 
-    def events_daily_event(start, end, start_hour, start_min, end_hour, end_min):
-        # reset start date to start of day; end date to end of day
-        if end < start:
-            return []
-        else:
-            ev = Event(
-                start.replace(
-                    hour=start_hour, minute=start_min, tzinfo=settings.TIMEZONE
-                ),
-                start.replace(hour=end_hour, minute=end_min, tzinfo=settings.TIMEZONE),
-            )
-            evs = events_daily_event(
-                start.replace(days=+1), end, start_hour, start_min, end_hour, end_min
-            )
-            return [ev] + evs
 
+def local_time(day, hour, minute, zone):
+    """
+    The epoch seconds of a wall-clock time on a local day in zone.
+    """
+    return zone.utc(day * DAY + hour * 3600 + minute * 60)
+
+
+def clipped(start, events, end):
+    start = epoch(start)
+    end = epoch(end) if end is not None else None
+    for ev in events:
+        if end is not None and ev.s >= end:
+            return
+        if ev.e > start:
+            yield Event(max(ev.s, start), ev.e if end is None else min(ev.e, end))
+
+
+def iter_daily_events(start, end, start_hour, start_min, end_hour, end_min, tz=None):
+    """
+    Generates an event at the same local time every day.
+    """
+    zone = get_zone(tz or settings.TIMEZONE)
+    events = (
+        Event(
+            local_time(day, start_hour, start_min, zone),
+            local_time(day, end_hour, end_min, zone),
+        )
+        for day in local_days(start, end, zone)
+    )
+    return clipped(start, events, end)
+
+
+def iter_day_runs(start, end, weekdays, tz=None):
+    """
+    Generates an event for each run of consecutive days whose weekday
+    (0 is Monday) is in weekdays, from midnight to midnight.
+    """
+    zone = get_zone(tz or settings.TIMEZONE)
+
+    def runs():
+        first = None
+        for day in local_days(start, end, zone):
+            if weekday(day) in weekdays:
+                if first is None:
+                    first = day
+            elif first is not None:
+                yield Event(local_time(first, 0, 0, zone), local_time(day, 0, 0, zone))
+                first = None
+        if first is not None:
+            yield Event(local_time(first, 0, 0, zone), local_time(day + 1, 0, 0, zone))
+
+    return clipped(start, runs(), end)
+
+
+def cal_daily_event(start, end, start_hour, start_min, end_hour, end_min, tz=None):
+    """
+    A cal_interval with a single event every day:
+    """
     return Interval(
         start,
-        events_daily_event(
-            new_start, new_end, start_hour, start_min, end_hour, end_min
+        list(
+            iter_daily_events(start, end, start_hour, start_min, end_hour, end_min, tz)
         ),
         end,
     )
 
 
-def cal_weekends(start, end):
+def cal_weekends(start, end, tz=None):
     """
     A cal_interval where the weekends are a single event
     """
-    new_start = start.floor("day")
-    new_end = end.replace(days=+1).floor("day")
-
-    def events_weekends(start, end):
-        # TODO: abstract this to handle different conventions for weekends
-        if end < start:
-            return []
-        elif start.weekday() in settings.weekend_num:
-            return [
-                Event(start, start.replace(days=+1).floor("day"))
-            ] + events_weekends(start.replace(days=+1), end)
-        else:
-            return events_weekends(start.replace(days=+1), end)
+    # TODO: abstract this to handle different conventions for weekends
+    return Interval(
+        start, list(iter_day_runs(start, end, settings.weekend_num, tz)), end
+    )
+
 
-    return Interval(start, events_flatten(events_weekends(new_start, new_end)), end)
+def cal_weekdays(start, end, tz=None):
+    """
+    A cal_interval where each run of weekdays is a single event
+    """
+    weekdays = set(range(7)) - set(settings.weekend_num)
+    return Interval(start, list(iter_day_runs(start, end, weekdays, tz)), end)
 
 
 def get_calendars_from_imported(calendars: list) -> list:
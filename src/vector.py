@@ -0,0 +1,160 @@
+"""
+A compact, NumPy-backed alternative to src.utils.Interval.
+
+Events are stored as two sorted int64 arrays of epoch seconds (starts and
+ends) instead of a list of Event objects, and the Boolean operators run as
+vectorized array operations.  Events are only materialised when they are
+asked for, e.g. when printing availability with human_str.
+"""
+import numpy as np
+
+from src import timings
+from src.utils import Event, Interval, SlotQueries, common_window, epoch
+
+
+def normalize(starts, ends):
+    """
+    Sorts events by start time and combines overlapping (or adjacent) events;
+    empty ones are dropped.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    # a zero-length event would otherwise show up as a busy time of its own:
+    keep = starts < ends
+    if not keep.all():
+        starts, ends = starts[keep], ends[keep]
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind="mergesort")
+    starts = starts[order]
+    ends = ends[order]
+    # an event opens a new group if it starts after everything before it ends:
+    reach = np.maximum.accumulate(ends)
+    opens = np.empty(len(starts), dtype=bool)
+    opens[0] = True
+    opens[1:] = starts[1:] > reach[:-1]
+    heads = np.flatnonzero(opens)
+    return starts[heads], np.maximum.reduceat(ends, heads)
+
+
+class ArrayInterval(SlotQueries):
+    """
+    Drop-in replacement for Interval with events held as epoch-second arrays.
+    """
+
+    def index(self):
+        # the arrays are kept sorted and flattened already:
+        return self.starts, self.ends
+
+    def __init__(self, start, events, end):
+        self.start = start
+        self.end = end
+        self.starts, self.ends = normalize(
+            [ev.s for ev in events], [ev.e for ev in events]
+        )
+
+    @classmethod
+    def from_arrays(cls, start, starts, ends, end, normalized=False):
+        interval = cls.__new__(cls)
+        interval.start = start
+        interval.end = end
+        if normalized:
+            interval.starts = np.asarray(starts, dtype=np.int64)
+            interval.ends = np.asarray(ends, dtype=np.int64)
+        else:
+            interval.starts, interval.ends = normalize(starts, ends)
+        return interval
+
+    @classmethod
+    def from_interval(cls, interval):
+        if isinstance(interval, cls):
+            return interval
+        return cls(interval.start, interval.events, interval.end)
+
+    def to_interval(self):
+        return Interval(self.start, self.events, self.end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def iter_events(self):
+        for s, e in zip(self.starts.tolist(), self.ends.tolist()):
+            yield Event(s, e)
+
+    @property
+    def events(self):
+        return list(self.iter_events())
+
+    def _coerce(self, other):
+        if self.start != other.start or self.end != other.end:
+            raise Exception("won't combine calendars with different intervals")
+        return ArrayInterval.from_interval(other)
+
+    def _derive(self, starts, ends):
+        return ArrayInterval.from_arrays(
+            self.start, starts, ends, self.end, normalized=True
+        )
+
+    @timings.timed("algebra.not", count=len)
+    def __invert__(self):
+        lo, hi = epoch(self.start), epoch(self.end)
+        inside = (self.ends > lo) & (self.starts < hi)
+        starts = np.clip(self.starts[inside], lo, hi)
+        ends = np.clip(self.ends[inside], lo, hi)
+        gap_starts = np.concatenate(([lo], ends))
+        gap_ends = np.concatenate((starts, [hi]))
+        keep = gap_starts < gap_ends
+        return self._derive(gap_starts[keep], gap_ends[keep])
+
+    @timings.timed("algebra.or", count=len)
+    def __or__(self, other):
+        other = self._coerce(other)
+        return self._derive(
+            *normalize(
+                np.concatenate((self.starts, other.starts)),
+                np.concatenate((self.ends, other.ends)),
+            )
+        )
+
+    def __and__(self, other):
+        return ArrayInterval.intersect_all([self, other])
+
+    @staticmethod
+    @timings.timed("algebra.union_all", count=len)
+    def union_all(intervals):
+        start, end = common_window(intervals)
+        cals = [ArrayInterval.from_interval(cal) for cal in intervals]
+        return ArrayInterval.from_arrays(
+            start,
+            np.concatenate([cal.starts for cal in cals]),
+            np.concatenate([cal.ends for cal in cals]),
+            end,
+        )
+
+    @staticmethod
+    @timings.timed("algebra.intersect_all", count=len)
+    def intersect_all(intervals):
+        start, end = common_window(intervals)
+        cals = [ArrayInterval.from_interval(cal) for cal in intervals]
+        # sweep the boundaries with a coverage counter; at equal times ends
+        # sort before starts, so adjacent events do not intersect.
+        starts = np.concatenate([cal.starts for cal in cals])
+        ends = np.concatenate([cal.ends for cal in cals])
+        times = np.concatenate((starts, ends))
+        deltas = np.concatenate(
+            (np.ones(len(starts), dtype=np.int64), -np.ones(len(ends), dtype=np.int64))
+        )
+        order = np.lexsort((deltas, times))
+        times = times[order]
+        coverage = np.cumsum(deltas[order])
+        covered = np.flatnonzero(coverage == len(cals))
+        # like Interval, an intersection is clipped to the interval itself:
+        starts = np.maximum(times[covered], epoch(start))
+        ends = np.minimum(times[covered + 1], epoch(end))
+        keep = starts < ends
+        return ArrayInterval.from_arrays(
+            start, starts[keep], ends[keep], end, normalized=True
+        )
+
+    def __str__(self):
+        return "\n".join([str(x) for x in self.iter_events()])
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from src.agenda import in_background, iter_pages, merge_streams
+
+
+def test_every_page_is_followed():
+    pages = {
+        None: {"items": [1, 2], "nextPageToken": "b"},
+        "b": {"items": [], "nextPageToken": "c"},
+        "c": {"items": [3]},
+    }
+    tokens = []
+
+    def list_page(token):
+        tokens.append(token)
+        return pages[token]
+
+    assert list(iter_pages(list_page)) == [1, 2, 3]
+    assert tokens == [None, "b", "c"]
+
+
+def test_streams_are_merged_in_order():
+    streams = [iter([1, 4, 7]), iter([]), iter([2, 3, 8]), iter([5, 6])]
+    assert list(merge_streams(streams, key=lambda x: x)) == list(range(1, 9))
+
+
+def test_streams_are_fetched_concurrently():
+    # each stream waits for the other one to start, which only finishes if
+    # they run at the same time:
+    started = threading.Barrier(2, timeout=5)
+
+    def stream(items):
+        started.wait()
+        yield from items
+
+    merged = merge_streams([stream([1, 3]), stream([2])], key=lambda x: x)
+    assert list(merged) == [1, 2, 3]
+
+
+def test_errors_are_raised_to_the_consumer():
+    def failing():
+        yield 1
+        raise ValueError("no such calendar")
+
+    items = in_background(failing())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="no such calendar"):
+        next(items)
@@ -0,0 +1,156 @@
+import json
+import random
+
+import arrow
+import pytest
+
+import gcal
+import settings
+from src.batch import BusyTable, read_jobs, run, shards, stitch
+from src.fake import FakeService
+from src.freebusy import query_freebusy
+from src.utils import Interval, epoch
+from src.vector import ArrayInterval
+
+START, END = arrow.get("2020-01-01"), arrow.get("2020-04-01")
+
+
+def random_times(rng, count):
+    lo, hi = epoch(START), epoch(END)
+    times = []
+    for _ in range(count):
+        s = rng.randrange(lo - 86400, hi)
+        times.append((s, s + rng.randint(1, 3 * 86400)))
+    return sorted(times)
+
+
+def test_shards_cover_the_window():
+    assert list(shards(0, 100, 30)) == [(0, 30), (30, 60), (60, 90), (90, 100)]
+    assert list(shards(0, 90, 30))[-1] == (60, 90)
+    with pytest.raises(ValueError):
+        list(shards(0, 100, 0))
+
+
+def test_busy_table_merges_overlapping_times():
+    table = BusyTable()
+    table.add_times("a", [(0, 10), (5, 20), (20, 30), (40, 50)])
+    assert "a" in table and "b" not in table
+    assert list(table.starts["a"]) == [0, 40]
+    assert list(table.ends["a"]) == [30, 50]
+
+
+@pytest.mark.parametrize("backend", [Interval, ArrayInterval])
+def test_sharded_availability_is_that_of_the_whole_window(backend):
+    rng = random.Random(1)
+    for _ in range(20):
+        table = BusyTable()
+        for id in "abc":
+            table.add_times(id, random_times(rng, rng.randint(0, 60)))
+
+        def available(start, end):
+            busy = [table.interval(id, start, end, backend) for id in "ab"]
+            free = table.interval("c", start, end, backend)
+            return (~backend.union_all(busy) & free).index()
+
+        whole = list(zip(*available(START, END)))
+        size = rng.choice([3600, 86400, 7 * 86400, 45 * 86400])
+        sharded = stitch(
+            available(arrow.get(s), arrow.get(e))
+            for s, e in shards(epoch(START), epoch(END), size)
+        )
+        assert [(int(s), int(e)) for s, e in sharded] == [
+            (int(s), int(e)) for s, e in whole
+        ]
+
+
+def test_jobs_are_read_with_ids():
+    jobs = list(read_jobs(['{"expr": "a"}', "", '{"id": "x", "busy": ["b"]}']))
+    assert jobs == [{"expr": "a", "id": "1"}, {"id": "x", "busy": ["b"]}]
+    with pytest.raises(ValueError, match="line 2"):
+        list(read_jobs(["{}", "[1]"]))
+
+
+def square(x):
+    return x * x
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_results_come_back_in_job_order(workers):
+    assert list(run(range(20), square, workers)) == [x * x for x in range(20)]
+
+
+def meeting(day, start, end):
+    t = "2020-01-%02dT%s:00+00:00"
+    return {
+        "id": "%d-%s" % (day, start),
+        "start": {"dateTime": t % (day, start)},
+        "end": {"dateTime": t % (day, end)},
+    }
+
+
+CONFIGURED = "args QUERY_TIMEZONE OUTPUT_TIMEZONE START END BUSY FREE INPUT".split()
+CONFIGURED += ["BackendInterval", "cache", "EVENT_FILTER", "BATCH_TABLE"]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """
+    A fake service, and the globals the batch command sets, restored after.
+    """
+    service = FakeService(
+        {
+            "primary": {"summary": "me", "events": [meeting(2, "10:00", "11:00")]},
+            "room": {"summary": "room", "events": [meeting(3, "09:00", "12:00")]},
+        }
+    )
+    monkeypatch.setattr(
+        gcal,
+        "query_freebusy",
+        lambda get_service, *args: query_freebusy(lambda: service, *args),
+    )
+    monkeypatch.setattr(settings, "get_imported_calendar_by_name", lambda name: name)
+    for name, value in [
+        ("TIMEZONE", "UTC"),
+        ("START_WORK", "9:00 AM"),
+        ("END_WORK", "5:00 PM"),
+        ("weekend_num", [5, 6]),
+    ]:
+        monkeypatch.setitem(vars(settings), name, value)
+    for name in CONFIGURED:
+        monkeypatch.setattr(gcal, name, getattr(gcal, name))
+    return service
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_batch_jobs_are_evaluated_against_one_fetch(service, tmp_path, workers):
+    window = {"start": "2020-01-02T09:00:00+00:00", "end": "2020-01-03T17:00:00+00:00"}
+    jobs = [
+        dict(window, id="me", expr="~primary & workhours"),
+        dict(window, busy=["room"], free=["workhours"]),
+        {"id": "bad", "expr": "primary &"},
+    ]
+    (tmp_path / "jobs.jsonl").write_text("\n".join(json.dumps(j) for j in jobs))
+    gcal.configure(
+        ["batch", "--jobs", str(tmp_path / "jobs.jsonl")]
+        + ["--output", str(tmp_path / "out.jsonl"), "--workers", workers]
+        + ["--no-cache", "--output-timezone", "UTC", "--cache-ttl", "0"]
+    )
+    gcal.batch()
+    results = [json.loads(line) for line in open(tmp_path / "out.jsonl")]
+
+    def at(day, time):
+        return "2020-01-%02dT%s:00+00:00" % (day, time)
+
+    assert [result["id"] for result in results] == ["me", "2", "bad"]
+    assert results[0]["available"] == [
+        {"start": at(2, "09:00"), "end": at(2, "10:00")},
+        {"start": at(2, "11:00"), "end": at(2, "17:00")},
+        {"start": at(3, "09:00"), "end": at(3, "17:00")},
+    ]
+    assert results[1]["available"] == [
+        {"start": at(2, "09:00"), "end": at(2, "17:00")},
+        {"start": at(3, "12:00"), "end": at(3, "17:00")},
+    ]
+    assert "error" in results[2]
+    # the calendars were fetched in a single freebusy query:
+    assert service.requests == 1
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from src.batching import Batcher
+from src.fake import FakeHttpError, FakeService
+
+
+def event(id):
+    t = "2020-01-02T%02d:00:00+00:00"
+    return {"id": id, "start": {"dateTime": t % 9}, "end": {"dateTime": t % 10}}
+
+
+def make_service(count, **kwargs):
+    return FakeService(
+        {
+            "cal-%d" % i: {"summary": str(i), "events": [event("ev-%d" % i)]}
+            for i in range(count)
+        },
+        **kwargs
+    )
+
+
+def fetch_all(batcher, service, ids):
+    """
+    Lists the events of each calendar on a thread of its own, through the
+    batcher, and returns each one's event ids, or the error it raised.
+    """
+    results = {}
+
+    def fetch(id):
+        try:
+            page = batcher.execute(service.events().list(calendarId=id))
+            results[id] = [ev["id"] for ev in page["items"]]
+        except FakeHttpError as error:
+            results[id] = error
+
+    threads = [threading.Thread(target=fetch, args=(id,)) for id in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_share_a_round_trip():
+    service = make_service(30)
+    batcher = Batcher(lambda: service, size=8, wait=0.2)
+    results = fetch_all(batcher, service, list(service.calendars))
+    assert results == {"cal-%d" % i: ["ev-%d" % i] for i in range(30)}
+    # batches of at most 8 calls each:
+    assert 4 <= service.requests < 30
+
+
+def test_transient_failures_are_retried():
+    service = make_service(20, failure_rate=0.5, seed=3)
+    batcher = Batcher(lambda: service, size=5, wait=0.1, retries=8, backoff=0)
+    results = fetch_all(batcher, service, list(service.calendars))
+    assert results == {"cal-%d" % i: ["ev-%d" % i] for i in range(20)}
+
+
+def test_errors_are_raised_to_their_own_caller_only():
+    service = make_service(3)
+    batcher = Batcher(lambda: service, wait=0.2, backoff=0)
+    results = fetch_all(batcher, service, ["cal-0", "missing", "cal-2"])
+    assert results["cal-0"] == ["ev-0"] and results["cal-2"] == ["ev-2"]
+    assert results["missing"].resp.status == 404
+    # the error was not retried:
+    assert service.requests == 1
+
+
+def test_a_lone_request_is_sent_by_itself():
+    service = make_service(1)
+    batcher = Batcher(lambda: pytest.fail("no batch is needed"), wait=0)
+    page = batcher.execute(service.events().list(calendarId="cal-0"))
+    assert [ev["id"] for ev in page["items"]] == ["ev-0"]
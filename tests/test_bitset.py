@@ -0,0 +1,112 @@
+import random
+
+import arrow
+import pytest
+
+from src.bitset import BitsetInterval, OffGridError, with_quantum
+from src.utils import Event, Interval, epoch
+
+QUANTUM = BitsetInterval.quantum
+
+
+def random_interval(rng, start, end, count):
+    lo, slots = epoch(start), (epoch(end) - epoch(start)) // QUANTUM
+    events = []
+    for _ in range(count):
+        s = lo - lo % QUANTUM + QUANTUM * rng.randrange(-4, slots + 4)
+        events.append(Event(s, s + QUANTUM * rng.randint(1, 12)))
+    return Interval(start, sorted(events, key=lambda ev: ev.s), end)
+
+
+def times(interval):
+    starts, ends = interval.index()
+    return [(int(s), int(e)) for s, e in zip(starts, ends)]
+
+
+def test_availability_is_that_of_the_list_backend():
+    rng = random.Random(5)
+    for _ in range(200):
+        # windows need not be on the grid, but events inside them must be:
+        start = arrow.get("2020-03-01").shift(minutes=rng.randrange(7 * 24 * 60))
+        end = start.shift(minutes=rng.randrange(1, 3 * 24 * 60))
+        busy = [random_interval(rng, start, end, rng.randint(0, 20)) for _ in range(3)]
+        free = random_interval(rng, start, end, rng.randint(0, 10))
+        expected = ~Interval.union_all(busy) & free
+        bitsets = [BitsetInterval.from_interval(cal) for cal in busy + [free]]
+        available = ~BitsetInterval.union_all(bitsets[:3]) & bitsets[3]
+        assert times(available) == times(expected)
+
+
+def rounded_in(interval):
+    """
+    The times of interval, each rounded in to the grid (but not past the
+    ends of the interval).
+    """
+    lo, hi = epoch(interval.start), epoch(interval.end)
+    rounded = []
+    for s, e in times(interval):
+        s = s if s == lo else s + -s % QUANTUM
+        e = e if e == hi else e - e % QUANTUM
+        if s < e:
+            rounded.append((s, e))
+    return rounded
+
+
+def test_availability_off_the_grid_is_rounded_in():
+    rng = random.Random(7)
+    for _ in range(200):
+        start = arrow.get("2020-03-01").shift(minutes=rng.randrange(7 * 24 * 60))
+        end = start.shift(minutes=rng.randrange(1, 3 * 24 * 60))
+        lo, span = epoch(start), epoch(end) - epoch(start)
+
+        def random_calendar(count):
+            events = []
+            for _ in range(count):
+                s = lo + 60 * rng.randrange(-60, span // 60 + 60)
+                events.append(Event(s, s + 60 * rng.randint(1, 180)))
+            return Interval(start, sorted(events, key=lambda ev: ev.s), end)
+
+        busy = [random_calendar(rng.randint(0, 20)) for _ in range(3)]
+        free = [random_calendar(rng.randint(0, 10)) for _ in range(2)]
+        expected = ~Interval.union_all(busy) & Interval.intersect_all(free)
+        bitsets = [BitsetInterval.from_interval(cal) for cal in busy + free]
+        available = ~BitsetInterval.union_all(
+            bitsets[:3]
+        ) & BitsetInterval.intersect_all(bitsets[3:])
+        assert times(available) == rounded_in(expected)
+
+
+def test_a_meeting_off_the_grid():
+    start, end = arrow.get("2020-03-02T09:00:00"), arrow.get("2020-03-02T17:00:00")
+    meeting = Event(epoch("2020-03-02T10:05:00"), epoch("2020-03-02T10:25:00"))
+    workhours = Event(epoch("2020-03-02T09:05:00"), epoch("2020-03-02T16:50:00"))
+    expected = ~Interval(start, [meeting], end) & Interval(start, [workhours], end)
+    assert times(expected) == [
+        (workhours.s, meeting.s),
+        (meeting.e, workhours.e),
+    ]
+
+    busy = BitsetInterval(start, [meeting], end)
+    free = BitsetInterval(start, [workhours], end)
+    # the calendars themselves are their events:
+    assert times(busy) == [(meeting.s, meeting.e)]
+    # availability is rounded in, to 9:15-10:00 and 10:30-16:45:
+    available = times(~busy & free)
+    assert available == rounded_in(expected)
+    assert available == [
+        (epoch("2020-03-02T09:15:00"), epoch("2020-03-02T10:00:00")),
+        (epoch("2020-03-02T10:30:00"), epoch("2020-03-02T16:45:00")),
+    ]
+    # and on a fine enough grid, it is exact:
+    fine = with_quantum(5 * 60)
+    available = ~fine(start, [meeting], end) & fine(start, [workhours], end)
+    assert times(available) == times(expected)
+
+
+def test_times_off_the_grid_are_an_error_if_exact():
+    start, end = arrow.get("2020-03-02"), arrow.get("2020-03-03")
+    meeting = Event(epoch("2020-03-02T10:05:00+00:00"), epoch("2020-03-02T11:00:00"))
+    with pytest.raises(OffGridError, match="10:05:00"):
+        with_quantum(QUANTUM, exact=True)(start, [meeting], end)
+    interval = with_quantum(5 * 60, exact=True)(start, [meeting], end)
+    assert times(interval) == [(meeting.s, meeting.e)]
@@ -0,0 +1,61 @@
+import arrow
+
+from src.cache import SYNC_SPAN, Cache
+from src.fake import FakeService
+
+START = arrow.get("2020-01-01")
+
+
+def event(id, days):
+    start = START.shift(days=days)
+    return {
+        "id": id,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": start.shift(hours=1).isoformat()},
+    }
+
+
+def test_synced_events_are_kept_within_the_window(tmp_path):
+    service = FakeService({"primary": {"summary": "me", "events": []}})
+    for id, days in [("soon", 1), ("later", 60), ("years-away", 3 * 365)]:
+        service.put_event("primary", event(id, days))
+
+    def list_events(**params):
+        return service.events_list("primary", **params)
+
+    # (with no TTL, so that every call syncs)
+    cache = Cache(str(tmp_path / "cache.sqlite"), ttl=-1)
+    end = START.shift(days=30)
+    events = cache.events("primary", START, end, list_events)
+    # a full sync covers SYNC_SPAN, for the queries that follow:
+    assert sorted(ev["id"] for ev in events) == ["later", "soon"]
+    assert SYNC_SPAN < 3 * 365 * 86400
+
+    # changes outside the window are not kept by incremental syncs either:
+    service.put_event("primary", event("soon", 2 * 365))
+    service.put_event("primary", event("new", 2))
+    service.put_event("primary", event("far", 4 * 365))
+    events = cache.events("primary", START, end, list_events)
+    assert sorted(ev["id"] for ev in events) == ["later", "new"]
+    assert cache.stats()["events_syncs"] == 1
+
+
+def test_sliding_freebusy_windows_are_kept_as_one_entry(tmp_path):
+    queries = []
+
+    def fetch(ids, start, end):
+        queries.append((start, end))
+        return {id: [(start, start.shift(minutes=30))] for id in ids}
+
+    cache = Cache(str(tmp_path / "cache.sqlite"))
+    for minutes in range(0, 600, 60):
+        start = START.shift(minutes=minutes)
+        cache.freebusy(["primary"], start, start.shift(days=1), fetch)
+    # every query after the first only fetched the hour it slid by:
+    assert len(queries) == 10
+    assert all((end - start).total_seconds() == 3600 for start, end in queries[1:])
+    assert cache.stats()["freebusy_entries"] == 1
+    # and the entry answers every part of the span it grew to:
+    busy = cache.freebusy(["primary"], START, START.shift(days=1, hours=9), fetch)
+    assert len(queries) == 10
+    assert len(busy["primary"]) == 10
@@ -0,0 +1,53 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+import settings
+from src import credentials
+
+
+class FakeCredentials:
+    """
+    Counts its refreshes, which are slow enough for threads to overlap.
+    """
+
+    def __init__(self):
+        self.token = "stale"
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        return self.token != "stale"
+
+    def refresh(self, request):
+        time.sleep(0.05)
+        self.refreshes += 1
+        self.token = "token-%d" % self.refreshes
+
+
+@pytest.fixture
+def creds(tmp_path, monkeypatch):
+    monkeypatch.setitem(vars(settings), "CREDENTIALS_DIR", str(tmp_path))
+    return credentials.share(FakeCredentials())
+
+
+def test_threads_refresh_a_stale_token_once(creds, tmp_path):
+    threads = [threading.Thread(target=creds.refresh, args=(None,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert creds.refreshes == 1
+    # and the new token is saved, without the shared refresh:
+    with open(str(tmp_path / "token.pickle"), "rb") as token:
+        saved = pickle.load(token)
+    assert saved.token == "token-1"
+    assert "refresh" not in vars(saved)
+
+
+def test_a_token_rejected_again_is_refreshed_again(creds):
+    creds.refresh(None)
+    creds.refresh(None)
+    assert creds.refreshes == 2
@@ -0,0 +1,79 @@
+import pytest
+
+from src.expr import compile_expr, name, parse, share
+from src.utils import Event, Interval
+
+ALIASES = {"weekday": "~weekend"}
+
+
+def test_negation_is_pushed_down_to_the_calendars():
+    both = frozenset([("not", name("a")), ("not", name("b"))])
+    assert parse("~(a | b)") == ("and", both)
+    assert parse("~~a") == name("a")
+    assert parse("~weekday", ALIASES) == name("weekend")
+
+
+def test_chains_are_flattened():
+    assert parse("a | (b | c)") == parse("(a | b) | c")
+    assert parse("a & b & c")[1] == frozenset(name(x) for x in "abc")
+    assert parse("a | a") == name("a")
+
+
+@pytest.mark.parametrize("text", ["(a |", "a & & b", "~", "a b", ")"])
+def test_malformed_expressions_are_syntax_errors(text):
+    with pytest.raises(SyntaxError):
+        parse(text)
+
+
+def test_common_operands_are_shared():
+    node = share(parse("(w & d & a) | (w & d & b)"))
+    inner = ("and", frozenset([name("w"), name("d")]))
+    assert node == (
+        "or",
+        frozenset(
+            [
+                ("and", frozenset([inner, name("a")])),
+                ("and", frozenset([inner, name("b")])),
+            ]
+        ),
+    )
+
+
+CALENDARS = {
+    "a": [Event(0, 30), Event(60, 90)],
+    "b": [Event(20, 70)],
+    "weekend": [Event(80, 100)],
+}
+
+
+def cells(events):
+    return set(t for ev in events for t in range(ev.s, ev.e))
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("a | b", lambda a, b, w: a | b),
+        ("a & ~b", lambda a, b, w: a - b),
+        ("~a & ~b & weekday", lambda a, b, w: set(range(100)) - a - b - w),
+        ("(a & weekday) | (b & weekday)", lambda a, b, w: (a | b) - w),
+    ],
+)
+def test_plans_compute_the_expression(text, expected):
+    looked_up = []
+
+    def lookup(calendar):
+        looked_up.append(calendar)
+        return Interval(0, CALENDARS[calendar], 100)
+
+    result = compile_expr(text, ALIASES).evaluate(lookup)
+    everything = [cells(CALENDARS[x]) for x in ("a", "b", "weekend")]
+    assert cells(result.events) == expected(*everything)
+    # every calendar is looked up once:
+    assert sorted(looked_up) == sorted(set(looked_up))
+
+
+def test_busy_calendars_are_the_complemented_ones():
+    plan = compile_expr("~(a | b) & workhours & weekday", ALIASES)
+    assert plan.calendars == ["a", "b", "weekend", "workhours"]
+    assert plan.busy_calendars == ["a", "b", "weekend"]
@@ -0,0 +1,209 @@
+import datetime
+import random
+
+import arrow
+import icalendar
+import pytest
+
+import gcal
+import src.credentials
+from src.fake import FakeService
+from src.filters import RAW_PROPERTIES, EventFilter, counts_as_busy
+from src.ics import (
+    get_ics_calendar_events,
+    get_ics_interval,
+    iter_vevents,
+    raw_properties,
+)
+from src.utils import epoch
+
+START, END = arrow.get("2020-01-01"), arrow.get("2020-01-08")
+UTC = datetime.timezone.utc
+
+
+def event(id, start, end, **fields):
+    times = {"dateTime": start}, {"dateTime": end}
+    if len(start) == 10:
+        times = {"date": start}, {"date": end}
+    return dict(fields, id=id, summary=id, start=times[0], end=times[1])
+
+
+def declined(id, start, end):
+    attendees = [{"email": "me@fake", "self": True, "responseStatus": "declined"}]
+    return event(id, start, end, attendees=attendees)
+
+
+def test_an_empty_filter_applies_nowhere():
+    assert not EventFilter().applies("primary")
+    assert EventFilter(match="x").applies("primary")
+
+
+def test_calendars_limit_where_a_filter_applies():
+    event_filter = EventFilter(match="x", calendars=["primary"])
+    assert event_filter.applies("primary")
+    assert not event_filter.applies("other@fake")
+    # no calendars at all, rather than all of them:
+    assert not EventFilter(match="x", calendars=[]).applies("primary")
+
+
+def test_events_are_matched_on_every_criterion():
+    event_filter = EventFilter(
+        match="^Standup|^Review",
+        ignore=["optional"],
+        min_duration=30 * 60,
+        statuses=["tentative", "declined"],
+        transparent=True,
+    )
+    t = "2020-01-02T%s:00+00:00"
+    assert event_filter.matches(event("Standup", t % "09:00", t % "09:30"))
+    assert not event_filter.matches(event("Lunch", t % "12:00", t % "13:00"))
+    assert not event_filter.matches(event("Review, optional", t % "14:00", t % "15:00"))
+    assert not event_filter.matches(event("Review", t % "14:00", t % "14:15"))
+    assert not event_filter.matches(
+        event("Review", t % "14:00", t % "15:00", status="tentative")
+    )
+    assert not event_filter.matches(declined("Review", t % "14:00", t % "15:00"))
+    assert not event_filter.matches(
+        event("Review", t % "14:00", t % "15:00", transparency="transparent")
+    )
+
+
+def test_raw_properties_are_matched_before_parsing():
+    event_filter = EventFilter(
+        ignore=["^Lunch"], search="Berlin", statuses=["cancelled"], transparent=True
+    )
+    props = {b"SUMMARY": b"Review", b"LOCATION": b"Berlin office"}
+    assert event_filter.matches_raw(props)
+    assert not event_filter.matches_raw({**props, b"SUMMARY": b"Lunch"})
+    assert not event_filter.matches_raw({**props, b"STATUS": b"CANCELLED"})
+    assert not event_filter.matches_raw({**props, b"TRANSP": b"TRANSPARENT"})
+    assert not event_filter.matches_raw({**props, b"LOCATION": b"Rome"})
+
+
+def test_all_day_events_start_at_local_midnight():
+    berlin = epoch(arrow.get("2020-01-02T00:00:00+01:00"))
+    assert gcal.event_epoch({"date": "2020-01-02"}, "Europe/Berlin") == berlin
+    assert gcal.event_epoch({"date": "2020-01-02"}) == epoch("2020-01-02")
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    """
+    Filtered busy times are read from a fake primary calendar, in Berlin.
+    """
+    events = []
+    service = FakeService({"primary": {"summary": "me", "events": events}})
+    monkeypatch.setattr(src.credentials, "get_thread_service", lambda: service)
+    monkeypatch.setattr(gcal, "EVENT_FILTER", EventFilter(ignore=["^Lunch"]))
+    monkeypatch.setattr(gcal, "QUERY_TIMEZONE", "Europe/Berlin")
+    monkeypatch.setattr(gcal, "cache", None)
+    return events
+
+
+def test_filtered_busy_times_count_what_freebusy_would(calendar):
+    t = "2020-01-02T%s:00+00:00"
+    calendar += [
+        event("Standup", t % "09:00", t % "09:30"),
+        event("Lunch", t % "12:00", t % "13:00"),
+        event("Focus", t % "14:00", t % "16:00", transparency="transparent"),
+        declined("Review", t % "16:00", t % "17:00"),
+        event("Holiday", "2020-01-03", "2020-01-04"),
+    ]
+    busy = gcal.filtered_busy_times(["primary"], START, END, "Europe/Berlin")
+    assert busy["primary"] == [
+        (epoch(t % "09:00"), epoch(t % "09:30")),
+        (epoch("2020-01-02T23:00:00+00:00"), epoch("2020-01-03T23:00:00+00:00")),
+    ]
+
+
+def write_ics(path, *events):
+    calendar = icalendar.Calendar()
+    calendar.add("X-WR-CALNAME", "me@fake")
+    for ev in events:
+        calendar.add_component(ev)
+    path.write_bytes(calendar.to_ical())
+    return str(path)
+
+
+def test_all_day_ics_events_start_at_local_midnight(tmp_path):
+    holiday = icalendar.Event()
+    holiday.add("UID", "holiday")
+    holiday.add("DTSTART", datetime.date(2020, 1, 3))
+    holiday.add("DTEND", datetime.date(2020, 1, 4))
+    path = write_ics(tmp_path / "holiday.ics", holiday)
+    busy = get_ics_interval(path, START, END, tz="Europe/Berlin")
+    days = {"date": "2020-01-03"}, {"date": "2020-01-04"}
+    api = [gcal.event_epoch(day, "Europe/Berlin") for day in days]
+    assert [(ev.s, ev.e) for ev in busy.events] == [tuple(api)]
+
+
+def test_cancelled_ics_events_are_not_busy(tmp_path):
+    events = []
+    for uid, status in [("retro", "CANCELLED"), ("standup", "CONFIRMED")]:
+        ev = icalendar.Event()
+        ev.add("UID", uid)
+        ev.add("STATUS", status)
+        ev.add("DTSTART", datetime.datetime(2020, 1, 2, 9, tzinfo=UTC))
+        ev.add("DURATION", datetime.timedelta(hours=1))
+        events.append(ev)
+    path = write_ics(tmp_path / "cancelled.ics", *events)
+    assert [ev["id"] for ev in get_ics_calendar_events(path, START, END)] == [
+        "retro",
+        "standup",
+    ]
+    assert len(get_ics_interval(path, START, END).events) == 1
+    assert not counts_as_busy({"status": "cancelled", "start": {}, "end": {}})
+
+
+def test_ics_events_the_owner_declined_are_not_busy(tmp_path):
+    events = []
+    for uid, partstat in [("review", "DECLINED"), ("standup", "ACCEPTED")]:
+        ev = icalendar.Event()
+        ev.add("UID", uid)
+        ev.add("SUMMARY", uid)
+        ev.add("DTSTART", datetime.datetime(2020, 1, 2, 9, tzinfo=UTC))
+        ev.add("DURATION", datetime.timedelta(hours=1))
+        ev.add("ATTENDEE", "mailto:other@fake", parameters={"PARTSTAT": "DECLINED"})
+        ev.add("ATTENDEE", "mailto:me@fake", parameters={"PARTSTAT": partstat})
+        events.append(ev)
+    path = write_ics(tmp_path / "invites.ics", *events)
+    event_filter = EventFilter(statuses=["declined"])
+    kept = get_ics_calendar_events(path, START, END, event_filter)
+    assert [ev["id"] for ev in kept] == ["standup"]
+    assert len(get_ics_interval(path, START, END).events) == 1
+
+
+def test_the_raw_check_never_drops_a_kept_event(tmp_path):
+    rng = random.Random(4)
+    words = ["Standup", "Lunch", "Review", "Berlin,", "optional;", "1:1", "x" * 60]
+    names = RAW_PROPERTIES + (b"UID",)
+    for n in range(300):
+        event_filter = EventFilter(
+            match=rng.choice([None, "^Standup", "Review|Lunch", "Berlin, "]),
+            ignore=rng.sample(["optional;", "^Lunch", "1:1"], rng.randint(0, 2)),
+            search=rng.choice([None, "berlin,", "review berlin"]),
+            statuses=rng.sample(["tentative", "cancelled"], rng.randint(0, 2)),
+            transparent=rng.random() < 0.5,
+        )
+        summary = " ".join(rng.sample(words, rng.randint(1, 3)))
+        location = rng.choice(["", "Berlin office", "Rome, Italy"])
+        ev = icalendar.Event()
+        ev.add("UID", "event")
+        ev.add("SUMMARY", summary)
+        ev.add("LOCATION", location)
+        ev.add("STATUS", rng.choice(["CONFIRMED", "TENTATIVE", "CANCELLED"]))
+        if rng.random() < 0.3:
+            ev.add("TRANSP", "TRANSPARENT")
+        ev.add("DTSTART", datetime.datetime(2020, 1, 2, 9, tzinfo=UTC))
+        ev.add("DURATION", datetime.timedelta(hours=1))
+        path = write_ics(tmp_path / ("%d.ics" % n), ev)
+
+        # the event as the API would give it, and the raw lines of the file:
+        (parsed,) = get_ics_calendar_events(path, START, END)
+        text = " ".join([summary, location]).lower()
+        kept = event_filter.matches(parsed) and all(
+            term in text for term in event_filter.terms
+        )
+        (lines,) = iter_vevents(path)
+        # (and nor does it keep an event the full check would drop)
+        assert event_filter.matches_raw(raw_properties(lines, names)) == kept
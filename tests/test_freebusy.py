@@ -0,0 +1,47 @@
+import arrow
+import pytest
+
+from src.fake import FakeHttpError, FakeService, random_calendars
+from src.freebusy import FreeBusyError, query_freebusy, with_retries
+from src.incremental import merge
+from src.utils import epoch
+
+START, END = arrow.get("2020-01-01"), arrow.get("2020-07-01")
+
+
+def test_chunked_queries_return_every_busy_time():
+    calendars = random_calendars(60, START, END, events=50)
+    service = FakeService(calendars)
+    busy = query_freebusy(lambda: service, sorted(calendars), START, END, "UTC")
+    for id in calendars:
+        expected = [(epoch(s), epoch(e)) for s, e in service.busy_spans(id)]
+        # times are split at the 60 day window boundaries, so compare coverage:
+        assert merge(busy[id]) == merge(expected)
+        assert busy[id] == sorted(busy[id], key=lambda t: t[0])
+
+
+def test_a_calendar_that_cannot_be_read_is_an_error():
+    service = FakeService(random_calendars(2, START, END, events=5))
+    with pytest.raises(FreeBusyError, match="missing@example.com: notFound"):
+        query_freebusy(
+            lambda: service,
+            ["calendar-0@fake", "missing@example.com"],
+            START,
+            END,
+            "UTC",
+        )
+
+
+@pytest.mark.parametrize(
+    "reason, attempts", [("rateLimitExceeded", 3), ("forbidden", 1), (None, 1)]
+)
+def test_only_rate_limited_403s_are_retried(reason, attempts):
+    calls = []
+
+    def forbidden():
+        calls.append(1)
+        raise FakeHttpError(403, "no", reason)
+
+    with pytest.raises(FakeHttpError):
+        with_retries(forbidden, retries=2, backoff=0)
+    assert len(calls) == attempts
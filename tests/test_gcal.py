@@ -0,0 +1,29 @@
+import pytest
+
+import gcal
+
+
+@pytest.mark.parametrize("expr", ["(primary |", "primary & & workhours", "~"])
+def test_an_invalid_expression_is_a_usage_error(expr, capsys):
+    with pytest.raises(SystemExit) as exit:
+        gcal.configure(["available", "--expr", expr])
+    assert exit.value.code == 2
+    assert "invalid --expr" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("format", ["text", "jsonl"])
+def test_the_agenda_is_shown_in_the_output_timezone(format, monkeypatch, capsys):
+    events = [
+        {"start": {"date": "2020-03-02"}, "summary": "Offsite"},
+        {"start": {"dateTime": "2020-03-02T09:00:00-08:00"}, "summary": "Standup"},
+    ]
+    monkeypatch.setattr(gcal, "agenda_events", lambda calendars: iter(events))
+    monkeypatch.setattr(gcal, "OUTPUT_TIMEZONE", "Europe/Paris")
+    monkeypatch.setattr(gcal, "args", gcal.parser.parse_args(["agenda"]))
+    monkeypatch.setattr(gcal.args, "format", format)
+    gcal.agenda()
+    out = capsys.readouterr().out
+    if format == "text":
+        assert out == "2020-03-02 12:00 AM Offsite\n2020-03-02 6:00 PM Standup\n"
+    else:
+        assert '"start": "2020-03-02T18:00:00+01:00"' in out.splitlines()[1]
@@ -0,0 +1,166 @@
+import itertools
+import random
+
+import arrow
+import icalendar
+import pytest
+
+from src.filters import EventFilter
+from src.ics import Recurrence, get_ics_calendar_events
+
+
+def vevent(*lines):
+    return icalendar.Event.from_ical(
+        "\r\n".join(("BEGIN:VEVENT",) + lines + ("END:VEVENT", ""))
+    )
+
+
+def random_rule(rng):
+    freq = rng.choice(["DAILY", "WEEKLY", "HOURLY", "MONTHLY"])
+    parts = ["FREQ=" + freq, "INTERVAL=%d" % rng.randint(1, 3)]
+    if freq == "WEEKLY" and rng.random() < 0.5:
+        parts.append("BYDAY=" + ",".join(rng.sample(["MO", "TU", "WE", "TH", "FR"], 2)))
+    if freq == "DAILY" and rng.random() < 0.3:
+        parts.append("BYHOUR=9,15")
+    ending = rng.random()
+    if ending < 0.4:
+        parts.append("COUNT=%d" % rng.randint(1, 5000))
+    elif ending < 0.7:
+        parts.append("UNTIL=%04d0601T000000Z" % rng.randint(2005, 2022))
+    return ";".join(parts)
+
+
+def test_rebased_rules_give_the_same_occurrences(monkeypatch):
+    rng = random.Random(3)
+    cases = []
+    for _ in range(150):
+        start = arrow.get("2000-01-01").shift(hours=rng.randrange(20 * 365 * 24))
+        dtstart = start.format("YYYYMMDDTHHmmss")
+        if rng.random() < 0.5:
+            dtstart = ";TZID=America/New_York:" + dtstart
+        else:
+            dtstart = ":" + dtstart + "Z"
+        event = vevent(
+            "UID:x", "DTSTART" + dtstart, "DURATION:PT45M", "RRULE:" + random_rule(rng)
+        )
+        window = arrow.get("2019-01-01").shift(hours=rng.randrange(3 * 365 * 24))
+        cases.append((event, window, window.shift(days=rng.randint(1, 10))))
+
+    def occurrences():
+        return [
+            [occ[1:] for occ in Recurrence(event).between(start, end)]
+            for event, start, end in cases
+        ]
+
+    rebased = occurrences()
+    monkeypatch.setattr(
+        Recurrence, "rebased", lambda self, rule, lower: (rule, self.dtstart)
+    )
+    assert rebased == occurrences()
+    assert any(rebased)
+
+
+def test_a_long_running_rule_starts_near_the_window():
+    recurrence = Recurrence(
+        vevent(
+            "UID:x",
+            "DTSTART:20000101T090000Z",
+            "DTEND:20000101T100000Z",
+            "RRULE:FREQ=DAILY",
+        )
+    )
+    lower = arrow.get("2026-01-01").naive
+    before = itertools.takewhile(lambda time: time < lower, recurrence.rules(lower))
+    assert len(list(before)) <= 1
+    window = list(recurrence.between(arrow.get("2026-01-01"), arrow.get("2026-01-05")))
+    assert len(window) == 4
+
+
+@pytest.mark.parametrize("count, expected", [(9497, 0), (9499, 2), (9600, 4)])
+def test_count_is_kept_when_rebased(count, expected):
+    # a daily rule from 2000-01-01 reaches 2026-01-01 with its 9498th occurrence:
+    recurrence = Recurrence(
+        vevent(
+            "UID:x",
+            "DTSTART:20000101T090000Z",
+            "DTEND:20000101T100000Z",
+            "RRULE:FREQ=DAILY;COUNT=%d" % count,
+        )
+    )
+    window = list(recurrence.between(arrow.get("2026-01-01"), arrow.get("2026-01-05")))
+    assert len(window) == expected
+
+
+def test_events_with_a_duration_are_not_dropped_before_parsing(tmp_path):
+    path = tmp_path / "long.ics"
+    path.write_text(
+        "BEGIN:VCALENDAR\r\n"
+        "BEGIN:VEVENT\r\nUID:covers\r\nDTSTART:20200225T090000Z\r\n"
+        "DURATION:P10D\r\nEND:VEVENT\r\n"
+        "BEGIN:VEVENT\r\nUID:before\r\nDTSTART:20200201T090000Z\r\n"
+        "DURATION:PT1H\r\nEND:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+    events = get_ics_calendar_events(
+        str(path), arrow.get("2020-03-01"), arrow.get("2020-03-03")
+    )
+    assert [event["id"] for event in events] == ["covers"]
+
+
+def test_alarm_properties_are_not_the_event_s(tmp_path):
+    path = tmp_path / "alarm.ics"
+    path.write_text(
+        "BEGIN:VCALENDAR\r\n"
+        "BEGIN:VEVENT\r\nUID:meeting\r\nDTSTART:20200225T090000Z\r\n"
+        "BEGIN:VALARM\r\nACTION:DISPLAY\r\nTRIGGER:-PT15M\r\nDURATION:PT5M\r\n"
+        "REPEAT:2\r\nDESCRIPTION:Lunch\r\n  reminder\r\nEND:VALARM\r\n"
+        "DURATION:P10D\r\nSUMMARY:Planning\r\nEND:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+    events = list(
+        get_ics_calendar_events(
+            str(path),
+            arrow.get("2020-03-01"),
+            arrow.get("2020-03-03"),
+            EventFilter(search="planning", ignore=["Lunch"]),
+        )
+    )
+    assert [event["id"] for event in events] == ["meeting"]
+    assert events[0]["end"]["dateTime"] == arrow.get("2020-03-06T09:00:00")
+
+
+def test_events_far_from_the_window_are_not_parsed(tmp_path, monkeypatch):
+    path = tmp_path / "history.ics"
+    path.write_text(
+        "BEGIN:VCALENDAR\r\n"
+        "BEGIN:VEVENT\r\nUID:old\r\nSUMMARY:old\r\nDTSTART:20080107T090000Z\r\n"
+        "DURATION:PT1H\r\nRRULE:FREQ=WEEKLY;UNTIL=20100101T000000Z\r\nEND:VEVENT\r\n"
+        "BEGIN:VEVENT\r\nUID:standup\r\nSUMMARY:standup\r\n"
+        "DTSTART:20200106T090000Z\r\nDURATION:PT15M\r\nRRULE:FREQ=DAILY\r\n"
+        "END:VEVENT\r\n"
+        "BEGIN:VEVENT\r\nUID:standup\r\nSUMMARY:moved out\r\n"
+        "RECURRENCE-ID:20200302T090000Z\r\nDTSTART:20190101T090000Z\r\n"
+        "DURATION:PT15M\r\nEND:VEVENT\r\n"
+        "BEGIN:VEVENT\r\nUID:standup\r\nSUMMARY:moved in\r\n"
+        "RECURRENCE-ID:20200110T090000Z\r\nDTSTART:20200303T150000Z\r\n"
+        "DURATION:PT15M\r\nEND:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+    parsed = []
+    from_ical = icalendar.Event.from_ical
+
+    def counting_from_ical(text, *args, **kwargs):
+        event = from_ical(text, *args, **kwargs)
+        if "SUMMARY" in event:
+            parsed.append(str(event["SUMMARY"]))
+        return event
+
+    monkeypatch.setattr(icalendar.Event, "from_ical", counting_from_ical)
+    events = get_ics_calendar_events(
+        str(path), arrow.get("2020-03-02"), arrow.get("2020-03-04")
+    )
+    assert [(event["summary"], event["start"]["dateTime"]) for event in events] == [
+        ("moved in", arrow.get("2020-03-03T15:00:00")),
+        ("standup", arrow.get("2020-03-03T09:00:00")),
+    ]
+    assert sorted(parsed) == ["moved in", "standup"]
@@ -0,0 +1,119 @@
+import random
+
+from src.incremental import Availability
+from src.utils import Event, Interval, events_flatten
+
+LO, HI = 1000, 5000
+
+
+def interval(pairs):
+    events = sorted((Event(s, e) for s, e in pairs if s < e), key=lambda ev: ev.s)
+    return Interval(LO, events, HI)
+
+
+def expected(busy, free):
+    """
+    The availability, computed from scratch with Interval.
+    """
+
+    def flat(pairs):
+        return Interval(LO, events_flatten(interval(pairs).events), HI)
+
+    busy_in_any = Interval.union_all(
+        [Interval(LO, [], HI)] + [flat(pairs) for pairs in busy.values()]
+    )
+    free_in_all = Interval.intersect_all(
+        [Interval(LO, [Event(LO, HI)], HI)] + [flat(pairs) for pairs in free.values()]
+    )
+    return [(ev.s, ev.e) for ev in (~busy_in_any & free_in_all).events]
+
+
+def random_events(rng):
+    events = []
+    for _ in range(rng.randint(0, 12)):
+        start = rng.randrange(800, 5200, 50)
+        events.append((start, start + rng.randrange(50, 900, 50)))
+    return events
+
+
+def cells(pairs):
+    return set(t for s, e in pairs for t in range(s, e, 50))
+
+
+def test_removing_one_of_two_overlapping_events():
+    availability = Availability(
+        0, 100, {"a": Interval(0, [Event(0, 10), Event(5, 15)], 100)}, {}
+    )
+    assert availability.update("a", removed=[(0, 10)]) == [(0, 5, True)]
+    assert list(zip(*availability.index())) == [(0, 5), (15, 100)]
+
+
+def test_updates_match_recomputing():
+    rng = random.Random(1)
+    for trial in range(300):
+        busy = {"b%d" % i: random_events(rng) for i in range(rng.randint(0, 4))}
+        free = {"f%d" % i: random_events(rng) for i in range(rng.randint(0, 3))}
+        availability = Availability(
+            LO,
+            HI,
+            {id: interval(pairs) for id, pairs in busy.items()},
+            {id: interval(pairs) for id, pairs in free.items()},
+        )
+        available = list(zip(*availability.index()))
+        assert available == expected(busy, free), trial
+        current = cells(available)
+        for step in range(15):
+            calendars = dict(busy, **free)
+            if not calendars:
+                break
+            id = rng.choice(sorted(calendars))
+            if rng.random() < 0.3:
+                new = random_events(rng)
+                changes = availability.replace(id, interval(new))
+                calendars[id][:] = new
+            else:
+                removed = rng.sample(calendars[id], rng.randint(0, len(calendars[id])))
+                added = random_events(rng)[:3]
+                changes = availability.update(id, added=added, removed=removed)
+                for event in removed:
+                    calendars[id].remove(event)
+                calendars[id].extend(added)
+            assert list(zip(*availability.index())) == expected(busy, free), trial
+            # the changes reported take the old availability to the new one:
+            for s, e, free_now in changes:
+                for t in range(s, e, 50):
+                    assert (t in current) != free_now
+                    (current.add if free_now else current.discard)(t)
+            assert current == cells(expected(busy, free)), trial
+
+
+def test_a_calendar_both_busy_and_free():
+    both = interval([(1000, 2000), (3000, 4000)])
+    availability = Availability(LO, HI, {"a": both}, {"a": both})
+    assert availability.index() == ([], [])
+    assert availability.update("a", removed=[(3000, 4000)]) == []
+    assert availability.index() == ([], [])
+
+
+def test_updating_with_the_difference_of_busy_times():
+    from src.incremental import difference, merge
+
+    rng = random.Random(2)
+    for trial in range(100):
+        busy = {"b": merge(random_events(rng)), "c": merge(random_events(rng))}
+        free = {"f": merge(random_events(rng))}
+        availability = Availability(
+            LO,
+            HI,
+            {id: interval(pairs) for id, pairs in busy.items()},
+            {id: interval(pairs) for id, pairs in free.items()},
+        )
+        for step in range(10):
+            id = rng.choice(["b", "c", "f"])
+            calendars = dict(busy, **free)
+            new = merge(random_events(rng))
+            availability.update(
+                id, difference(new, calendars[id]), difference(calendars[id], new)
+            )
+            (busy if id in busy else free)[id] = new
+            assert list(zip(*availability.index())) == expected(busy, free), trial
@@ -0,0 +1,104 @@
+import csv
+import datetime
+import io
+import json
+
+import arrow
+import icalendar
+import pytest
+
+from src.output import Writer, write_interval
+from src.utils import Event, Interval, epoch
+
+TZ = "America/New_York"
+# across the end of daylight saving time:
+SLOTS = [
+    Event(epoch(arrow.get(s)), epoch(arrow.get(e)))
+    for s, e in [
+        ("2020-10-31T13:00:00", "2020-10-31T14:30:00"),
+        ("2020-11-02T15:00:00", "2020-11-03T01:00:00"),
+    ]
+]
+AVAILABLE = Interval(SLOTS[0].s, SLOTS, SLOTS[-1].e)
+
+
+def written(format, interval=AVAILABLE, tz=TZ):
+    out = io.StringIO()
+    count = write_interval(interval, out, format, tz)
+    assert count == len(interval.events)
+    return out.getvalue()
+
+
+def test_text_matches_arrow():
+    lines = written("text").splitlines()
+    assert lines == [
+        "October 31 @ 9:00am-10:30am " + TZ,
+        "November 02 @ 10:00am-8:00pm " + TZ,
+    ]
+    for ev, line in zip(SLOTS, lines):
+        left = arrow.get(ev.s).to(TZ)
+        right = arrow.get(ev.e).to(TZ)
+        assert line.startswith(left.format("MMMM DD @ h:mma"))
+        assert line.endswith(right.format("h:mma") + " " + TZ)
+
+
+@pytest.mark.parametrize("interval", [AVAILABLE, Interval(0, [], 1)])
+def test_json_is_one_array(interval):
+    records = json.loads(written("json", interval))
+    assert records == [
+        {
+            "start": arrow.get(ev.s).to(TZ).isoformat(),
+            "end": arrow.get(ev.e).to(TZ).isoformat(),
+        }
+        for ev in interval.events
+    ]
+
+
+def test_jsonl_is_one_object_per_line():
+    lines = written("jsonl").splitlines()
+    assert [json.loads(line)["start"] for line in lines] == [
+        "2020-10-31T09:00:00-04:00",
+        "2020-11-02T10:00:00-05:00",
+    ]
+
+
+def test_csv_has_a_header():
+    rows = list(csv.reader(io.StringIO(written("csv"))))
+    assert rows[0] == ["start", "end", "summary"]
+    assert rows[2] == ["2020-11-02T10:00:00-05:00", "2020-11-02T20:00:00-05:00", ""]
+
+
+def test_ics_is_a_calendar_in_utc():
+    calendar = icalendar.Calendar.from_ical(written("ics"))
+    events = calendar.walk("VEVENT")
+    assert [ev.decoded("dtstart") for ev in events] == [
+        arrow.get(ev.s).datetime for ev in SLOTS
+    ]
+    assert len(set(str(ev["uid"]) for ev in events)) == len(SLOTS)
+    assert all(str(ev["summary"]) == "Available" for ev in events)
+
+
+def test_summaries_and_all_day_events():
+    out = io.StringIO()
+    writer = Writer(out, "ics", TZ)
+    day = datetime.date(2020, 12, 25)
+    writer.write(day, day + datetime.timedelta(days=1), "Off; all, day")
+    writer.close()
+    event = icalendar.Calendar.from_ical(out.getvalue()).walk("VEVENT")[0]
+    assert event.decoded("dtstart") == datetime.date(2020, 12, 25)
+    assert str(event["summary"]) == "Off; all, day"
+
+
+def test_lines_are_written_in_chunks():
+    out = io.StringIO()
+    writer = Writer(out, "jsonl", TZ, flush_every=2)
+    writer.write(SLOTS[0].s, SLOTS[0].e)
+    assert out.getvalue() == ""
+    writer.write(SLOTS[1].s, SLOTS[1].e)
+    assert len(out.getvalue().splitlines()) == 2
+    assert writer.close() == 2
+
+
+def test_unknown_formats_are_refused():
+    with pytest.raises(ValueError):
+        Writer(io.StringIO(), "xml", TZ)
@@ -0,0 +1,57 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import arrow
+import pytest
+
+from src import server
+
+
+@pytest.fixture
+def url():
+    def when(params):
+        return {"when": arrow.get(params["t"][0]).isoformat()}
+
+    httpd = server.make_server({"/when": when}, port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield "http://%s:%d" % httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_queries_are_answered(url):
+    assert get(url + "/when?t=2020-03-01") == (
+        200,
+        {"when": "2020-03-01T00:00:00+00:00"},
+    )
+    assert get(url + "/health")[1]["computed"] == 1
+
+
+def test_bad_queries_are_client_errors(url):
+    assert get(url + "/when?t=next-tuesday")[0] == 400
+    assert get(url + "/when")[0] == 400
+    assert get(url + "/never")[0] == 404
+
+
+def test_results_are_shared_then_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "time", lambda: now[0])
+    coalescer = server.Coalescer(ttl=30, workers=1)
+    for key in range(100):
+        assert coalescer.run(key, lambda: key) == key
+    assert coalescer.run(0, lambda: "again") == 0
+    assert (coalescer.computed, coalescer.coalesced) == (100, 1)
+    now[0] += 31
+    assert coalescer.run(0, lambda: "again") == "again"
+    # the other results expired too, and are gone rather than kept forever:
+    assert list(coalescer.results) == [0]
@@ -0,0 +1,17 @@
+import configparser
+
+import settings
+
+
+def test_settings_read_after_a_calendar_is_set_are_up_to_date(tmp_path, monkeypatch):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.add_section("Calendars")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "_parser", parser)
+    # (and forget the values computed from it by the end of the test)
+    monkeypatch.setitem(vars(settings), "calendars_imported", None)
+    monkeypatch.delitem(vars(settings), "calendars_imported")
+    assert settings.calendars_imported == 0
+    settings.set_calendar("team", "team@example.com")
+    assert settings.calendars_imported == 1
+    assert settings.get_imported_calendar_by_name("Team") == "team@example.com"
@@ -0,0 +1,74 @@
+import arrow
+import pytest
+
+import gcal
+import settings
+from src import slots
+from src.fake import FakeService
+from src.freebusy import query_freebusy
+from src.utils import Interval, epoch
+
+START, END = arrow.get("2020-01-02T09:00:00"), arrow.get("2020-01-02T17:00:00")
+
+
+def meeting(start, end):
+    t = "2020-01-02T%s:00+00:00"
+    return {"id": start, "start": {"dateTime": t % start}, "end": {"dateTime": t % end}}
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    """
+    Busy times are read from a fake primary calendar.
+    """
+    events = []
+    service = FakeService({"primary": {"summary": "me", "events": events}})
+    monkeypatch.setattr(
+        gcal,
+        "query_freebusy",
+        lambda get_service, *args: query_freebusy(lambda: service, *args),
+    )
+    monkeypatch.setattr(gcal, "EVENT_FILTER", None)
+    monkeypatch.setattr(gcal, "QUERY_TIMEZONE", "UTC")
+    monkeypatch.setattr(gcal, "BackendInterval", Interval)
+    monkeypatch.setattr(gcal, "cache", None)
+    monkeypatch.setattr(settings, "get_imported_calendar_by_name", lambda name: name)
+    return events
+
+
+def find(duration, count, buffer, expr=None):
+    def available_between(start, end):
+        return gcal.compute_available(["primary"], [], expr, start, end, buffer=buffer)
+
+    found = slots.find_slots(
+        slots.free_segments(available_between, START, END), duration, count
+    )
+    return [
+        (arrow.Arrow.utcfromtimestamp(s), arrow.Arrow.utcfromtimestamp(e))
+        for s, e in found
+    ]
+
+
+@pytest.mark.parametrize("expr", [None, "~primary"])
+def test_buffers_are_kept_around_meetings_only(calendar, expr):
+    calendar.append(meeting("10:00", "11:00"))
+
+    def at(time):
+        return arrow.get("2020-01-02T%s:00" % time)
+
+    # a slot may start right at the start of the window:
+    assert find(30 * 60, 3, 10 * 60, expr) == [
+        (at("09:00"), at("09:30")),
+        (at("11:10"), at("11:40")),
+        (at("11:40"), at("12:10")),
+    ]
+
+
+def test_buffers_are_kept_from_meetings_outside_the_window(calendar):
+    calendar.append(meeting("10:05", "11:00"))
+    available = gcal.compute_available(
+        ["primary"], [], None, START, START.shift(hours=1), buffer=10 * 60
+    )
+    assert [(ev.s, ev.e) for ev in available.events] == [
+        (epoch(START), epoch("2020-01-02T09:55:00+00:00"))
+    ]
@@ -0,0 +1,100 @@
+import arrow
+import pytest
+
+import settings
+from src import snapshot
+from src.utils import epoch
+
+ICS = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:standup
+DTSTART:20200106T090000Z
+DURATION:PT15M
+RRULE:FREQ=DAILY
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture
+def calendar(tmp_path, monkeypatch):
+    # (settings loads lazily, so set its value without reading the old one)
+    monkeypatch.setitem(vars(settings), "CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    path = tmp_path / "team.ics"
+    path.write_text(ICS.replace("\n", "\r\n"))
+    yield str(path)
+    snapshot.close_snapshots()
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    windows = []
+    build = snapshot.build_snapshot
+
+    def counting_build(calendar, start, end, tz="UTC"):
+        windows.append((start, end))
+        return build(calendar, start, end, tz)
+
+    monkeypatch.setattr(snapshot, "build_snapshot", counting_build)
+    return windows
+
+
+def test_a_missing_snapshot_is_built_for_the_usual_span(calendar, builds):
+    now = arrow.utcnow()
+    start = now.floor("day")
+    for days in range(0, 70, 7):
+        window = start.shift(days=days), start.shift(days=days + 7)
+        busy = snapshot.get_snapshot_interval(calendar, *window)
+        assert len(busy.events) == 7
+    # one parse serves the following weeks too:
+    assert len(builds) == 1
+    lo, hi = builds[0]
+    assert lo <= now.shift(days=-snapshot.BUILD_PAST_DAYS + 1)
+    assert hi >= now.shift(days=snapshot.BUILD_FUTURE_DAYS - 1)
+
+
+def test_a_snapshot_grows_to_cover_a_window_outside_it(calendar, builds):
+    snapshot.import_snapshot(calendar)
+    old = arrow.get("2020-01-01"), arrow.get("2020-02-01")
+    busy = snapshot.get_snapshot_interval(calendar, *old)
+    assert [ev.s for ev in busy.events][:2] == [
+        epoch("2020-01-06T09:00:00+00:00"),
+        epoch("2020-01-07T09:00:00+00:00"),
+    ]
+    assert len(builds) == 2
+    # and still covers the span it was imported with:
+    snapshot.get_snapshot_interval(
+        calendar, arrow.utcnow(), arrow.utcnow().shift(days=7)
+    )
+    assert len(builds) == 2
+
+
+def test_a_snapshot_stays_mapped_until_it_is_replaced(calendar):
+    week = arrow.utcnow(), arrow.utcnow().shift(days=7)
+    snapshot.get_snapshot_interval(calendar, *week)
+    (first,) = snapshot._open.values()
+    snapshot.get_snapshot_interval(calendar, *week)
+    assert list(snapshot._open.values()) == [first]
+    # a rebuild for another timezone unmaps the old snapshot:
+    snapshot.get_snapshot_interval(calendar, *week, tz="Europe/London")
+    (second,) = snapshot._open.values()
+    assert second is not first and first.map.closed
+    snapshot.close_snapshots()
+    assert second.map.closed and not snapshot._open
+
+
+def test_an_out_of_date_snapshot_is_unmapped(calendar, monkeypatch):
+    snapshot.import_snapshot(calendar)
+    snapshot.close_snapshots()
+    with open(calendar, "a") as f:
+        f.write("\r\n")
+    closed = []
+    close = snapshot.Snapshot.close
+
+    def counting_close(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(snapshot.Snapshot, "close", counting_close)
+    assert snapshot.load_snapshot(calendar) is None
+    assert len(closed) == 1 and closed[0].map.closed
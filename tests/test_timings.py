@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from src import timings
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(timings, "_phases", {})
+    monkeypatch.setattr(timings, "_hooks", [])
+    monkeypatch.setattr(timings, "_began", None)
+    timings.enable()
+    yield
+    timings.disable()
+
+
+def test_disabled_phases_record_nothing(monkeypatch):
+    monkeypatch.setattr(timings, "_phases", {})
+    assert timings.phase("api.freebusy") is timings.NULL_PHASE
+    with timings.phase("api.freebusy") as p:
+        p.count(3)
+    assert timings.report()["phases"] == {}
+
+
+def test_phases_accumulate(enabled):
+    for events in (2, 5):
+        with timings.phase("api.freebusy") as p:
+            p.count(events)
+
+    @timings.timed("algebra.or", count=len)
+    def union(a, b):
+        return a + b
+
+    assert union([1], [2, 3]) == [1, 2, 3]
+    phases = timings.report()["phases"]
+    assert phases["api.freebusy"]["calls"] == 2
+    assert phases["api.freebusy"]["events"] == 7
+    assert phases["algebra.or"]["events"] == 3
+    assert all(p["seconds"] >= 0 for p in phases.values())
+
+
+def test_hooks_see_every_phase(enabled):
+    seen = []
+
+    def hook(name, seconds, events):
+        seen.append((name, events))
+
+    timings.add_hook(hook)
+    with timings.phase("ics.parse") as p:
+        p.count(4)
+    timings.remove_hook(hook)
+    with timings.phase("ics.parse"):
+        pass
+    assert seen == [("ics.parse", 4)]
+
+
+def test_failing_phases_are_still_timed(enabled):
+    with pytest.raises(ValueError):
+        with timings.phase("api.events.list"):
+            raise ValueError
+    assert timings.report()["phases"]["api.events.list"]["calls"] == 1
+
+
+def test_reports_are_written_as_json(enabled, tmp_path):
+    with timings.phase("filter.events") as p:
+        p.count(1)
+    path = tmp_path / "timings.json"
+    timings.write_report(str(path))
+    report = json.loads(path.read_text())
+    assert report["phases"]["filter.events"]["calls"] == 1
+    assert report["phases"]["filter.events"]["events"] == 1
+    assert report["total_seconds"] >= 0
@@ -0,0 +1,65 @@
+import datetime
+
+import pytest
+import pytz
+
+from src.tz import DAY, EPOCH, date, get_zone, parse_epoch, weekday
+
+ZONES = [
+    "America/New_York",
+    "Europe/London",
+    "Australia/Lord_Howe",  # moves its clocks by half an hour
+    "Asia/Kolkata",
+    "UTC",
+]
+# every 75 minutes (a different time of day each day) through 2020, and the
+# start of 1970:
+TIMES = list(range(1577836800, 1609459200, 4500)) + list(range(0, 30 * DAY, 4500))
+
+
+def pytz_local(tz, time):
+    local = pytz.utc.localize(EPOCH + datetime.timedelta(seconds=time)).astimezone(tz)
+    return int((local.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+def pytz_utc(tz, local, is_dst):
+    wall = EPOCH + datetime.timedelta(seconds=local)
+    utc = tz.localize(wall, is_dst=is_dst).astimezone(pytz.utc)
+    return int((utc.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+@pytest.mark.parametrize("name", ZONES)
+def test_zones_agree_with_pytz(name):
+    zone, tz = get_zone(name), pytz.timezone(name)
+    for time in TIMES:
+        assert zone.local(time) == pytz_local(tz, time)
+        for is_dst in (False, True):
+            assert zone.utc(time, is_dst) == pytz_utc(tz, time, is_dst)
+
+
+def test_zones_are_cached():
+    assert get_zone("Europe/London") is get_zone("Europe/London")
+
+
+def test_unknown_zones_are_value_errors():
+    with pytest.raises(ValueError, match="unknown timezone"):
+        get_zone("Mars/Olympus_Mons")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "2020-03-08T07:30:00Z",
+        "2020-03-08T02:30:00-05:00",
+        "2020-03-08T08:30:00.000+01:00",
+        "2020-03-08T07:30:00",
+    ],
+)
+def test_api_timestamps_are_parsed(text):
+    assert parse_epoch(text) == 1583652600
+
+
+def test_days_are_counted_from_the_epoch():
+    assert date(0) == datetime.date(1970, 1, 1)
+    assert weekday(0) == 3  # a Thursday
+    assert all(weekday(day) == date(day).weekday() for day in range(-10, 4000, 7))
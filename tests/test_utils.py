@@ -0,0 +1,139 @@
+import functools
+import itertools
+import operator
+import random
+
+import arrow
+import pytest
+
+import settings
+from src.bitset import BitsetInterval
+from src.utils import (
+    Event,
+    Interval,
+    cal_daily_event,
+    cal_weekends,
+    epoch,
+    events_complement,
+    events_flatten,
+    events_union,
+    iter_daily_events,
+)
+from src.vector import ArrayInterval
+
+START, END = arrow.get("2020-03-02T09:00:00"), arrow.get("2020-03-02T17:00:00")
+
+
+def at(hours):
+    return START.shift(hours=hours)
+
+
+@pytest.fixture(params=[Interval, ArrayInterval, BitsetInterval])
+def meetings(request):
+    events = [Event(epoch(at(1)), epoch(at(2))), Event(epoch(at(7)), epoch(END))]
+    return request.param(START, events, END)
+
+
+def test_next_free_after_is_an_arrow_within_the_interval(meetings):
+    for time, free in [
+        (at(0.5), at(0.5)),
+        (at(1.5), at(2)),
+        (START.shift(days=-1), START),
+        (epoch(at(3)), at(3)),
+        (at(7.5), None),
+        (END.shift(hours=1), None),
+    ]:
+        found = meetings.next_free_after(time)
+        assert found == free
+        assert found is None or isinstance(found, arrow.Arrow)
+
+
+def cells(events):
+    return set(t for ev in events for t in range(ev.s, ev.e))
+
+
+def random_events(rng, count, lo=0, hi=200):
+    events = []
+    for _ in range(count):
+        s = rng.randrange(lo, hi)
+        events.append(Event(s, s + rng.randint(1, 30)))
+    return sorted(events, key=lambda ev: ev.s)
+
+
+def test_sweeps_cover_what_the_events_do():
+    rng = random.Random(1)
+    for _ in range(300):
+        first = random_events(rng, rng.randint(0, 15))
+        second = random_events(rng, rng.randint(0, 15))
+        flat = events_flatten(first)
+        assert cells(flat) == cells(first)
+        # flattened events are ordered, and neither overlap nor touch:
+        assert all(a.e < b.s for a, b in zip(flat, flat[1:]))
+        union = events_union(flat, events_flatten(second))
+        assert cells(union) == cells(first) | cells(second)
+        gaps = events_complement(50, flat, 150)
+        assert cells(gaps) == set(range(50, 150)) - cells(first)
+
+
+def test_long_calendars_do_not_recurse():
+    events = [Event(2 * n, 2 * n + 1) for n in range(100000)]
+    assert len(events_flatten(events)) == len(events)
+    assert len(events_complement(0, events, 200000)) == len(events)
+
+
+def test_n_ary_algebra_matches_the_coverage():
+    rng = random.Random(3)
+    for _ in range(200):
+        cals = [
+            Interval(0, events_flatten(random_events(rng, rng.randint(0, 10))), 200)
+            for _ in range(rng.randint(1, 5))
+        ]
+        busy_any = set().union(*[cells(cal.events) for cal in cals])
+        busy_all = set.intersection(*[cells(cal.events) for cal in cals])
+        union = Interval.union_all(cals)
+        assert cells(union.events) == busy_any
+        pairwise = functools.reduce(operator.or_, cals)
+        assert cells(union.events) == cells(pairwise.events)
+        # the intersection is also clipped to the window:
+        busy_all &= set(range(200))
+        assert cells(Interval.intersect_all(cals).events) == busy_all
+
+
+def test_n_ary_algebra_keeps_adjacent_events_apart():
+    first = Interval(0, [Event(0, 10)], 100)
+    second = Interval(0, [Event(10, 20)], 100)
+    assert Interval.intersect_all([first, second]).events == []
+    assert [(ev.s, ev.e) for ev in Interval.union_all([first, second]).events] == [
+        (0, 20)
+    ]
+
+
+def local(t, tz):
+    return arrow.Arrow.utcfromtimestamp(t).to(tz)
+
+
+def test_daily_events_keep_their_local_time_across_dst():
+    start = arrow.get("2020-03-01T00:00:00-05:00")
+    end = arrow.get("2020-11-08T00:00:00-05:00")
+    workhours = cal_daily_event(start, end, 9, 0, 17, 30, "America/New_York")
+    assert len(workhours.events) == (end - start).days
+    for ev in workhours.events:
+        assert local(ev.s, "America/New_York").format("HH:mm") == "09:00"
+        assert local(ev.e, "America/New_York").format("HH:mm") == "17:30"
+
+
+def test_weekends_run_from_local_midnight_to_midnight(monkeypatch):
+    monkeypatch.setitem(vars(settings), "weekend_num", [5, 6])
+    start = arrow.get("2020-10-19T00:00:00+01:00")
+    end = arrow.get("2020-11-09T00:00:00+00:00")
+    weekends = cal_weekends(start, end, "Europe/London")
+    assert [ev.e - ev.s for ev in weekends.events] == [49 * 3600, 48 * 3600, 48 * 3600]
+    for ev in weekends.events:
+        assert local(ev.s, "Europe/London").format("ddd HH:mm") == "Sat 00:00"
+        assert local(ev.e, "Europe/London").format("ddd HH:mm") == "Mon 00:00"
+
+
+def test_daily_events_can_be_generated_for_years():
+    start = arrow.get("2000-01-01T00:00:00+00:00")
+    events = iter_daily_events(start, None, 9, 0, 17, 0, "Asia/Tokyo")
+    assert len(list(itertools.islice(events, 20000))) == 20000
@@ -0,0 +1,51 @@
+import random
+
+import arrow
+import numpy as np
+
+from src.utils import Event, Interval, epoch
+from src.vector import ArrayInterval, normalize
+
+
+def test_empty_events_are_dropped():
+    starts, ends = normalize([50, 10, 20, 30], [50, 20, 20, 40])
+    assert starts.tolist() == [10, 30]
+    assert ends.tolist() == [20, 40]
+    starts, ends = normalize([5], [5])
+    assert starts.dtype == ends.dtype == np.int64
+    assert (len(starts), len(ends)) == (0, 0)
+
+
+def test_availability_is_that_of_the_list_backend():
+    rng = random.Random(2)
+    start, end = arrow.get("2020-03-01"), arrow.get("2020-03-08")
+    lo, hi = epoch(start), epoch(end)
+
+    def random_interval():
+        events = []
+        for _ in range(rng.randint(0, 30)):
+            s = rng.randrange(lo - 3600, hi)
+            events.append(Event(s, s + rng.choice([0, 60, 900, 3600, 86400])))
+        return sorted(events, key=lambda ev: ev.s)
+
+    for _ in range(200):
+        calendars = [random_interval() for _ in range(4)]
+        results = []
+        for backend in (Interval, ArrayInterval):
+            busy = [backend(start, events, end) for events in calendars[:3]]
+            free = backend(start, calendars[3], end)
+            starts, ends = (~backend.union_all(busy) & free).index()
+            results.append([(int(s), int(e)) for s, e in zip(starts, ends)])
+        assert results[1] == results[0]
+
+
+def test_slot_queries_take_numpy_times():
+    start, end = arrow.get("2020-03-02T09:00:00"), arrow.get("2020-03-02T17:00:00")
+    meeting = Event(arrow.get("2020-03-02T10:00:00"), arrow.get("2020-03-02T11:00:00"))
+    busy = ArrayInterval(start, [meeting], end)
+    starts, ends = busy.index()
+    assert isinstance(starts[0], np.int64)
+    assert epoch(starts[0]) == meeting.s and epoch(np.float64(meeting.e)) == meeting.e
+    assert not busy.is_free(starts[0])
+    assert busy.is_free(ends[0])
+    assert busy.next_free_after(starts[0]) == arrow.get("2020-03-02T11:00:00")